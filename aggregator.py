@@ -0,0 +1,108 @@
+"""Trade to bar aggregation
+
+A TradeAggregator turns trade prints into time bars of several intervals plus volume and dollar bars, each kept
+in its own MarketDataManager so the usual indicators and check_signal run on them. Every trade costs O(1) per
+bar series.
+"""
+from ordermanager import MarketDataManager
+from barstore import BAR_CAPACITY
+
+# Seconds per time bar series kept by default
+TIME_INTERVALS = (1, 10, 60, 300)
+
+
+class TimeBars:
+    """Bars of a fixed number of seconds"""
+    def __init__(self, seconds, mdb):
+        self.seconds = seconds
+        self.mdb = mdb
+
+    def add(self, timestamp, px, qty):
+        self.mdb.apply_trade(timestamp, px, qty, self.seconds)
+
+
+class ThresholdBars:
+    """Bars closing once their volume (or traded value with dollar=True) reaches threshold
+
+    The trade crossing the threshold is the last one of its bar, the next trade starts a new bar.
+    """
+    def __init__(self, threshold, mdb, dollar=False):
+        self.threshold = threshold
+        self.mdb = mdb
+        self.dollar = dollar
+        self.filled = None
+
+    def add(self, timestamp, px, qty):
+        bars = self.mdb.bars
+        if self.filled is None:
+            bars.append_values(timestamp, px, px, px, px, qty)
+            self.filled = 0.0
+        else:
+            columns = bars.columns
+            slot = (len(bars) - 1) % bars.capacity
+            if px > columns['px_high'][slot]:
+                columns['px_high'][slot] = px
+            if px < columns['px_low'][slot]:
+                columns['px_low'][slot] = px
+            columns['px_close'][slot] = px
+            columns['volume'][slot] += qty
+            columns['end_time'][slot] = timestamp
+
+        self.filled += px * qty if self.dollar else qty
+        self.mdb.mark_dirty(len(bars) - 1)
+        if self.filled >= self.threshold:
+            self.mdb.finalize_last()
+            self.filled = None
+
+
+class TradeAggregator:
+    """Keeps time, volume and dollar bars up to date from one trade stream
+
+    managers maps each series to its MarketDataManager: the interval in seconds for time bars, 'volume' and
+    'dollar' for threshold bars. Trades with an id not above the last one seen are dropped, so overlapping
+    polls of a trades endpoint can be fed as they are.
+    """
+    def __init__(self, intervals=TIME_INTERVALS, volume=None, dollar=None, capacity=BAR_CAPACITY):
+        self.series = []
+        self.managers = {}
+        for seconds in intervals:
+            self._add_series(seconds, TimeBars(seconds, MarketDataManager(capacity)))
+        if volume:
+            self._add_series('volume', ThresholdBars(volume, MarketDataManager(capacity)))
+        if dollar:
+            self._add_series('dollar', ThresholdBars(dollar, MarketDataManager(capacity), dollar=True))
+        self.last_trade_id = None
+        self.trades = 0
+
+    def _add_series(self, key, series):
+        self.series.append(series)
+        self.managers[key] = series.mdb
+
+    def add_trade(self, ts, px, qty, trade_id=None):
+        """Add one trade, ts in ms. Returns False when the trade was already seen"""
+        if trade_id is not None:
+            if self.last_trade_id is not None and trade_id <= self.last_trade_id:
+                return False
+            self.last_trade_id = trade_id
+        timestamp = ts / 1000.0
+        for series in self.series:
+            series.add(timestamp, px, qty)
+        self.trades += 1
+        return True
+
+    def add_trades(self, trades):
+        """Add (ts, px, qty, trade_id) tuples in trade order, returns how many were new"""
+        added = 0
+        for ts, px, qty, trade_id in trades:
+            if self.add_trade(ts, px, qty, trade_id):
+                added += 1
+        return added
+
+    def add_binance_trades(self, trades):
+        """Add the result of BinanceRestful.get_trades"""
+        return self.add_trades((trade['time'], float(trade['price']), float(trade['qty']), trade['id'])
+                               for trade in trades)
+
+    def update_indicators(self):
+        for mdb in self.managers.values():
+            mdb.update_indicators()
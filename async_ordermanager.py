@@ -0,0 +1,154 @@
+import asyncio
+from datetime import datetime
+
+from cybexapi_async import AsyncCybexRestful, AsyncSignerConnector
+from ordermanager import OrderManager, OrderStatus
+
+MAX_IN_FLIGHT = 8
+
+
+class AsyncOrderManager(OrderManager):
+    """OrderManager with an asyncio order entry path
+
+    Each order is signed and sent as its own task, so many orders are signed and submitted at the same time.
+    At most max_in_flight sign-then-send chains run at once.
+    """
+    def __init__(self, account, assetPair, max_in_flight=MAX_IN_FLIGHT, signer=None, api_server=None,
+                 async_signer=None, async_api_server=None, **kwargs):
+        # kwargs are the OrderManager options: presign_cancels, delta_sync, archive, order_ttl, risk, ...
+        super().__init__(account, assetPair, signer, api_server, **kwargs)
+        self.async_signer = async_signer if async_signer is not None else AsyncSignerConnector()
+        self.async_api_server = async_api_server if async_api_server is not None else AsyncCybexRestful()
+        self.max_in_flight = max_in_flight
+        self._in_flight = None
+
+    def _slots(self):
+        # Created lazily so the semaphore belongs to the running loop
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self._in_flight
+
+    async def close(self):
+        await self.async_signer.close()
+        await self.async_api_server.close()
+
+    async def place_order_async(self, side, price, quantity, ttl=None, reserved=False):
+        quantity = round(quantity, 2)
+        price = round(price, 2)
+        # Same reserve, record, then send order as OrderManager.place_order
+        if not reserved:
+            with self.lock:
+                self._reserve(side, price, quantity)
+        async with self._slots():
+            try:
+                new_order_msg = await self.async_signer.prepare_order_message(self.assetPair, price, quantity,
+                                                                              side)
+            except Exception:
+                with self.lock:
+                    self._release(side, quantity)
+                raise
+            new_order = self.new_order_from_message(new_order_msg, side, price, quantity)
+            with self.lock:
+                self._release(side, quantity)
+                self.add_order(new_order, ttl)
+
+            print(datetime.now(), "try to", side, new_order.quantity, "at", new_order.price,
+                  "trx_id", new_order.trx_id)
+
+            try:
+                result = await self.async_api_server.send_transaction(new_order_msg)
+            except Exception:
+                self.remove_order(new_order.trx_id)
+                raise
+            print('send order result:', result)
+
+        self.order_accepted(new_order, result)
+        return new_order
+
+    async def buy_async(self, price, quantity, ttl=None):
+        return await self.place_order_async('buy', price, quantity, ttl)
+
+    async def sell_async(self, price, quantity, ttl=None):
+        return await self.place_order_async('sell', price, quantity, ttl)
+
+    async def cancel_async(self, trx_id):
+        async with self._slots():
+            print(datetime.now(), 'cancelling', trx_id)
+            cancel = None
+            if self.cancel_cache is not None:
+                # Never block the loop on a signing that is still running in the background
+                cancel = self.cancel_cache.take(trx_id, wait=False)
+            if cancel is None:
+                cancel = await self.async_signer.prepare_cancel_message(trx_id)
+            result = await self.async_api_server.send_transaction(cancel)
+            print('cancel result', result)
+        return result
+
+    async def cancel_all_async(self, symbol):
+        async with self._slots():
+            print(datetime.now(), 'cancelling all')
+            cancel_all = await self.async_signer.prepare_cancel_all_message(symbol)
+            result = await self.async_api_server.send_transaction(cancel_all)
+            print('cancel all result', result)
+        return result
+
+    async def place_orders_async(self, orders):
+        """Sign and send (side, price, quantity) tuples concurrently
+
+        Returns one entry per order, either the new Order or the exception it raised.
+        """
+        tasks = [self.place_order_async(side, price, quantity) for side, price, quantity in orders]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel_orders_async(self, trx_ids):
+        """Cancel orders concurrently, returns a dict of trx_id to result or exception
+
+        Sends a single cancel all instead when trx_ids covers every live order, see covers_live_orders.
+        """
+        trx_ids = list(dict.fromkeys(trx_ids))
+        if self.covers_live_orders(trx_ids):
+            try:
+                result = await self.cancel_all_async(self.assetPair)
+            except Exception as e:
+                result = e
+            results = [result] * len(trx_ids)
+        else:
+            results = await asyncio.gather(*[self.cancel_async(trx_id) for trx_id in trx_ids],
+                                           return_exceptions=True)
+        for trx_id, result in zip(trx_ids, results):
+            if not isinstance(result, Exception) and trx_id in self.orders:
+                self.set_order_state(self.orders[trx_id], OrderStatus.PendingCancel)
+        return dict(zip(trx_ids, results))
+
+    async def cancel_old_orders_async(self):
+        to_cancel = [order.trx_id for order in self.expired_orders()]
+        if to_cancel:
+            return await self.cancel_orders_async(to_cancel)
+        return {}
+
+    async def update_orders_async(self):
+        # Only the fetch is awaited, the reconcile step is the same as the blocking path
+        order_datas = await self.async_api_server.get_orders(self.account)
+        self.apply_orders(order_datas)
+
+    async def handle_signal_async(self, signal, orderbook):
+        if signal is None:
+            return None
+
+        target = self.size * signal
+
+        # Same checks as handle_signal, the opposite side is cancelled in one concurrent batch
+        to_cancel, pending_new_count, pending_count = self.signal_cancels(target)
+        if to_cancel:
+            results = await self.cancel_orders_async(to_cancel)
+            for trx_id, result in results.items():
+                if isinstance(result, Exception):
+                    print('cancel error', result)
+        self.check_pending(pending_new_count, pending_count)
+
+        decided = self.reserve_for_target(target, orderbook)
+        if not isinstance(decided, tuple):
+            return decided
+        side, price, quantity = decided
+        await self.place_order_async(side, price, quantity, reserved=True)
+        return True
@@ -1,8 +1,17 @@
+import atexit
 import requests
 import sys
 from datetime import datetime
 from time import time
-from ordermanager import OrderManager, MarketDataManager, BarData
+from ordermanager import OrderManager, OrderStatus, MarketDataManager
+from orderarchive import OrderArchive
+from metrics import default_registry, start_metrics_server
+from streaming import SocketTransport, StreamIngestor
+from refresh import RefreshStage
+from barfile import BarFile
+from expiry import DEFAULT_ORDER_TTL
+from risk import RiskEngine, limits_from_config
+from gateway import OrderGateway
 import threading
 
 import ccxt
@@ -13,15 +22,21 @@ symbol = 'ETH/USDT'
 
 mdb = None
 om = None
+gateway = None
 
 def input_thread():
     while True:
         cmd = input()
         print(datetime.now(), 'Got a command', cmd)
+        # Orders go through the gateway, never straight to om from this thread
         if cmd == '+':
-            om.buy_one(mdb.get_order_book())
+            gateway.buy_one()
         elif cmd == '-':
-            om.sell_one(mdb.get_order_book())
+            gateway.sell_one()
+        elif cmd == 'k' and om.risk is not None:
+            om.risk.kill('console')
+        elif cmd == 'r' and om.risk is not None:
+            om.risk.resume()
 
 
 thread = threading.Thread(target=input_thread)
@@ -46,36 +61,41 @@ thread.start()
 #         print(bar.start_time, bar.px_open, bar.px_high, bar.px_low, bar.px_close, bar.volume)
 
 
-def process_huobi_data(mdb, start, end):
-    try:
-        # start_time = timer()
-        data = huobi_api.fetch_ohlcv(symbol, since=start)
-        order_book = huobi_api.fetch_order_book(symbol, limit=10)
-        # end_time = timer()
-        # print(end_time - start_time)
-        # Usually this takes 3.9 seconds
+def fetch_huobi_ohlcv(mdb, start):
+    # Usually this takes 3.9 seconds, see huobi.* in the metrics snapshot
+    # Only ask for bars from the in-progress one on, once the history is in
+    with default_registry.measure('huobi.fetch_ohlcv'):
+        return huobi_api.fetch_ohlcv(symbol, since=mdb.ohlcv_since(start))
+
+
+def fetch_huobi_order_book():
+    with default_registry.measure('huobi.fetch_order_book'):
+        return huobi_api.fetch_order_book(symbol, limit=10)
 
-        for bar_data in data:
-            bar = BarData()
-            bar.start_time = datetime.fromtimestamp(bar_data[0]/1000.0)
-            bar.px_open = float(bar_data[1])
-            bar.px_high = float(bar_data[2])
-            bar.px_low = float(bar_data[3])
-            bar.px_close = float(bar_data[4])
-            bar.volume = float(bar_data[5])
 
-            mdb.update_bar_data(bar)
+def apply_huobi_order_book(mdb, order_book):
+    mdb.order_book.apply_snapshot(order_book['bids'], order_book['asks'], order_book.get('nonce'))
 
-            # print(bar.start_time, bar.px_open, bar.px_high, bar.px_low, bar.px_close, bar.volume)
-        # print('got', len(results), 'bars', results)
+    # An empty side keeps the last best price, orders are not priced from it, see OrderManager.best_price
+    best_bid = mdb.order_book.get_best_bid()
+    best_ask = mdb.order_book.get_best_ask()
+    if best_bid is not None:
+        mdb.best_bid = best_bid
+    if best_ask is not None:
+        mdb.best_ask = best_ask
 
-        mdb.order_book.bids = order_book['bids']
-        mdb.order_book.asks = order_book['asks']
+    # print('{0:.3f} {1:.3f}'.format(mdb.best_bid, mdb.best_ask))
+
+
+def process_huobi_data(mdb, start, end):
+    try:
+        data = fetch_huobi_ohlcv(mdb, start)
+        order_book = fetch_huobi_order_book()
 
-        mdb.best_bid = mdb.order_book.bids[0][0]
-        mdb.best_ask = mdb.order_book.asks[0][0]
+        mdb.sync_ohlcv(data)
+        # print('got', len(data), 'bars', data)
 
-        # print('{0:.3f} {1:.3f}'.format(mdb.best_bid, mdb.best_ask))
+        apply_huobi_order_book(mdb, order_book)
 
     except requests.exceptions.HTTPError:
         print('http error, no matter, do it next time')
@@ -104,8 +124,83 @@ if __name__ == '__main__':
         print('need to have cybex account setting in the config_uat.ini')
         exit(-1)
 
+    try:
+        metrics_port = int(config['Metrics']['port'])
+    except Exception:
+        metrics_port = None
+    if metrics_port:
+        start_metrics_server(metrics_port)
+        print(datetime.now(), 'metrics served on port', metrics_port)
+
+    # Seconds a resting order lives before it is cancelled
+    try:
+        order_ttl = float(config['Cybex']['order_ttl'])
+    except Exception:
+        order_ttl = DEFAULT_ORDER_TTL
+
+    # Archived orders spill to this file, without it only the newest ones can be looked up
+    try:
+        orders_path = config['History']['orders_path']
+    except Exception:
+        orders_path = None
+    archive = OrderArchive(orders_path, status_by_value={status.value: status for status in OrderStatus}) \
+        if orders_path else None
+
     mdb = MarketDataManager()
-    om = OrderManager(account, symbol)
+    om = OrderManager(account, symbol, order_ttl=order_ttl, archive=archive)
+
+    # Orders archived since the last full chunk only reach the spill file on close, also on Ctrl-C
+    if archive is not None:
+        def close_archive():
+            with om.lock:
+                archive.close()
+        atexit.register(close_archive)
+    # Best bid / ask as last published by the book, safe to read while the ingestor or the loop updates it
+    top_of_book = mdb.get_order_book().top_view()
+
+    # Pre-trade limits from the [Risk] section, a missing key leaves that check off
+    try:
+        risk_section = config['Risk']
+    except Exception:
+        risk_section = None
+    if risk_section is not None:
+        try:
+            limits = limits_from_config(risk_section)
+        except ValueError as e:
+            print('bad [Risk] section in the config:', e)
+            exit(-1)
+        om.risk = RiskEngine(orderbook=top_of_book, **limits)
+        print(datetime.now(), 'pre-trade limits', limits)
+
+    # Bars kept on disk, a restart only fetches what closed since the last one saved
+    try:
+        history_path = config['History']['path']
+    except Exception:
+        history_path = None
+    if history_path:
+        loaded = mdb.load_history(BarFile(history_path))
+        print(datetime.now(), 'loaded', loaded, 'bars from', history_path)
+
+    # With a [Stream] section, bars and book come from a pushed feed instead of polling huobi
+    ingestor = None
+    mdb_lock = threading.RLock()
+    try:
+        stream_host = config['Stream']['host']
+        stream_port = int(config['Stream']['port'])
+    except Exception:
+        stream_host = None
+    if stream_host:
+        def huobi_snapshot():
+            book = huobi_api.fetch_order_book(symbol, limit=10)
+            return {'type': 'snapshot', 'seq': book.get('nonce'), 'bids': book['bids'], 'asks': book['asks']}
+
+        def huobi_ohlcv(since):
+            with default_registry.measure('huobi.fetch_ohlcv'):
+                return huobi_api.fetch_ohlcv(symbol, since=since)
+        # No ohlcv refresh task in streaming mode, the ingestor refetches bars itself after a trade gap
+        ingestor = StreamIngestor(mdb, SocketTransport(stream_host, stream_port), snapshot_fn=huobi_snapshot,
+                                  ohlcv_fn=huobi_ohlcv, reconnect=True)
+        mdb_lock = ingestor.lock
 
     # om.do_test_order()
 
@@ -117,6 +212,20 @@ if __name__ == '__main__':
     # process_binance_data(mdb, start, end)
     process_huobi_data(mdb, start, end)
     mdb.redo_ema()
+    if ingestor is not None:
+        ingestor.start()
+        print(datetime.now(), 'streaming market data from', stream_host, stream_port)
+
+    # Signing and sending orders runs on the gateway thread, the loop only queues targets
+    gateway = OrderGateway(om, top_of_book)
+    gateway.start()
+
+    # Market data and order state are fetched in parallel and merged at one point of the loop
+    refresh = RefreshStage()
+    if ingestor is None:
+        refresh.add('ohlcv', lambda: fetch_huobi_ohlcv(mdb, (int(time()) - 120) * 1000), mdb.sync_ohlcv)
+        refresh.add('order_book', fetch_huobi_order_book, lambda order_book: apply_huobi_order_book(mdb, order_book))
+    refresh.add('orders', om.fetch_orders, om.apply_orders)
 
     signal_slots = {}
 
@@ -126,22 +235,28 @@ if __name__ == '__main__':
 
         # calculate a few time related number
         now_s = int(time())
-        start_s = (now_s - 120) * 1000
-        end_s = now_s * 1000
         now_m = int(now_s / 60)
 
-        # Get market data udpates
-        process_huobi_data(mdb, start_s, end_s)
-        bar_count = mdb.get_bar_count()
+        # Get market data and order updates
+        timings = refresh.run()
+        if timings['total'] > 1:
+            print(datetime.now(), 'slow refresh', ', '.join('{0} {1}'.format(name, 'timeout' if elapsed is None
+                                                                             else '{0:.3f}s'.format(elapsed))
+                                                            for name, elapsed in timings.items()))
 
-        # bar_count - 1 is the current bar
-        mdb.calc_ema(bar_count - 2)
-        mdb.calc_ema(bar_count - 1)
+        # Expired orders are picked on this thread after the merge, the gateway sends their cancels and marks
+        # them PendingCancel under om.lock
+        expired = [order.trx_id for order in om.expired_orders()]
+        if expired:
+            gateway.cancel(expired)
 
-        om.update_orders()
-        om.cancel_old_orders()
+        with mdb_lock:
+            bar_count = mdb.get_bar_count()
 
-        current_pnl = om.calculate_pnl(mdb.get_order_book())
+            # bar_count - 1 is the current bar
+            mdb.update_indicators()
+
+        current_pnl = om.calculate_pnl(top_of_book)
 
         pnl_changed = False
         pnl_change = abs(current_pnl - om.pnl)
@@ -157,15 +272,18 @@ if __name__ == '__main__':
 
         # print('now', now, 'now_m', now_m, 'now_s', now_s, 'cut_off', cut_off)
 
-        if now_m not in signal_slots and now_s > cut_off:
+        if now_m not in signal_slots and now_s > cut_off and not gateway.target_busy():
             # If there is no action in this time slot, calculate to_trade and send order
             signal = mdb.check_signal(bar_count - 2)
 
             print('{0}, signal for slot {1} is {2}, pos {3}, pnl {4}'
                   .format(datetime.now(), now_m, signal, om.position, current_pnl))
-            try:
-                result = om.handle_signal(signal, mdb.get_order_book())
-                if result is not None or signal is None:
-                    signal_slots[now_m] = signal
-            except Exception as e:
-                print('handle_signal encounter error', e)
+
+            # Runs on the gateway thread, a slot without a result is tried again by the next loop
+            def signal_handled(intent, slot=now_m):
+                if intent.error is not None:
+                    print('handle_signal encounter error', intent.error)
+                elif intent.result is not None or intent.signal is None:
+                    signal_slots[slot] = intent.signal
+
+            gateway.submit_target(signal, signal_handled)
@@ -0,0 +1,91 @@
+"""Append-only bar history on disk
+
+Fixed size records after a small header, read through a NumPy memmap so range queries only touch the pages
+they need. Records only ever go at the end and in start time order; a partly written last record (a crash
+mid-append) is ignored and overwritten by the next append.
+"""
+import os
+import struct
+
+import numpy as np
+
+BAR_FILE_MAGIC = b'CYBXBARS'
+BAR_FILE_VERSION = 1
+HEADER = struct.Struct('<8sII')
+HEADER_SIZE = 64
+
+RECORD_FIELDS = ('start_time', 'end_time', 'px_open', 'px_high', 'px_low', 'px_close', 'volume')
+RECORD_DTYPE = np.dtype([(name, '<f8') for name in RECORD_FIELDS])
+
+
+class BarFile:
+    """Bar history file, times in epoch seconds"""
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE
+        self.file = open(path, 'w+b' if new else 'r+b')
+        if new:
+            self.file.write(HEADER.pack(BAR_FILE_MAGIC, BAR_FILE_VERSION, RECORD_DTYPE.itemsize)
+                            .ljust(HEADER_SIZE, b'\0'))
+            self.file.flush()
+        else:
+            magic, version, record_size = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != BAR_FILE_MAGIC or version != BAR_FILE_VERSION or record_size != RECORD_DTYPE.itemsize:
+                raise ValueError('%s is not a version %s bar file' % (path, BAR_FILE_VERSION))
+        self.count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        self.map = None
+        self.map_count = 0
+        self.last_start = float(self.records(self.count - 1)['start_time'][0]) if self.count else None
+
+    def __len__(self):
+        return self.count
+
+    def last_start_time(self):
+        return self.last_start
+
+    def append(self, start_time, px_open, px_high, px_low, px_close, volume, end_time=None):
+        """Append one bar, returns False (and writes nothing) unless it starts after the last one"""
+        if self.last_start is not None and start_time <= self.last_start:
+            return False
+        record = np.array([(start_time, end_time if end_time is not None else start_time, px_open, px_high,
+                            px_low, px_close, volume)], dtype=RECORD_DTYPE)
+        self.file.seek(HEADER_SIZE + self.count * RECORD_DTYPE.itemsize)
+        self.file.write(record.tobytes())
+        self.file.flush()
+        self.count += 1
+        self.last_start = start_time
+        return True
+
+    def append_bar(self, bar):
+        """Append a BarView (or anything with the BarData attributes)"""
+        if hasattr(bar, 'store'):
+            values = [float(bar.value(name)) for name in RECORD_FIELDS]
+        else:
+            values = [bar.start_time.timestamp(), bar.end_time.timestamp(), bar.px_open, bar.px_high, bar.px_low,
+                      bar.px_close, bar.volume]
+        return self.append(values[0], values[2], values[3], values[4], values[5], values[6], values[1])
+
+    def _mapped(self):
+        # Remap once records were appended since the last read
+        if self.map is None or self.map_count != self.count:
+            if self.count:
+                self.map = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE,
+                                     shape=(self.count,))
+            else:
+                self.map = np.zeros(0, dtype=RECORD_DTYPE)
+            self.map_count = self.count
+        return self.map
+
+    def records(self, start=None, end=None):
+        """Records start to end (end exclusive) as a read-only memmap slice"""
+        return self._mapped()[start:end]
+
+    def between(self, start_time, end_time):
+        """Records with start_time <= start < end_time, found by binary search"""
+        mapped = self._mapped()
+        times = mapped['start_time']
+        return mapped[np.searchsorted(times, start_time, 'left'):np.searchsorted(times, end_time, 'left')]
+
+    def close(self):
+        self.map = None
+        self.file.close()
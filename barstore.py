@@ -0,0 +1,208 @@
+from datetime import datetime
+
+import numpy as np
+
+# One week of one minute bars
+BAR_CAPACITY = 7 * 24 * 60
+
+TIME_COLUMNS = ('start_time', 'end_time')
+VALUE_COLUMNS = ('px_open', 'px_high', 'px_low', 'px_close', 'volume',
+                 'sma_fast', 'sma_slow', 'ema_fast', 'ema_slow', 'macd', 'macd_signal')
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+class BarView:
+    """One bar of a BarStore, read and written through the same attributes as BarData
+
+    The view points at a ring buffer slot, so it is only valid until that slot is reused.
+    """
+    __slots__ = ('store', 'slot')
+
+    def __init__(self, store, slot):
+        self.store = store
+        self.slot = slot
+
+    def value(self, name):
+        return self.store.columns[name][self.slot]
+
+    def to_dict(self):
+        columns = self.store.columns
+        row = {name: float(columns[name][self.slot]) for name in TIME_COLUMNS + VALUE_COLUMNS}
+        row['finalized'] = bool(self.store.finalized[self.slot])
+        return row
+
+
+def _time_property(name):
+    def getter(self):
+        return datetime.fromtimestamp(self.store.columns[name][self.slot])
+
+    def setter(self, value):
+        self.store.columns[name][self.slot] = to_timestamp(value)
+
+    return property(getter, setter)
+
+
+def _value_property(name):
+    def getter(self):
+        return self.store.columns[name][self.slot]
+
+    def setter(self, value):
+        self.store.columns[name][self.slot] = value
+
+    return property(getter, setter)
+
+
+for _name in TIME_COLUMNS:
+    setattr(BarView, _name, _time_property(_name))
+for _name in VALUE_COLUMNS:
+    setattr(BarView, _name, _value_property(_name))
+BarView.finalized = property(lambda self: bool(self.store.finalized[self.slot]),
+                             lambda self, value: self.store.finalized.__setitem__(self.slot, value))
+
+
+class BarStore:
+    """Columnar bar series backed by fixed capacity NumPy ring buffers
+
+    Bars keep their absolute index: len() is the number of bars ever appended and bars[i] is valid for
+    first_index <= i < len(). Once capacity is reached the oldest bar is handed to on_evict(index, view),
+    if set, and its slot is reused. columns and finalized can be passed in to keep the bars in arrays owned by
+    someone else, e.g. rows of the shared arrays of a multi symbol store.
+    """
+    def __init__(self, capacity=BAR_CAPACITY, on_evict=None, columns=None, finalized=None):
+        self.capacity = capacity
+        self.on_evict = on_evict
+        if columns is None:
+            columns = {name: np.zeros(capacity) for name in TIME_COLUMNS + VALUE_COLUMNS}
+        self.columns = columns
+        self.finalized = finalized if finalized is not None else np.zeros(capacity, dtype=bool)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def first_index(self):
+        return max(0, self.count - self.capacity)
+
+    def _slot(self, index):
+        if index < 0:
+            index += self.count
+        if index < self.first_index or index >= self.count:
+            raise IndexError('bar %s not in store (%s to %s)' % (index, self.first_index, self.count - 1))
+        return index % self.capacity
+
+    def __getitem__(self, index):
+        return BarView(self, self._slot(index))
+
+    def __setitem__(self, index, bar):
+        self._write(self._slot(index), bar)
+
+    def __iter__(self):
+        for index in range(self.first_index, self.count):
+            yield BarView(self, index % self.capacity)
+
+    def _next_slot(self):
+        slot = self.count % self.capacity
+        if self.count >= self.capacity and self.on_evict is not None:
+            self.on_evict(self.count - self.capacity, BarView(self, slot))
+        self.count += 1
+        return slot
+
+    def _write(self, slot, bar):
+        columns = self.columns
+        for name in TIME_COLUMNS:
+            columns[name][slot] = to_timestamp(getattr(bar, name))
+        for name in VALUE_COLUMNS:
+            columns[name][slot] = getattr(bar, name)
+        self.finalized[slot] = getattr(bar, 'finalized', False)
+
+    def append(self, bar):
+        self._write(self._next_slot(), bar)
+
+    def append_values(self, start_time, px_open, px_high, px_low, px_close, volume, end_time=None):
+        """Append a bar from plain values, times in epoch seconds, indicators reset to 0"""
+        slot = self._next_slot()
+        self._set_values(slot, start_time, px_open, px_high, px_low, px_close, volume, end_time)
+        for name in VALUE_COLUMNS[5:]:
+            self.columns[name][slot] = 0
+        self.finalized[slot] = False
+
+    def set_values(self, index, start_time, px_open, px_high, px_low, px_close, volume, end_time=None):
+        self._set_values(self._slot(index), start_time, px_open, px_high, px_low, px_close, volume, end_time)
+
+    def _set_values(self, slot, start_time, px_open, px_high, px_low, px_close, volume, end_time):
+        columns = self.columns
+        columns['start_time'][slot] = start_time
+        columns['end_time'][slot] = end_time if end_time is not None else start_time
+        columns['px_open'][slot] = px_open
+        columns['px_high'][slot] = px_high
+        columns['px_low'][slot] = px_low
+        columns['px_close'][slot] = px_close
+        columns['volume'][slot] = volume
+
+    def extend(self, columns, finalized=True):
+        """Append bars in bulk from equal length arrays by column name, without calling on_evict
+
+        Only the last capacity bars are written, missing columns are left at 0.
+        """
+        count = len(columns['start_time'])
+        skip = max(0, count - self.capacity)
+        start = self.count + skip
+        self.count += count
+        for name in TIME_COLUMNS + VALUE_COLUMNS:
+            if name in columns:
+                self.set_column(name, columns[name][skip:], start)
+            else:
+                self.set_column(name, np.zeros(count - skip), start)
+        self.set_column('finalized', np.full(count - skip, finalized), start)
+
+    def add_column(self, name):
+        """Add a float column for an extra indicator, BarView.value(name) reads it"""
+        if name not in self.columns:
+            self.columns[name] = np.zeros(self.capacity)
+        return self.columns[name]
+
+    def value(self, name, index):
+        return self.columns[name][self._slot(index)]
+
+    def last_start_time(self):
+        """Start time of the newest bar in epoch seconds, None when empty"""
+        if self.count == 0:
+            return None
+        return self.columns['start_time'][(self.count - 1) % self.capacity]
+
+    def column(self, name, start=None, end=None):
+        """Values of a column for bars start to end (absolute indexes, end exclusive) in bar order
+
+        Returns a view when the range does not wrap around the ring, a copy otherwise.
+        """
+        first = self.first_index
+        start = first if start is None else max(start, first)
+        end = self.count if end is None else min(end, self.count)
+        data = self.columns[name] if name != 'finalized' else self.finalized
+        if start >= end:
+            return data[0:0]
+        lo = start % self.capacity
+        hi = lo + (end - start)
+        if hi <= self.capacity:
+            return data[lo:hi]
+        return np.concatenate((data[lo:], data[:hi - self.capacity]))
+
+    def set_column(self, name, values, start=None):
+        """Write values into a column starting at absolute index start, the inverse of column()"""
+        start = self.first_index if start is None else start
+        self._slot(start)
+        values = np.asarray(values)
+        end = min(start + len(values), self.count)
+        lo = start % self.capacity
+        n = end - start
+        first_part = min(n, self.capacity - lo)
+        data = self.columns[name] if name != 'finalized' else self.finalized
+        data[lo:lo + first_part] = values[:first_part]
+        if n > first_part:
+            data[:n - first_part] = values[first_part:n]
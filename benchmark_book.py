@@ -0,0 +1,92 @@
+"""Benchmark the incremental L2 order book
+
+Applies random level inserts, modifies and deletes around the mid to a deep book, then times the depth
+queries, and compares with rebuilding a sorted OrderBook from scratch for every update.
+
+Usage:
+    python3 benchmark_book.py --levels 1000 --updates 200000
+"""
+import argparse
+import random
+import time
+
+from l2book import L2OrderBook
+
+TICK = 0.01
+
+
+def make_updates(count, levels, seed):
+    rnd = random.Random(seed)
+    mid = 100.0
+    updates = []
+    for i in range(count):
+        is_bid = rnd.random() < 0.5
+        offset = rnd.randint(1, levels) * TICK
+        px = round(mid - offset if is_bid else mid + offset, 2)
+        sz = 0.0 if rnd.random() < 0.2 else round(rnd.uniform(0.1, 10), 2)
+        updates.append((is_bid, px, sz))
+    return updates
+
+
+def initial_levels(levels):
+    bids = [[round(100.0 - i * TICK, 2), 1.0] for i in range(1, levels + 1)]
+    asks = [[round(100.0 + i * TICK, 2), 1.0] for i in range(1, levels + 1)]
+    return bids, asks
+
+
+def run_incremental(book, updates):
+    start = time.perf_counter()
+    for is_bid, px, sz in updates:
+        book.apply_update(is_bid, px, sz)
+    return time.perf_counter() - start
+
+
+def run_rebuild(bids, asks, updates):
+    # What a full refresh costs: merge the change into dicts and sort both sides again
+    bid_map = {px: sz for px, sz in bids}
+    ask_map = {px: sz for px, sz in asks}
+    start = time.perf_counter()
+    for is_bid, px, sz in updates:
+        side = bid_map if is_bid else ask_map
+        if sz > 0:
+            side[px] = sz
+        else:
+            side.pop(px, None)
+        sorted(bid_map.items(), reverse=True)
+        sorted(ask_map.items())
+    return time.perf_counter() - start
+
+
+def run_queries(book, count):
+    start = time.perf_counter()
+    for i in range(count):
+        book.vwap(i % 2 == 0, 25.0)
+        book.cumulative_size(True, 99.5)
+        book.microprice()
+        book.imbalance(5)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", type=int, default=1000, help="Price levels per side")
+    parser.add_argument("--updates", type=int, default=200000, help="Number of level updates")
+    parser.add_argument("--queries", type=int, default=50000, help="Number of depth query rounds")
+    args = parser.parse_args()
+
+    bids, asks = initial_levels(args.levels)
+    updates = make_updates(args.updates, args.levels, 1)
+
+    book = L2OrderBook()
+    book.apply_snapshot(bids, asks)
+    incremental = run_incremental(book, updates)
+    rebuild_count = min(args.updates, 2000)
+    rebuild = run_rebuild(bids, asks, updates[:rebuild_count])
+    queries = run_queries(book, args.queries)
+
+    print('{0} updates, {1:.0f} updates/s incremental, {2:.0f} updates/s full rebuild'
+          .format(args.updates, args.updates / incremental, rebuild_count / rebuild))
+    print('{0} query rounds (vwap, cumulative size, microprice, imbalance), {1:.0f} rounds/s'
+          .format(args.queries, args.queries / queries))
+    print('book now {0} bids / {1} asks, best {2} / {3}'
+          .format(len(book.bid_side), len(book.ask_side), book.get_best_bid(), book.get_best_ask()))
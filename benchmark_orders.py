@@ -0,0 +1,129 @@
+"""Order entry throughput benchmark against the local mock server
+
+Pushes OrderManager at a target rate of new orders per second and reports the achieved throughput and
+the order entry latency percentiles (sign + send).
+
+Usage:
+    python3 benchmark_orders.py --rate 200 --duration 10 --workers 16
+    python3 benchmark_orders.py --rate 500 --duration 10 --mode async --latency 0.005
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cybexapi_connector import CybexRestful, SignerConnector
+from httppool import PoolConfig
+from metrics import Histogram, default_registry
+from mock_server import MockServer, MockConfig
+from ordermanager import OrderManager
+
+
+def report(title, sent, errors, elapsed, latency_us):
+    snap = latency_us.snapshot()
+    print('{0}: sent {1}, errors {2}, {3:.1f} orders/sec over {4:.2f}s'.format(title, sent, errors,
+                                                                          sent / elapsed, elapsed))
+    print('  latency ms p50 {0:.2f} p90 {1:.2f} p99 {2:.2f} p99.9 {3:.2f} max {4:.2f}'
+          .format(snap['p50'] / 1000.0, snap['p90'] / 1000.0, snap['p99'] / 1000.0, snap['p99.9'] / 1000.0,
+                  snap['max'] / 1000.0))
+
+
+def run_threaded(om, rate, duration, workers):
+    latency_us = Histogram()
+    errors = [0]
+
+    def one_order(i):
+        start = time.perf_counter()
+        try:
+            if i % 2 == 0:
+                om.buy(99.0, 0.01)
+            else:
+                om.sell(101.0, 0.01)
+        except Exception:
+            errors[0] += 1
+        latency_us.record((time.perf_counter() - start) * 1000000)
+
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(total):
+            # Open loop: keep the schedule whether or not earlier orders have finished
+            delay = begin + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(one_order, i)
+    elapsed = time.perf_counter() - begin
+    return total, errors[0], elapsed, latency_us
+
+
+def run_async(om, rate, duration):
+    latency_us = Histogram()
+    errors = [0]
+
+    async def one_order(i):
+        start = time.perf_counter()
+        try:
+            await om.place_order_async('buy' if i % 2 == 0 else 'sell', 99.0 if i % 2 == 0 else 101.0, 0.01)
+        except Exception:
+            errors[0] += 1
+        latency_us.record((time.perf_counter() - start) * 1000000)
+
+    async def drive():
+        total = int(rate * duration)
+        interval = 1.0 / rate
+        begin = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            delay = begin + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one_order(i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - begin
+        await om.close()
+        return total, errors[0], elapsed, latency_us
+
+    return asyncio.run(drive())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=100, help="Target new orders per second")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to run")
+    parser.add_argument("--workers", type=int, default=16, help="Threads for the blocking order path")
+    parser.add_argument("--mode", choices=['threaded', 'async'], default='threaded')
+    parser.add_argument("--latency", type=float, default=0.0, help="Injected API server latency in seconds")
+    parser.add_argument("--signer_latency", type=float, default=0.0, help="Injected signer latency in seconds")
+    parser.add_argument("--reject", type=float, default=0.0, help="Reject probability per new order")
+    args = parser.parse_args()
+
+    server = MockServer(0, config=MockConfig(signer_latency=args.signer_latency, api_latency=args.latency,
+                                             reject_probability=args.reject)).start()
+    pool_config = PoolConfig(pool_maxsize=max(args.workers, 16))
+    signer = SignerConnector(server.signer_root, pool_config=pool_config)
+    api_server = CybexRestful(server.api_root, pool_config=pool_config)
+
+    # OrderManager prints every order, keep the report readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.mode == 'async':
+            from async_ordermanager import AsyncOrderManager
+            from cybexapi_async import AsyncCybexRestful, AsyncSignerConnector
+            om = AsyncOrderManager('bench', 'ETH/USDT', max_in_flight=args.workers, signer=signer,
+                                   api_server=api_server,
+                                   async_signer=AsyncSignerConnector(server.signer_root, pool_config=pool_config),
+                                   async_api_server=AsyncCybexRestful(server.api_root, pool_config=pool_config))
+            result = run_async(om, args.rate, args.duration)
+        else:
+            om = OrderManager('bench', 'ETH/USDT', signer=signer, api_server=api_server)
+            result = run_threaded(om, args.rate, args.duration, args.workers)
+
+    report('%s order entry' % args.mode, *result)
+    for endpoint, snap in default_registry.snapshot().items():
+        latency = snap['latency_us']
+        print('  {0:<20} count {1:>7} p50 {2:.2f}ms p99 {3:.2f}ms errors {4}'
+              .format(endpoint, latency['count'], latency['p50'] / 1000.0, latency['p99'] / 1000.0,
+                      snap['errors']))
+    server.stop()
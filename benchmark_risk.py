@@ -0,0 +1,95 @@
+"""Benchmark the pre-trade risk checks
+
+Times RiskEngine.check with every limit on against an OrderManager holding many live orders, and compares with
+the same limits computed by scanning the orders. No order is signed or sent.
+
+Usage:
+    python3 benchmark_risk.py --orders 10000 --checks 200000
+"""
+import argparse
+import random
+import time
+
+from l2book import L2OrderBook
+from ordermanager import Order, OrderManager, OrderStatus
+from risk import CybexRiskException, RiskEngine
+
+
+class Offline:
+    """Stands in for the signer and api server, the benchmark never reaches them"""
+
+
+def make_manager(orders, seed):
+    rnd = random.Random(seed)
+    om = OrderManager('bench', 'ETH/USDT', signer=Offline(), api_server=Offline())
+    for i in range(orders):
+        order = Order()
+        order.trx_id = 'bench%d' % i
+        order.side = 'buy' if i % 2 == 0 else 'sell'
+        order.price = round(100 + rnd.uniform(-1, 1), 2)
+        order.quantity = 0.01
+        order.filled = 0
+        order.avg_price = 0
+        order.order_status = OrderStatus.New
+        om.add_order(order)
+    return om
+
+
+def scan_check(om, engine, side, price, quantity):
+    # What the checks cost without the incremental totals
+    open_orders = 0
+    buy_open = 0
+    sell_open = 0
+    for order in om.orders.values():
+        if order.order_status in {None, OrderStatus.PendingNew, OrderStatus.New, OrderStatus.PartiallyFilled,
+                                  OrderStatus.PendingCancel}:
+            open_orders += 1
+            if order.side == 'buy':
+                buy_open += order.quantity - order.filled
+            else:
+                sell_open += order.quantity - order.filled
+    exposure = om.position + buy_open + quantity if side == 'buy' else om.position - sell_open - quantity
+    return open_orders < engine.max_open_orders and abs(exposure) <= engine.max_position \
+        and price * quantity <= engine.max_order_notional
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--checks', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    om = make_manager(args.orders, args.seed)
+    book = L2OrderBook()
+    book.apply_snapshot([[99.9, 5.0]], [[100.1, 5.0]])
+    engine = RiskEngine(max_position=1e9, max_order_notional=1e6, max_open_orders=args.orders * 2,
+                        max_orders_per_second=args.checks * 2, price_band=0.05, orderbook=book)
+
+    rnd = random.Random(args.seed)
+    requests = [('buy' if rnd.random() < 0.5 else 'sell', round(100 + rnd.uniform(-6, 6), 2), 0.01)
+                for _ in range(args.checks)]
+
+    start = time.perf_counter()
+    refused = 0
+    for side, price, quantity in requests:
+        try:
+            engine.check(om, side, price, quantity)
+        except CybexRiskException:
+            refused += 1
+    elapsed = time.perf_counter() - start
+    print('risk engine: {0} checks with {1} live orders, {2:.2f} us per check, {3:.0f} checks/sec, {4} refused'
+          .format(args.checks, len(om.live_orders), elapsed / args.checks * 1e6, args.checks / elapsed, refused))
+    print('  refused by rule', {rule: count for rule, count in engine.rejected.items() if count})
+
+    scans = max(1, min(args.checks, 2000000 // max(args.orders, 1)))
+    start = time.perf_counter()
+    for side, price, quantity in requests[:scans]:
+        scan_check(om, engine, side, price, quantity)
+    scan_elapsed = time.perf_counter() - start
+    print('order scan: {0} checks, {1:.2f} us per check'.format(scans, scan_elapsed / scans * 1e6))
+    print('speedup {0:.0f}x'.format((scan_elapsed / scans) / (elapsed / args.checks)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark delta order sync against the full reconcile
+
+Builds an OrderManager with live orders and an api server response that also holds the account's older
+terminal orders, changes a few records per sync, and times apply_order_updates and apply_order_deltas over
+growing response sizes. No request is sent.
+
+Usage:
+    python3 benchmark_sync.py --live 200 --changed 5 --syncs 200
+"""
+import argparse
+import time
+
+from ordermanager import Order, OrderManager, OrderStatus
+
+
+class Offline:
+    """Stands in for the signer and api server, the benchmark never reaches them"""
+
+
+def make_manager(live, delta_sync):
+    om = OrderManager('bench', 'ETH/USDT', signer=Offline(), api_server=Offline(), delta_sync=delta_sync)
+    for i in range(live):
+        order = Order()
+        order.trx_id = 'live%d' % i
+        order.side = 'buy' if i % 2 == 0 else 'sell'
+        order.price = 100.0
+        order.quantity = 1.0
+        order.order_status = OrderStatus.New
+        order.order_sequence = i + 1
+        om.add_order(order)
+    return om
+
+
+def make_response(live, history):
+    records = []
+    for i in range(history):
+        records.append({'transactionId': 'old%d' % i, 'orderStatus': 'FILLED', 'orderSequence': -i,
+                        'filledQuantity': 1.0, 'averagePrice': 100.0, 'quantity': 1.0})
+    for i in range(live):
+        records.append({'transactionId': 'live%d' % i, 'orderStatus': 'OPEN', 'orderSequence': i + 1,
+                        'filledQuantity': 0.0, 'averagePrice': 0.0, 'quantity': 1.0})
+    return records
+
+
+def run(om, apply, response, live, changed, syncs):
+    start = time.perf_counter()
+    for sync in range(syncs):
+        # A few live orders pick up a small fill each sync
+        for j in range(changed):
+            record = response[len(response) - live + (sync * changed + j) % live]
+            record['filledQuantity'] = round(record['filledQuantity'] + 0.001, 3)
+        apply(response)
+    return (time.perf_counter() - start) / syncs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--live', type=int, default=200)
+    parser.add_argument('--changed', type=int, default=5)
+    parser.add_argument('--syncs', type=int, default=200)
+    args = parser.parse_args()
+
+    for history in (0, 1000, 10000, 50000):
+        size = history + args.live
+        full_om = make_manager(args.live, False)
+        full = run(full_om, full_om.apply_order_updates, make_response(args.live, history), args.live,
+                   args.changed, args.syncs)
+        delta_om = make_manager(args.live, True)
+        delta = run(delta_om, delta_om.apply_orders, make_response(args.live, history), args.live,
+                    args.changed, args.syncs)
+        print('{0:6d} records: full {1:8.3f} ms, delta {2:8.3f} ms ({3:.0f} ns per record), {4:.1f}x'
+              .format(size, full * 1e3, delta * 1e3, delta / size * 1e9, full / delta))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 import time
 import hashlib
-import requests
 import hmac
+from concurrent.futures import ThreadPoolExecutor
+from httppool import PoolConfig, create_session, SERVER_ERROR_STATUS
+from metrics import default_registry
+from scheduler import PRIORITY_CANCEL, PRIORITY_NEW_ORDER, PRIORITY_ORDER_POLL, PRIORITY_MARKET_DATA, \
+    coalesce_key_for
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 
 try:
     from urllib import urlencode
@@ -10,14 +19,37 @@ except ImportError:
     from urllib.parse import urlencode
 
 
+BULK_WORKERS = 16
+RECV_WINDOW = 120000
+
+
 class BinanceRestful:
     BASE_URL = "https://www.binance.com/api/v1"
     BASE_URL_V3 = "https://api.binance.com/api/v3"
     PUBLIC_URL = "https://www.binance.com/exchange/public/product"
 
-    def __init__(self, key, secret):
+    def __init__(self, key, secret, metrics=None, scheduler=None, pool_config=None, timeout=None,
+                 bulk_workers=BULK_WORKERS):
         self.key = key
         self.secret = secret
+        self.metrics = metrics if metrics is not None else default_registry
+        self.scheduler = scheduler
+
+        # One keep-alive pool for every call, big enough for the bulk fetches. A 429 is not retried, Binance
+        # bans IPs that keep calling after it, the scheduler or the caller has to back off
+        if pool_config is None:
+            pool_config = PoolConfig(pool_maxsize=max(bulk_workers, PoolConfig().pool_maxsize),
+                                     retry_status=SERVER_ERROR_STATUS)
+        self.timeout = timeout if timeout is not None else pool_config.timeout
+        self.session = create_session(pool_config)
+        self.api_headers = {"X-MBX-APIKEY": key}
+
+        # HMAC key schedule computed once, each signature starts from a copy of it. Without a secret only the
+        # public market data calls work
+        self.hmac_state = hmac.new(secret.encode(), digestmod=hashlib.sha256) if secret else None
+
+        self.bulk_workers = bulk_workers
+        self.executor = None
 
     def get_history(self, market, limit=50):
         path = "%s/historicalTrades" % self.BASE_URL
@@ -45,16 +77,46 @@ class BinanceRestful:
         params = {"symbol": market, "limit": limit}
         return self._get_no_sign(path, params)
 
+    def bulk_order_books(self, markets, limit=50):
+        return self._bulk(self.get_order_books, markets, limit)
+
+    def bulk_tickers(self, markets):
+        return self._bulk(self.get_ticker, markets)
+
+    def bulk_trades(self, markets, limit=50):
+        return self._bulk(self.get_trades, markets, limit)
+
+    def _bulk(self, fn, markets, *args):
+        """Call fn for every market in parallel, returns {market: result}
+
+        A market that failed maps to its exception instead of a result.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.bulk_workers, thread_name_prefix='binance')
+        futures = [(market, self.executor.submit(fn, market, *args)) for market in markets]
+        results = {}
+        for market, future in futures:
+            try:
+                results[market] = future.result()
+            except Exception as e:
+                results[market] = e
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.session.close()
+
     def get_account(self):
         path = "%s/account" % self.BASE_URL_V3
-        return self._get(path, {})
+        return self._get(path)
 
     def get_products(self):
-        return requests.get(self.PUBLIC_URL, timeout=30, verify=True).json()
+        return self._request('GET', self.PUBLIC_URL)
 
     def get_exchange_info(self):
         path = "%s/exchangeInfo" % self.BASE_URL
-        return requests.get(path, timeout=30, verify=True).json()
+        return self._request('GET', path)
 
     def get_open_orders(self, market, limit=100):
         path = "%s/openOrders" % self.BASE_URL_V3
@@ -96,39 +158,31 @@ class BinanceRestful:
         params = {"symbol": market, "orderId": order_id}
         return self._delete(path, params)
 
-    def _get_no_sign(self, path, params={}):
-        query = urlencode(params)
+    def _get_no_sign(self, path, params=None):
+        query = urlencode(params or {})
         url = "%s?%s" % (path, query)
-        return requests.get(url, timeout=30, verify=True).json()
+        return self._request('GET', url, endpoint=path)
 
-    def _sign(self, params={}):
-        data = params.copy()
+    def _sign(self, params=None):
+        # Returns the signed query string, params itself is left untouched
+        data = dict(params) if params else {}
+        data["recvWindow"] = RECV_WINDOW
+        data["timestamp"] = str(int(1000 * time.time()))
 
-        ts = str(int(1000 * time.time()))
-        data.update({"timestamp": ts})
+        if self.hmac_state is None:
+            raise ValueError('BinanceRestful needs a secret for signed calls')
+        query = urlencode(data)
+        mac = self.hmac_state.copy()
+        mac.update(query.encode('utf-8'))
+        return "%s&signature=%s" % (query, mac.hexdigest())
 
-        h = urlencode(data)
-        b = bytearray()
-        b.extend(self.secret.encode())
-        signature = hmac.new(b, msg=h.encode('utf-8'), digestmod=hashlib.sha256).hexdigest()
-        data.update({"signature": signature})
-        return data
+    def _get(self, path, params=None):
+        url = "%s?%s" % (path, self._sign(params))
+        return self._request('GET', url, self.api_headers, path, PRIORITY_ORDER_POLL)
 
-    def _get(self, path, params={}):
-        params.update({"recvWindow": 120000})
-        query = urlencode(self._sign(params))
-        url = "%s?%s" % (path, query)
-        header = {"X-MBX-APIKEY": self.key}
-        return requests.get(url, headers=header, \
-                            timeout=30, verify=True).json()
-
-    def _post(self, path, params={}):
-        params.update({"recvWindow": 120000})
-        query = urlencode(self._sign(params))
-        url = "%s?%s" % (path, query)
-        header = {"X-MBX-APIKEY": self.key}
-        return requests.post(url, headers=header, \
-                             timeout=30, verify=True).json()
+    def _post(self, path, params=None):
+        url = "%s?%s" % (path, self._sign(params))
+        return self._request('POST', url, self.api_headers, path, PRIORITY_NEW_ORDER)
 
     def _order(self, market, quantity, side, rate=None):
         params = {}
@@ -149,10 +203,21 @@ class BinanceRestful:
     def _format(self, price):
         return "{:.8f}".format(price)
 
-    def _delete(self, path, params={}):
-        params.update({"recvWindow": 120000})
-        query = urlencode(self._sign(params))
-        url = "%s?%s" % (path, query)
-        header = {"X-MBX-APIKEY": self.key}
-        return requests.delete(url, headers=header, \
-                               timeout=30, verify=True).json()
\ No newline at end of file
+    def _delete(self, path, params=None):
+        url = "%s?%s" % (path, self._sign(params))
+        return self._request('DELETE', url, self.api_headers, path, PRIORITY_CANCEL)
+
+    def _request(self, method, url, headers=None, endpoint=None, priority=PRIORITY_MARKET_DATA):
+        # Metrics are keyed by method and the last path segment, e.g. binance.GET depth
+        name = 'binance.%s %s' % (method, (endpoint or url).rstrip('/').split('/')[-1])
+        if self.scheduler is None:
+            return self._send(name, method, url, headers)
+        # Signed urls carry a timestamp, so only public reads ever coalesce
+        return self.scheduler.call(lambda: self._send(name, method, url, headers), priority, urlparse(url).netloc,
+                                   name, coalesce_key_for(method, url, {}) if headers is None else None)
+
+    def _send(self, name, method, url, headers):
+        with self.metrics.measure(name) as measurement:
+            response = self.session.request(method, url, headers=headers, timeout=self.timeout, verify=True)
+            measurement.payload(len(response.content))
+            return response.json()
\ No newline at end of file
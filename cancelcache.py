@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CANCEL_CACHE_SIZE = 256
+PRESIGN_WORKERS = 2
+
+# Do not hand out a pre-signed cancel that expires within this many seconds
+EXPIRY_MARGIN = 30
+
+
+class CancelCache:
+    """Bounded cache of cancel messages signed ahead of time, keyed by the original trx_id
+
+    presign() signs in the background right after an order is accepted, so cancelling the order later only
+    needs the send_transaction call.
+    """
+    def __init__(self, signer, capacity=CANCEL_CACHE_SIZE, workers=PRESIGN_WORKERS):
+        self.signer = signer
+        self.capacity = capacity
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='presign')
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, trx_id):
+        return trx_id in self.entries
+
+    def presign(self, trx_id):
+        future = self.executor.submit(self.signer.prepare_cancel_message, trx_id)
+        with self.lock:
+            self.entries[trx_id] = future
+            self.entries.move_to_end(trx_id)
+            while len(self.entries) > self.capacity:
+                _, oldest = self.entries.popitem(last=False)
+                oldest.cancel()
+        return future
+
+    def take(self, trx_id, wait=True):
+        """Remove and return the signed cancel message, or None when the caller has to sign it itself
+
+        A pre-signed cancel can only be sent once, so it leaves the cache either way.
+        With wait=False a signing still in progress counts as a miss.
+        """
+        with self.lock:
+            future = self.entries.pop(trx_id, None)
+
+        if future is None or (not wait and not future.done()):
+            self.misses += 1
+            return None
+
+        try:
+            message = future.result()
+        except Exception:
+            self.misses += 1
+            return None
+
+        expiration = message.get('txExpiration') if isinstance(message, dict) else None
+        if expiration is not None and expiration - EXPIRY_MARGIN < time.time():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return message
+
+    def evict(self, trx_id):
+        with self.lock:
+            future = self.entries.pop(trx_id, None)
+        if future is not None:
+            future.cancel()
+
+    def close(self):
+        with self.lock:
+            for future in self.entries.values():
+                future.cancel()
+            self.entries.clear()
+        self.executor.shutdown(wait=False)
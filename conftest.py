@@ -0,0 +1,57 @@
+import itertools
+import threading
+
+import pytest
+
+from ordermanager import OrderManager
+from l2book import L2OrderBook
+
+
+class FakeSigner:
+    """Signs nothing, hands out transaction ids and remembers what it was asked for"""
+    def __init__(self):
+        self.ids = itertools.count()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def prepare_order_message(self, symbol, price, quantity, side):
+        with self.lock:
+            self.calls.append(('order', side, price, quantity))
+            return {'transactionId': 'trx%d' % next(self.ids)}
+
+    def prepare_cancel_message(self, trx_id):
+        with self.lock:
+            self.calls.append(('cancel', trx_id))
+        return {'transactionType': 'Cancel', 'originalTransactionId': trx_id}
+
+    def prepare_cancel_all_message(self, symbol):
+        with self.lock:
+            self.calls.append(('cancel_all', symbol))
+        return {'transactionType': 'CancelAll', 'assetPair': symbol}
+
+
+class FakeApiServer:
+    """Accepts every transaction, fail holds original transaction ids whose cancel raises"""
+    def __init__(self):
+        self.sent = []
+        self.fail = set()
+        self.lock = threading.Lock()
+
+    def send_transaction(self, data):
+        if data.get('originalTransactionId') in self.fail:
+            raise RuntimeError('cancel refused')
+        with self.lock:
+            self.sent.append(data)
+        return {'Status': 'Successful'}
+
+
+@pytest.fixture
+def om():
+    return OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer())
+
+
+@pytest.fixture
+def book():
+    book = L2OrderBook()
+    book.apply_snapshot([[99.0, 5.0], [98.0, 5.0]], [[101.0, 5.0], [102.0, 5.0]])
+    return book
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from cybexapi_connector import CybexRestful, SignerConnector, signer_endpoint_root, api_endpoint_root
+from httppool import PoolConfig, IDEMPOTENT_METHODS
+from decoder import json_loads, decode_order_book
+from metrics import default_registry
+
+KEEPALIVE_TIMEOUT = 30
+
+
+class BufferedResponse:
+    """Fully read aiohttp response exposing the parts of requests.Response the error handling uses
+
+    """
+    def __init__(self, status_code, content, request=None):
+        self.status_code = status_code
+        self.content = content
+        self.request = request
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json_loads(self.content)
+
+
+class AsyncConnector:
+    """Shared aiohttp session handling, timeouts and retry/backoff for the async connectors
+
+    """
+    def __init__(self, api_root, timeout=None, pool_config=None, session=None, metrics=None):
+        self.api_root = api_root
+        self.metrics = metrics if metrics is not None else default_registry
+
+        if pool_config is None:
+            pool_config = PoolConfig()
+        self.pool_config = pool_config
+
+        if timeout is None:
+            timeout = pool_config.timeout
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        else:
+            self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self.headers = {'content-type': 'application/json', 'accept': 'application/json'}
+        if not pool_config.keep_alive:
+            self.headers['connection'] = 'close'
+
+        # The session is bound to the running event loop, so it is created on first use
+        self.session = session
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_config.pool_maxsize,
+                                             limit_per_host=self.pool_config.pool_maxsize,
+                                             force_close=not self.pool_config.keep_alive,
+                                             keepalive_timeout=KEEPALIVE_TIMEOUT
+                                             if self.pool_config.keep_alive else None)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _call(self, endpoint, method, url, **kwargs):
+        with self.metrics.measure(endpoint) as measurement:
+            response = await self._request(method, url, **kwargs)
+            measurement.payload(len(response.content))
+            return self._handle_response(response)
+
+    async def _request(self, method, url, **kwargs):
+        config = self.pool_config
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    content = await response.read()
+                    if (response.status in config.retry_status and method in config.retry_methods
+                            and attempt < config.max_retries):
+                        raise _RetryableStatus()
+                    return BufferedResponse(response.status, content, response.request_info)
+            except _RetryableStatus:
+                pass
+            except aiohttp.ClientConnectorError:
+                # Connection could not be opened, nothing was sent so any method can be retried
+                if attempt >= config.max_retries:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # The request may have reached the server, only retry when the method allows it
+                if attempt >= config.max_retries or method not in config.retry_methods:
+                    raise
+            attempt += 1
+            await asyncio.sleep(config.backoff_factor * (2 ** (attempt - 1)))
+
+
+class _RetryableStatus(Exception):
+    pass
+
+
+class AsyncCybexRestful(AsyncConnector):
+    """Awaitable version of CybexRestful
+
+    """
+    def __init__(self, api_root=api_endpoint_root, clordid_prefix=None, timeout=None, pool_config=None,
+                 session=None, metrics=None):
+        super().__init__(api_root, timeout, pool_config, session, metrics)
+        self.logger = logging.getLogger('root')
+        self.headers['user-agent'] = 'cybex-bot'
+
+    async def get_instruments(self):
+        url = "%s/instrument" % self.api_root
+        return await self._call('cybex.instrument', 'GET', url)
+
+    async def get_order_book(self):
+        url = "%s/orderBook" % self.api_root
+        return await self._call('cybex.orderBook', 'GET', url)
+
+    async def get_order_book_record(self):
+        return decode_order_book(await self.get_order_book())
+
+    async def get_position(self, seller_id):
+        url = "%s/position" % self.api_root
+        params = {'sellerId': seller_id}
+        return await self._call('cybex.position', 'GET', url, params=params)
+
+    async def get_orders(self, account):
+        url = "%s/order" % self.api_root
+        params = {'accountName': account}
+        return await self._call('cybex.order', 'GET', url, params=params)
+
+    async def send_transaction(self, data):
+        url = "%s/transaction" % self.api_root
+        return await self._call('cybex.transaction', 'POST', url, json=data)
+
+    # BufferedResponse looks like a requests.Response, so the sync error handling is reused as is
+    _handle_response = CybexRestful._handle_response
+
+
+class AsyncSignerConnector(AsyncConnector):
+    """Awaitable version of SignerConnector
+
+    """
+    def __init__(self, api_root=signer_endpoint_root, timeout=None, pool_config=None, session=None, metrics=None):
+        if pool_config is None:
+            pool_config = PoolConfig(retry_methods=IDEMPOTENT_METHODS | {'POST'})
+        super().__init__(api_root, timeout, pool_config, session, metrics)
+
+    async def prepare_order_message(self, symbol, price, quantity, side):
+        url = "%s/newOrder" % self.api_root
+        data = {'assetPair': symbol, 'price': price, 'quantity': quantity, 'side': side}
+        return await self._call('signer.newOrder', 'POST', url, json=data)
+
+    async def prepare_cancel_message(self, trxid):
+        url = "%s/cancelOrder" % self.api_root
+        data = {'originalTransactionId': trxid}
+        return await self._call('signer.cancelOrder', 'POST', url, json=data)
+
+    async def prepare_cancel_all_message(self, symbol):
+        url = "%s/cancelAll" % self.api_root
+        data = {'assetPair': symbol}
+        return await self._call('signer.cancelAll', 'POST', url, json=data)
+
+    _handle_response = SignerConnector._handle_response
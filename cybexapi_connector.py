@@ -1,7 +1,12 @@
 from time import sleep
-import requests
 import logging
 import json
+from httppool import PoolConfig, create_session, IDEMPOTENT_METHODS
+from decoder import decode_response, decode_order_book
+from metrics import default_registry
+from scheduler import PRIORITY_CANCEL, PRIORITY_NEW_ORDER, PRIORITY_ORDER_POLL, PRIORITY_MARKET_DATA, \
+    CANCEL_TRANSACTION_TYPES, coalesce_key_for
+from urllib.parse import urlparse
 
 SLEEP_INTERVAL = 5
 signer_endpoint_root = "http://127.0.0.1:8090/signer/v1"
@@ -56,14 +61,26 @@ class CybexRestful:
     """Cybex Restful API sample implementation
 
     """
-    def __init__(self, api_root=api_endpoint_root, clordid_prefix=None, timeout=None):
+    def __init__(self, api_root=api_endpoint_root, clordid_prefix=None, timeout=None, pool_config=None,
+                 session=None, metrics=None, scheduler=None):
         self.logger = logging.getLogger('root')
         self.api_root = api_root
+        self.metrics = metrics if metrics is not None else default_registry
 
-        self.timeout = timeout
+        # Optional shared RequestScheduler, calls are then rate limited and prioritised with other connectors
+        self.scheduler = scheduler
+        self.host = urlparse(api_root).netloc
 
-        # Prepare HTTPS session
-        self.session = requests.Session()
+        if pool_config is None:
+            pool_config = PoolConfig()
+        self.pool_config = pool_config
+
+        self.timeout = timeout if timeout is not None else pool_config.timeout
+
+        # Prepare HTTPS session, every call goes through its keep-alive connection pool
+        if session is None:
+            session = create_session(pool_config)
+        self.session = session
 
         self.session.headers.update({'user-agent': 'cybex-bot'})
         self.session.headers.update({'content-type': 'application/json'})
@@ -71,22 +88,24 @@ class CybexRestful:
 
     def get_instruments(self):
         url = "%s/instrument" % self.api_root
-        return self._handle_response(requests.get(url))
+        return self._request('cybex.instrument', 'GET', url)
 
     def get_order_book(self):
         url = "%s/orderBook" % self.api_root
-        return self._handle_response(requests.get(url))
+        return self._request('cybex.orderBook', 'GET', url)
+
+    def get_order_book_record(self):
+        return decode_order_book(self.get_order_book())
 
     def get_position(self, seller_id):
         url = "%s/position" % self.api_root
         params = {'sellerId': seller_id}
-        return self._handle_response(requests.get(url, params=params))
+        return self._request('cybex.position', 'GET', url, PRIORITY_ORDER_POLL, params=params)
 
     def get_orders(self, account):
         url = "%s/order" % self.api_root
         params = {'accountName': account}
-        headers = {'Content-type': 'application/json'}
-        return self._handle_response(requests.get(url, params=params, headers=headers))
+        return self._request('cybex.order', 'GET', url, PRIORITY_ORDER_POLL, params=params)
 
     def get_bar_data(self):
         pass
@@ -99,15 +118,28 @@ class CybexRestful:
 
     def send_transaction(self, data):
         url = "%s/transaction" % self.api_root
-        headers = {'Content-type': 'application/json'}
-        return self._handle_response(requests.post(url, json=data, headers=headers))
+        cancel = data.get('transactionType') in CANCEL_TRANSACTION_TYPES
+        priority = PRIORITY_CANCEL if cancel else PRIORITY_NEW_ORDER
+        return self._request('cybex.transaction', 'POST', url, priority, json=data)
+
+    def _request(self, endpoint, method, url, priority=PRIORITY_MARKET_DATA, **kwargs):
+        if self.scheduler is None:
+            return self._send(endpoint, method, url, **kwargs)
+        return self.scheduler.call(lambda: self._send(endpoint, method, url, **kwargs), priority, self.host,
+                                   endpoint, coalesce_key_for(method, url, kwargs))
+
+    def _send(self, endpoint, method, url, **kwargs):
+        with self.metrics.measure(endpoint) as measurement:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            measurement.payload(len(response.content))
+            return self._handle_response(response)
 
     def _handle_response(self, response):
         # Return the json object if there is no error
         if not str(response.status_code).startswith('2'):
             raise CybexAPIException(response)
         try:
-            data = response.json()
+            data = decode_response(response)
             if 'Status' in data and data['Status'] == 'Failed':
                 msg = 'Unknown error.'
                 if 'rejectReason' in data:
@@ -119,31 +151,60 @@ class CybexRestful:
 
 
 class SignerConnector:
-    def __init__(self, api_root=signer_endpoint_root):
+    def __init__(self, api_root=signer_endpoint_root, timeout=None, pool_config=None, session=None, metrics=None,
+                 scheduler=None):
         self.api_root = api_root
+        self.metrics = metrics if metrics is not None else default_registry
+        self.scheduler = scheduler
+        self.host = urlparse(api_root).netloc
+
+        if pool_config is None:
+            # Signing has no side effect on the exchange, so POSTs to the signer are safe to retry
+            pool_config = PoolConfig(retry_methods=IDEMPOTENT_METHODS | {'POST'})
+        self.pool_config = pool_config
+
+        self.timeout = timeout if timeout is not None else pool_config.timeout
+
+        if session is None:
+            session = create_session(pool_config)
+        self.session = session
+
+        self.session.headers.update({'content-type': 'application/json'})
+        self.session.headers.update({'accept': 'application/json'})
 
     def prepare_order_message(self, symbol, price, quantity, side):
         url = "%s/newOrder" % self.api_root
         data = {'assetPair': symbol, 'price': price, 'quantity': quantity, 'side': side}
-        headers = {'Content-type': 'application/json'}
-        return self._handle_response(requests.post(url, json=data, headers=headers))
+        return self._request('signer.newOrder', 'POST', url, PRIORITY_NEW_ORDER, json=data)
 
     def prepare_cancel_message(self, trxid):
         url = "%s/cancelOrder" % self.api_root
         data = {'originalTransactionId': trxid}
-        return self._handle_response(requests.post(url, json=data))
+        return self._request('signer.cancelOrder', 'POST', url, PRIORITY_CANCEL, json=data)
 
     def prepare_cancel_all_message(self, symbol):
         url = "%s/cancelAll" % self.api_root
         data = {'assetPair': symbol}
-        return self._handle_response(requests.post(url, json=data))
+        return self._request('signer.cancelAll', 'POST', url, PRIORITY_CANCEL, json=data)
+
+    def _request(self, endpoint, method, url, priority=PRIORITY_MARKET_DATA, **kwargs):
+        if self.scheduler is None:
+            return self._send(endpoint, method, url, **kwargs)
+        return self.scheduler.call(lambda: self._send(endpoint, method, url, **kwargs), priority, self.host,
+                                   endpoint, coalesce_key_for(method, url, kwargs))
+
+    def _send(self, endpoint, method, url, **kwargs):
+        with self.metrics.measure(endpoint) as measurement:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            measurement.payload(len(response.content))
+            return self._handle_response(response)
 
     def _handle_response(self, response):
         # Return the json object if there is no error
         if not str(response.status_code).startswith('2'):
             raise CybexAPIException(response)
         try:
-            data = response.json()
+            data = decode_response(response)
             if 'Status' in data and data['Status'] == 'Failed':
                 msg = 'Unknown error'
                 if 'Message' in data:
@@ -0,0 +1,64 @@
+import json
+from array import array
+
+# Use the fastest JSON backend available, all of them raise a ValueError subclass on bad input
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+
+        json_loads = ujson.loads
+        JSON_BACKEND = 'ujson'
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = 'json'
+
+
+def decode_response(response):
+    # Decode from the raw bytes, skipping the text decoding step of response.json()
+    return json_loads(response.content)
+
+
+class BookRecord:
+    """Order book snapshot stored as four parallel float arrays
+
+    Levels are kept in the order the API returns them, best price first.
+    """
+    __slots__ = ('asset_pair', 'bid_px', 'bid_sz', 'ask_px', 'ask_sz', 'time')
+
+    def __init__(self, asset_pair=None, time=None):
+        self.asset_pair = asset_pair
+        self.time = time
+        self.bid_px = array('d')
+        self.bid_sz = array('d')
+        self.ask_px = array('d')
+        self.ask_sz = array('d')
+
+    def best_bid(self):
+        return self.bid_px[0] if self.bid_px else None
+
+    def best_ask(self):
+        return self.ask_px[0] if self.ask_px else None
+
+    def bids(self):
+        return [[px, sz] for px, sz in zip(self.bid_px, self.bid_sz)]
+
+    def asks(self):
+        return [[px, sz] for px, sz in zip(self.ask_px, self.ask_sz)]
+
+
+def decode_order_book(data):
+    """Map an orderBook payload, levels as [price, size, ...] strings or numbers, into a BookRecord"""
+    record = BookRecord(data.get('assetPair'), data.get('time'))
+    _fill_side(data.get('bids', ()), record.bid_px, record.bid_sz)
+    _fill_side(data.get('asks', ()), record.ask_px, record.ask_sz)
+    return record
+
+
+def _fill_side(levels, px_array, sz_array):
+    px_array.extend([float(level[0]) for level in levels])
+    sz_array.extend([float(level[1]) for level in levels])
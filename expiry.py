@@ -0,0 +1,68 @@
+"""Order time-to-live deadlines
+
+A min-heap of (deadline, trx_id). pop_expired only touches entries whose deadline passed, so checking for
+expired orders costs O(expired log n) however many orders are live. Rescheduling or discarding an order leaves
+its old heap entry behind, it is skipped when it reaches the top.
+"""
+import heapq
+import itertools
+import time
+
+# Seconds an order may rest before it expires and is cancelled
+DEFAULT_ORDER_TTL = 40
+# Seconds before an expired order is looked at again: not yet acknowledged, or its cancel still in flight
+EXPIRY_RETRY = 5
+
+
+class ExpiryScheduler:
+    """Deadlines by trx_id on the time.monotonic clock
+
+    Not thread safe. OrderManager only calls it with its lock held: add_order, remove_order and archive_order
+    on whichever thread changes the orders, expired_orders on the autotrader loop after the order merge.
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.deadlines = {}
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, trx_id):
+        return trx_id in self.deadlines
+
+    def schedule(self, trx_id, ttl, now=None):
+        """Expire trx_id ttl seconds from now, replaces an earlier deadline"""
+        now = self.clock() if now is None else now
+        deadline = now + ttl
+        self.deadlines[trx_id] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.sequence), trx_id))
+        return deadline
+
+    def discard(self, trx_id):
+        self.deadlines.pop(trx_id, None)
+
+    def deadline(self, trx_id):
+        return self.deadlines.get(trx_id)
+
+    def pop_expired(self, now=None):
+        """trx_ids whose deadline passed, in deadline order. They are no longer scheduled"""
+        now = self.clock() if now is None else now
+        expired = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            deadline, sequence, trx_id = heapq.heappop(heap)
+            # Stale entry of an order rescheduled or discarded since
+            if self.deadlines.get(trx_id) != deadline:
+                continue
+            del self.deadlines[trx_id]
+            expired.append(trx_id)
+        # Stale entries can pile up when orders are discarded long before their deadline
+        if len(heap) > 2 * len(self.deadlines) + 64:
+            self._compact()
+        return expired
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if self.deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self.heap)
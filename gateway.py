@@ -0,0 +1,187 @@
+"""Order entry off the strategy thread
+
+Strategies and the console put order intents on an OrderGateway and return at once; gateway workers sign, send
+and register the orders through the OrderManager. A newer target position replaces one still waiting in the
+queue, so a slow exchange never leaves a backlog of stale signals, and the queue is bounded so callers learn
+when order entry cannot keep up.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from metrics import default_registry
+
+GATEWAY_WORKERS = 1
+GATEWAY_QUEUE_SIZE = 64
+
+
+class OrderIntent:
+    """One unit of work for the gateway
+
+    kind is 'target' (OrderManager.handle_signal), 'buy_one' / 'sell_one', 'buy' / 'sell' with price and
+    quantity, or 'cancel' with trx_ids. on_done(intent) runs on the worker once it was handled, with result or
+    error set.
+    """
+    __slots__ = ('kind', 'signal', 'price', 'quantity', 'trx_ids', 'on_done', 'created', 'result', 'error')
+
+    def __init__(self, kind, signal=None, price=None, quantity=None, trx_ids=None, on_done=None):
+        self.kind = kind
+        self.signal = signal
+        self.price = price
+        self.quantity = quantity
+        self.trx_ids = trx_ids
+        self.on_done = on_done
+        self.created = time.monotonic()
+        self.result = None
+        self.error = None
+
+
+class OrderGateway:
+    """Queue of order intents worked off by background threads
+
+    orderbook is the book handle_signal, buy_one and sell_one price from when the intent is handled. Target
+    intents are handled one at a time even with several workers, the others run in parallel. The OrderManager
+    lock keeps its state consistent with order updates applied on other threads.
+    """
+    def __init__(self, om, orderbook, workers=GATEWAY_WORKERS, max_pending=GATEWAY_QUEUE_SIZE, metrics=None):
+        self.om = om
+        self.orderbook = orderbook
+        self.workers = workers
+        self.max_pending = max_pending
+        self.metrics = metrics if metrics is not None else default_registry
+        self.queue = deque()
+        self.cond = threading.Condition()
+        # The target intent still in the queue, replaced in place by newer ones
+        self.pending_target = None
+        self.target_lock = threading.Lock()
+        self.targets_running = 0
+        self.threads = []
+        self.running = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.handled = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='gateway-%d' % i, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the workers once the intents already queued are handled"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def target_busy(self):
+        """True while a target intent is queued or being handled"""
+        return self.pending_target is not None or self.targets_running > 0
+
+    def submit(self, intent, block=False, timeout=None):
+        """Queue an intent, returns False when the queue stayed full (never with block=True and no timeout)"""
+        with self.cond:
+            if intent.kind == 'target' and self.pending_target is not None:
+                # Keep the queue position, only the newest target matters
+                stale = self.pending_target
+                stale.signal = intent.signal
+                stale.on_done = intent.on_done
+                stale.created = intent.created
+                self.coalesced += 1
+                return True
+
+            if len(self.queue) >= self.max_pending:
+                if not block or not self.cond.wait_for(lambda: len(self.queue) < self.max_pending, timeout):
+                    self.dropped += 1
+                    print(datetime.now(), 'order gateway full, dropped', intent.kind)
+                    return False
+
+            self.queue.append(intent)
+            if intent.kind == 'target':
+                self.pending_target = intent
+            self.submitted += 1
+            self.cond.notify_all()
+        return True
+
+    def submit_target(self, signal, on_done=None):
+        return self.submit(OrderIntent('target', signal=signal, on_done=on_done))
+
+    def submit_order(self, side, price, quantity, block=False):
+        return self.submit(OrderIntent(side, price=price, quantity=quantity), block)
+
+    def buy_one(self, block=True):
+        return self.submit(OrderIntent('buy_one'), block)
+
+    def sell_one(self, block=True):
+        return self.submit(OrderIntent('sell_one'), block)
+
+    def cancel(self, trx_ids, block=False):
+        return self.submit(OrderIntent('cancel', trx_ids=list(trx_ids)), block)
+
+    def _next(self):
+        with self.cond:
+            while not self.queue:
+                if not self.running:
+                    return None
+                self.cond.wait()
+            intent = self.queue.popleft()
+            if intent is self.pending_target:
+                self.pending_target = None
+                self.targets_running += 1
+            # Wake producers waiting for room
+            self.cond.notify_all()
+        return intent
+
+    def _handle(self, intent):
+        om = self.om
+        kind = intent.kind
+        if kind == 'target':
+            with self.target_lock:
+                return om.handle_signal(intent.signal, self.orderbook)
+        if kind == 'buy_one':
+            return om.buy_one(self.orderbook)
+        if kind == 'sell_one':
+            return om.sell_one(self.orderbook)
+        if kind == 'buy':
+            return om.buy(intent.price, intent.quantity)
+        if kind == 'sell':
+            return om.sell(intent.price, intent.quantity)
+        if kind == 'cancel':
+            return om.cancel_orders(intent.trx_ids)
+        raise ValueError('unknown order intent %s' % kind)
+
+    def _work(self):
+        while True:
+            intent = self._next()
+            if intent is None:
+                return
+            try:
+                with self.metrics.measure('gateway.%s' % intent.kind):
+                    intent.result = self._handle(intent)
+            except Exception as e:
+                intent.error = e
+                print(datetime.now(), 'order gateway', intent.kind, 'error', e)
+
+            if intent.on_done is not None:
+                try:
+                    intent.on_done(intent)
+                except Exception as e:
+                    print(datetime.now(), 'order gateway callback error', e)
+
+            # Only now, so target_busy() stays True until on_done has run
+            with self.cond:
+                if intent.error is None:
+                    self.handled += 1
+                else:
+                    self.failed += 1
+                if intent.kind == 'target':
+                    self.targets_running -= 1
@@ -0,0 +1,68 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Number of distinct hosts to keep a pool for, and connections kept per host.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.1
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# For venues that ban an IP hammering them after a 429, the rate limit answer goes back to the caller
+SERVER_ERROR_STATUS = (500, 502, 503, 504)
+
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Only idempotent calls are retried after the request reached the server.
+# Connection errors are retried for every method, as nothing was sent yet.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'DELETE'])
+
+
+class PoolConfig:
+    """Connection pool, keep-alive, timeout and retry settings for a connector
+
+    """
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, keep_alive=True,
+                 timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 retry_status=RETRY_STATUS, retry_methods=IDEMPOTENT_METHODS, pool_block=False):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retry_status = retry_status
+        self.retry_methods = retry_methods
+        self.pool_block = pool_block
+
+    def make_retry(self):
+        return Retry(total=self.max_retries,
+                     backoff_factor=self.backoff_factor,
+                     status_forcelist=self.retry_status,
+                     allowed_methods=self.retry_methods,
+                     # Hand the last response back so the connector can raise its own exception
+                     raise_on_status=False)
+
+
+def create_session(config=None, headers=None):
+    if config is None:
+        config = PoolConfig()
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=config.pool_connections,
+                          pool_maxsize=config.pool_maxsize,
+                          max_retries=config.make_retry(),
+                          pool_block=config.pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    if not config.keep_alive:
+        session.headers.update({'connection': 'close'})
+
+    if headers:
+        session.headers.update(headers)
+
+    return session
@@ -0,0 +1,388 @@
+"""Indicator engines for the bar store
+
+The batch functions work over whole NumPy arrays. They reproduce the per-bar MarketDataManager.calc_ema /
+calc_sma arithmetic operation for operation, so the results are bit for bit identical to running those over
+each bar.
+
+The streaming indicators keep O(1) state per bar and are driven by an IndicatorRegistry, which only
+recomputes the bars MarketDataManager marked dirty.
+"""
+import math
+from abc import ABC, abstractmethod
+from itertools import accumulate
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _ema_python(values, k, first):
+    # accumulate drives the recursion from C, the arithmetic is the same as calc_ema
+    return list(accumulate(values[1:].tolist(), lambda prev, value: (value - prev) * k + prev, initial=first))
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _ema_compiled(values, k, first):
+        out = np.empty(values.shape[0])
+        out[0] = first
+        for i in range(1, values.shape[0]):
+            out[i] = (values[i] - out[i - 1]) * k + out[i - 1]
+        return out
+else:
+    _ema_compiled = None
+
+
+def ema(values, k, first=0.0):
+    """out[0] = first, out[i] = (values[i] - out[i - 1]) * k + out[i - 1]
+
+    first is the value already held by the first bar; calc_ema never updates bar 0, which stays at 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[0] == 0:
+        return np.empty(0)
+    if _ema_compiled is not None:
+        return _ema_compiled(values, float(k), float(first))
+    return np.array(_ema_python(values, k, float(first)))
+
+
+def macd(close, fast_period, slow_period, signal_period, ema_fast0=0.0, ema_slow0=0.0, macd0=0.0, signal0=0.0):
+    """EMA fast/slow, MACD and MACD signal for a close series, returns four arrays
+
+    The *0 arguments are the values held by the first bar, which is not recomputed.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    fast_k = 2 / (fast_period + 1)
+    slow_k = 2 / (slow_period + 1)
+    signal_k = 2 / (signal_period + 1)
+
+    ema_fast = ema(close, fast_k, ema_fast0)
+    ema_slow = ema(close, slow_k, ema_slow0)
+    macd_line = ema_fast - ema_slow
+    if macd_line.shape[0]:
+        macd_line[0] = macd0
+    signal = ema(macd_line, signal_k, signal0)
+    return ema_fast, ema_slow, macd_line, signal
+
+
+def rolling_sum(values, period, start):
+    """Sum of the period values before each index, for indexes start to len(values) - 1
+
+    Adds one shifted slice at a time, so each window is summed left to right exactly like calc_sma does,
+    instead of a cumulative sum difference which drifts in the last bits.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[0]
+    if start < period:
+        raise ValueError('start %s must be at least period %s' % (start, period))
+    if n <= start:
+        return np.empty(0)
+    total = np.zeros(n - start)
+    for j in range(period):
+        total += values[start - period + j:n - period + j]
+    return total
+
+
+def sma(values, period, start):
+    """Mean of the period values before each index (calc_sma convention), for indexes start onwards"""
+    return rolling_sum(values, period, start) / period
+
+
+# Number of recent bars whose indicator state is kept, so replacing them only recomputes from there
+STATE_HISTORY = 4
+
+NAN = float('nan')
+
+
+class StreamingIndicator(ABC):
+    """Base class of the streaming indicators
+
+    step(state, bars, index), which every subclass defines, returns the state after bar index and the values to write into the bar store
+    columns named by outputs. States are immutable, so keeping an old one is enough to roll back.
+    """
+    outputs = ()
+
+    def initial_state(self):
+        return None
+
+    def start(self, bars, index):
+        """State after the first bar held and the values to write for it"""
+        return self.step(self.initial_state(), bars, index)
+
+    @abstractmethod
+    def step(self, state, bars, index):
+        pass
+
+    def recompute(self, bars, first, keep_from):
+        """Recompute every bar from first, returns {index: state} for indexes from keep_from"""
+        kept = {}
+        state, values = self.start(bars, first)
+        write_outputs(bars, self.outputs, first, values)
+        if first >= keep_from:
+            kept[first] = state
+        for index in range(first + 1, len(bars)):
+            state, values = self.step(state, bars, index)
+            write_outputs(bars, self.outputs, index, values)
+            if index >= keep_from:
+                kept[index] = state
+        return kept
+
+
+def write_outputs(bars, outputs, index, values):
+    if values is None:
+        return
+    slot = index % bars.capacity
+    for name, value in zip(outputs, values):
+        bars.columns[name][slot] = value
+
+
+def _bar_value(bars, name, index):
+    return bars.columns[name][index % bars.capacity]
+
+
+class MACDIndicator(StreamingIndicator):
+    """EMA fast/slow, MACD and signal, same arithmetic and seeding as MarketDataManager.calc_ema
+
+    The first bar held is not recomputed, its stored values seed the recursion.
+    """
+    def __init__(self, fast_period, slow_period, signal_period,
+                 outputs=('ema_fast', 'ema_slow', 'macd', 'macd_signal')):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.signal_period = signal_period
+        self.fast_k = 2 / (fast_period + 1)
+        self.slow_k = 2 / (slow_period + 1)
+        self.signal_k = 2 / (signal_period + 1)
+        self.outputs = outputs
+
+    def _stored_state(self, bars, index):
+        ema_fast, ema_slow, _, macd_signal = self.outputs
+        return (_bar_value(bars, ema_fast, index), _bar_value(bars, ema_slow, index),
+                _bar_value(bars, macd_signal, index))
+
+    def start(self, bars, index):
+        return self._stored_state(bars, index), None
+
+    def step(self, state, bars, index):
+        last_fast, last_slow, last_signal = state
+        close = _bar_value(bars, 'px_close', index)
+        ema_fast = (close - last_fast) * self.fast_k + last_fast
+        ema_slow = (close - last_slow) * self.slow_k + last_slow
+        macd_value = ema_fast - ema_slow
+        signal = (macd_value - last_signal) * self.signal_k + last_signal
+        return (ema_fast, ema_slow, signal), (ema_fast, ema_slow, macd_value, signal)
+
+    def recompute(self, bars, first, keep_from):
+        ema_fast, ema_slow, macd_name, macd_signal = self.outputs
+        seed = self._stored_state(bars, first) + (_bar_value(bars, macd_name, first),)
+        results = macd(bars.column('px_close'), self.fast_period, self.slow_period, self.signal_period,
+                       seed[0], seed[1], seed[3], seed[2])
+        for name, values in zip(self.outputs, results):
+            bars.set_column(name, values, first)
+        return {index: self._stored_state(bars, index) for index in range(keep_from, len(bars))}
+
+
+class EMAIndicator(StreamingIndicator):
+    """Exponential moving average of a bar column, seeded with the first value"""
+    def __init__(self, period, source='px_close', name=None):
+        self.period = period
+        self.source = source
+        self.k = 2 / (period + 1)
+        self.outputs = (name or 'ema_%s' % period,)
+
+    def step(self, state, bars, index):
+        value = _bar_value(bars, self.source, index)
+        if state is not None:
+            value = (value - state) * self.k + state
+        return value, (value,)
+
+    def recompute(self, bars, first, keep_from):
+        values = bars.column(self.source)
+        result = ema(values, self.k, values[0])
+        bars.set_column(self.outputs[0], result, first)
+        return {index: result[index - first] for index in range(keep_from, len(bars))}
+
+
+class RSIIndicator(StreamingIndicator):
+    """Wilder's relative strength index, NaN until period price changes were seen"""
+    def __init__(self, period=14, name=None):
+        self.period = period
+        self.outputs = (name or 'rsi_%s' % period,)
+
+    def step(self, state, bars, index):
+        close = _bar_value(bars, 'px_close', index)
+        if state is None:
+            return (close, 0.0, 0.0, 0), (NAN,)
+        last_close, avg_gain, avg_loss, count = state
+        change = close - last_close
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        if count < self.period:
+            # Simple average over the first period changes, then Wilder smoothing
+            count += 1
+            avg_gain += (gain - avg_gain) / count
+            avg_loss += (loss - avg_loss) / count
+        else:
+            avg_gain = (avg_gain * (self.period - 1) + gain) / self.period
+            avg_loss = (avg_loss * (self.period - 1) + loss) / self.period
+        state = (close, avg_gain, avg_loss, count)
+        if count < self.period:
+            return state, (NAN,)
+        if avg_loss == 0:
+            return state, (100.0,)
+        return state, (100.0 - 100.0 / (1.0 + avg_gain / avg_loss),)
+
+
+class BollingerIndicator(StreamingIndicator):
+    """Bollinger bands over the last period closes, from a sliding Welford mean and sum of squared deviations
+
+    Sums of closes and squared closes cancel catastrophically at large prices, the deviations kept here do not,
+    and both are recomputed from the window every period bars. The close leaving the window is read back from
+    the bar store, so period must not exceed its capacity.
+    """
+    def __init__(self, period=20, width=2.0, prefix=None):
+        self.period = period
+        self.width = width
+        prefix = prefix or 'bb_%s' % period
+        self.outputs = (prefix + '_mid', prefix + '_upper', prefix + '_lower')
+
+    def initial_state(self):
+        return 0.0, 0.0, 0
+
+    def step(self, state, bars, index):
+        mean, m2, count = state
+        close = _bar_value(bars, 'px_close', index)
+        if count == self.period and index % self.period == 0:
+            # Once per window length start again from the closes themselves, rounding cannot build up
+            window = [_bar_value(bars, 'px_close', i) for i in range(index - count + 1, index + 1)]
+            mean = math.fsum(window) / count
+            m2 = math.fsum((value - mean) * (value - mean) for value in window)
+        elif count == self.period:
+            # Swap the oldest close for the new one in a single update
+            leaving = _bar_value(bars, 'px_close', index - self.period)
+            new_mean = mean + (close - leaving) / count
+            m2 += (close - leaving) * (close - new_mean + leaving - mean)
+            mean = new_mean
+        else:
+            count += 1
+            delta = close - mean
+            mean += delta / count
+            m2 += delta * (close - mean)
+        m2 = max(m2, 0.0)
+        state = (mean, m2, count)
+        if count < self.period:
+            return state, (NAN, NAN, NAN)
+        std = math.sqrt(m2 / count)
+        return state, (mean, mean + self.width * std, mean - self.width * std)
+
+
+class ATRIndicator(StreamingIndicator):
+    """Wilder's average true range, NaN until period true ranges were seen"""
+    def __init__(self, period=14, name=None):
+        self.period = period
+        self.outputs = (name or 'atr_%s' % period,)
+
+    def step(self, state, bars, index):
+        high = _bar_value(bars, 'px_high', index)
+        low = _bar_value(bars, 'px_low', index)
+        close = _bar_value(bars, 'px_close', index)
+        if state is None:
+            last_close, atr, count = None, 0.0, 0
+        else:
+            last_close, atr, count = state
+
+        true_range = high - low
+        if last_close is not None:
+            true_range = max(true_range, abs(high - last_close), abs(low - last_close))
+
+        if count < self.period:
+            count += 1
+            atr += (true_range - atr) / count
+        else:
+            atr = (atr * (self.period - 1) + true_range) / self.period
+        return (close, atr, count), (atr if count >= self.period else NAN,)
+
+
+class VWAPIndicator(StreamingIndicator):
+    """Volume weighted average typical price, restarting every session_seconds of bar start time"""
+    def __init__(self, session_seconds=86400, name='vwap'):
+        self.session_seconds = session_seconds
+        self.outputs = (name,)
+
+    def step(self, state, bars, index):
+        session = int(_bar_value(bars, 'start_time', index) // self.session_seconds)
+        if state is None or state[2] != session:
+            cum_pv, cum_volume = 0.0, 0.0
+        else:
+            cum_pv, cum_volume = state[0], state[1]
+        typical = (_bar_value(bars, 'px_high', index) + _bar_value(bars, 'px_low', index)
+                   + _bar_value(bars, 'px_close', index)) / 3.0
+        volume = _bar_value(bars, 'volume', index)
+        cum_pv += typical * volume
+        cum_volume += volume
+        return (cum_pv, cum_volume, session), (cum_pv / cum_volume if cum_volume > 0 else typical,)
+
+
+class IndicatorRegistry:
+    """Streaming indicators attached to a BarStore
+
+    update(dirty_from) steps every indicator over bars dirty_from onwards, starting from the state kept after
+    bar dirty_from - 1. Replacing the in-progress last bar therefore rolls back to the state before it. When
+    that state is not kept (first update, or a change further back) everything held is recomputed.
+    """
+    def __init__(self, bars):
+        self.bars = bars
+        self.indicators = []
+        self.states = {}
+
+    def register(self, indicator):
+        for name in indicator.outputs:
+            self.bars.add_column(name)
+        self.indicators.append(indicator)
+        self.reset()
+        return indicator
+
+    def reset(self):
+        self.states = {}
+
+    def update(self, dirty_from):
+        """Recompute dirty bars, returns how many bars were recomputed"""
+        bars = self.bars
+        count = len(bars)
+        first = bars.first_index
+        if count == first or not self.indicators:
+            return 0
+
+        if not self.states:
+            return self._recompute_all()
+        if dirty_from is None:
+            return 0
+
+        start = max(dirty_from, first)
+        previous = self.states.get(start - 1)
+        if previous is None:
+            return self._recompute_all()
+
+        states = list(previous)
+        indicators = self.indicators
+        for index in range(start, count):
+            for i, indicator in enumerate(indicators):
+                states[i], values = indicator.step(states[i], bars, index)
+                write_outputs(bars, indicator.outputs, index, values)
+            self.states[index] = tuple(states)
+
+        oldest = count - STATE_HISTORY
+        for index in [index for index in self.states if index < oldest]:
+            del self.states[index]
+        return count - start
+
+    def _recompute_all(self):
+        bars = self.bars
+        first = bars.first_index
+        keep_from = max(first, len(bars) - STATE_HISTORY)
+        kept = [indicator.recompute(bars, first, keep_from) for indicator in self.indicators]
+        self.states = {index: tuple(states[index] for states in kept) for index in range(keep_from, len(bars))}
+        return len(bars) - first
@@ -0,0 +1,234 @@
+"""Incremental L2 order book
+
+Each side keeps its price levels in sorted lists, best price first, so a level insert, modify or delete is a
+binary search plus one list insert or delete. Full snapshots and diffs (a size of 0 deletes the level) are
+both accepted, and the book answers depth queries on top of the best bid / ask.
+"""
+from bisect import bisect_left, bisect_right
+
+
+class BookSide:
+    """Price levels of one side, bids are keyed by negated price so both sides sort best first"""
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self.keys = []
+        self.sizes = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _key(self, px):
+        return -px if self.is_bid else px
+
+    def clear(self):
+        self.keys = []
+        self.sizes = []
+
+    def update(self, px, sz):
+        """Set the size at px, 0 removes the level"""
+        key = self._key(px)
+        i = bisect_left(self.keys, key)
+        found = i < len(self.keys) and self.keys[i] == key
+        if sz > 0:
+            if found:
+                self.sizes[i] = sz
+            else:
+                self.keys.insert(i, key)
+                self.sizes.insert(i, sz)
+        elif found:
+            del self.keys[i]
+            del self.sizes[i]
+
+    def load(self, levels):
+        """Replace every level by [[price, size], ...] in any order"""
+        merged = {}
+        for level in levels:
+            sz = float(level[1])
+            if sz > 0:
+                merged[self._key(float(level[0]))] = sz
+        self.keys = sorted(merged)
+        self.sizes = [merged[key] for key in self.keys]
+
+    def best(self):
+        if not self.keys:
+            return None
+        return -self.keys[0] if self.is_bid else self.keys[0]
+
+    def best_size(self):
+        return self.sizes[0] if self.sizes else 0.0
+
+    def levels(self, depth=None):
+        keys = self.keys if depth is None else self.keys[:depth]
+        sign = -1 if self.is_bid else 1
+        return [[sign * key, sz] for key, sz in zip(keys, self.sizes)]
+
+    def size_through(self, px):
+        """Total size at px or better"""
+        return sum(self.sizes[:bisect_right(self.keys, self._key(px))])
+
+    def size_within(self, depth):
+        return sum(self.sizes[:depth])
+
+    def sweep(self, quantity):
+        """(average price, quantity filled) of taking quantity from the best levels down"""
+        filled = 0.0
+        notional = 0.0
+        sign = -1 if self.is_bid else 1
+        for key, sz in zip(self.keys, self.sizes):
+            take = min(sz, quantity - filled)
+            filled += take
+            notional += take * sign * key
+            if filled >= quantity:
+                break
+        if filled == 0:
+            return None, 0.0
+        return notional / filled, filled
+
+
+class TopOfBook:
+    """Best bid and ask of an L2OrderBook for threads that do not own it
+
+    Reads the (best bid, best ask) tuple the book publishes after every complete update, so a reader never sees
+    a level half applied and needs no lock. Has the get_best_bid / get_best_ask / get_cur_px of OrderBook.
+    """
+    def __init__(self, book):
+        self.book = book
+
+    def get_best_bid(self):
+        return self.book.top[0]
+
+    def get_best_ask(self):
+        return self.book.top[1]
+
+    def get_cur_px(self):
+        best_bid, best_ask = self.book.top
+        if best_bid is not None and best_ask is not None:
+            return (best_ask + best_bid) / 2
+
+        return 0
+
+
+class L2OrderBook:
+    """Order book with incremental updates, drop-in for OrderBook
+
+    bids and asks read as [[price, size], ...] lists best first, and assigning them loads a snapshot of that
+    side, so code written against OrderBook keeps working. Only the thread applying updates may read the
+    levels, other threads read top_view().
+    """
+    def __init__(self):
+        self.bid_side = BookSide(True)
+        self.ask_side = BookSide(False)
+        self.sequence = None
+        self.updates = 0
+        # Replaced, never changed, once an update is fully applied
+        self.top = (None, None)
+
+    def _publish(self):
+        self.top = (self.bid_side.best(), self.ask_side.best())
+
+    def top_view(self):
+        return TopOfBook(self)
+
+    @property
+    def bids(self):
+        return self.bid_side.levels()
+
+    @bids.setter
+    def bids(self, levels):
+        self.bid_side.load(levels)
+        self._publish()
+
+    @property
+    def asks(self):
+        return self.ask_side.levels()
+
+    @asks.setter
+    def asks(self, levels):
+        self.ask_side.load(levels)
+        self._publish()
+
+    def side(self, is_bid):
+        return self.bid_side if is_bid else self.ask_side
+
+    def apply_snapshot(self, bids, asks, sequence=None):
+        self.bid_side.load(bids)
+        self.ask_side.load(asks)
+        self.sequence = sequence
+        self.updates += 1
+        self._publish()
+
+    def apply_record(self, record):
+        """Load a decoder.BookRecord"""
+        self.apply_snapshot(zip(record.bid_px, record.bid_sz), zip(record.ask_px, record.ask_sz))
+
+    def apply_update(self, is_bid, px, sz):
+        """Insert, modify (sz > 0) or delete (sz == 0) one level"""
+        self.side(is_bid).update(float(px), float(sz))
+        self.updates += 1
+        self._publish()
+
+    def apply_diff(self, bids, asks, sequence=None):
+        """Apply changed levels [[price, size], ...] of both sides
+
+        With sequence numbers, a diff not newer than the book is stale and skipped. Returns whether it was applied.
+        """
+        if sequence is not None and self.sequence is not None and sequence <= self.sequence:
+            return False
+        for level in bids:
+            self.bid_side.update(float(level[0]), float(level[1]))
+        for level in asks:
+            self.ask_side.update(float(level[0]), float(level[1]))
+        if sequence is not None:
+            self.sequence = sequence
+        self.updates += 1
+        self._publish()
+        return True
+
+    def get_best_bid(self):
+        return self.bid_side.best()
+
+    def get_best_ask(self):
+        return self.ask_side.best()
+
+    def get_cur_px(self):
+        if self.bid_side.keys and self.ask_side.keys:
+            return (self.ask_side.best() + self.bid_side.best()) / 2
+
+        return 0
+
+    def depth(self, levels=10):
+        return self.bid_side.levels(levels), self.ask_side.levels(levels)
+
+    def cumulative_size(self, is_bid, px):
+        """Size on one side at px or better"""
+        return self.side(is_bid).size_through(float(px))
+
+    def vwap(self, is_buy, quantity):
+        """(average price, quantity available) of a market order for quantity, a buy takes the asks"""
+        return self.side(not is_buy).sweep(quantity)
+
+    def slippage(self, is_buy, quantity):
+        """Price given up against the mid by a market order for quantity, None when that side is empty"""
+        avg_px, filled = self.vwap(is_buy, quantity)
+        mid = self.get_cur_px()
+        if avg_px is None or not mid:
+            return None
+        return avg_px - mid if is_buy else mid - avg_px
+
+    def microprice(self):
+        """Mid weighted by the size at the touch, leans towards the side with less size"""
+        bid = self.bid_side.best()
+        ask = self.ask_side.best()
+        if bid is None or ask is None:
+            return None
+        bid_sz = self.bid_side.best_size()
+        ask_sz = self.ask_side.best_size()
+        return (bid * ask_sz + ask * bid_sz) / (bid_sz + ask_sz)
+
+    def imbalance(self, levels=1):
+        """(bid size - ask size) / total over the top levels, from -1 (all asks) to 1 (all bids)"""
+        bid_sz = self.bid_side.size_within(levels)
+        ask_sz = self.ask_side.size_within(levels)
+        if bid_sz + ask_sz == 0:
+            return 0.0
+        return (bid_sz - ask_sz) / (bid_sz + ask_sz)
@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Histogram resolution: values below 2 ** SUB_BUCKET_BITS are exact, above that every power of two is split
+# into 2 ** (SUB_BUCKET_BITS - 1) linear buckets, i.e. under 1.6% relative error
+SUB_BUCKET_BITS = 7
+MAX_SHIFT = 40
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    """HDR style log-linear histogram of non-negative integer values
+
+    record() is O(1) and memory is fixed, whatever the number of samples.
+    """
+    def __init__(self):
+        self.sub_count = 1 << SUB_BUCKET_BITS
+        self.half_count = self.sub_count >> 1
+        self.counts = [0] * (self.sub_count + MAX_SHIFT * self.half_count)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def _index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = min(value.bit_length() - SUB_BUCKET_BITS, MAX_SHIFT)
+        return self.sub_count + (shift - 1) * self.half_count + min((value >> shift) - self.half_count,
+                                                                    self.half_count - 1)
+
+    def _lowest_value(self, index):
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half_count + 1
+        return (self.half_count + (index - self.sub_count) % self.half_count) << shift
+
+    def record(self, value):
+        value = int(value)
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, pct):
+        with self.lock:
+            if self.count == 0:
+                return 0
+            rank = max(1, int(round(pct / 100.0 * self.count)))
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank:
+                    return min(self._lowest_value(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        result = {'count': self.count, 'min': self.min or 0, 'max': self.max,
+                  'mean': self.total / self.count if self.count else 0}
+        for pct in PERCENTILES:
+            result['p%s' % pct] = self.percentile(pct)
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+
+class EndpointMetrics:
+    def __init__(self):
+        # Latencies are recorded in microseconds, payloads in bytes
+        self.latency_us = Histogram()
+        self.payload_bytes = Histogram()
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add_error(self, exc_type):
+        with self.lock:
+            self.errors[exc_type] = self.errors.get(exc_type, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            errors = dict(self.errors)
+        return {'latency_us': self.latency_us.snapshot(), 'payload_bytes': self.payload_bytes.snapshot(),
+                'errors': errors}
+
+
+class Measurement:
+    """Context manager timing one call, see MetricsRegistry.measure"""
+    __slots__ = ('endpoint', 'start', 'size')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = 0
+        self.size = None
+
+    def payload(self, size):
+        self.size = size
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.endpoint.latency_us.record(elapsed * 1000000)
+        if self.size is not None:
+            self.endpoint.payload_bytes.record(self.size)
+        if exc_type is not None:
+            self.endpoint.add_error(exc_type.__name__)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def endpoint(self, name):
+        metrics = self.endpoints.get(name)
+        if metrics is None:
+            with self.lock:
+                metrics = self.endpoints.setdefault(name, EndpointMetrics())
+        return metrics
+
+    def measure(self, name):
+        """Time a block and count its exception by type name
+
+        with registry.measure('cybex.get_orders') as m:
+            response = session.get(url)
+            m.payload(len(response.content))
+        """
+        return Measurement(self.endpoint(name))
+
+    def snapshot(self):
+        with self.lock:
+            names = list(self.endpoints)
+        return {name: self.endpoints[name].snapshot() for name in sorted(names)}
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def to_prometheus(self):
+        lines = []
+        for name, snap in self.snapshot().items():
+            label = 'endpoint="%s"' % name
+            latency = snap['latency_us']
+            for pct in PERCENTILES:
+                lines.append('cybex_request_latency_us{%s,quantile="%g"} %s'
+                             % (label, pct / 100.0, latency['p%s' % pct]))
+            lines.append('cybex_request_latency_us_count{%s} %s' % (label, latency['count']))
+            lines.append('cybex_request_latency_us_max{%s} %s' % (label, latency['max']))
+            lines.append('cybex_response_bytes_mean{%s} %s' % (label, snap['payload_bytes']['mean']))
+            for exc_type, count in snap['errors'].items():
+                lines.append('cybex_request_errors_total{%s,type="%s"} %s' % (label, exc_type, count))
+        return '\n'.join(lines) + '\n'
+
+
+default_registry = MetricsRegistry()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST, registry=None):
+    """Serve /metrics (prometheus text) and /metrics.json from a daemon thread, returns the server"""
+    if registry is None:
+        registry = default_registry
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics.json':
+                body = json.dumps(registry.snapshot()).encode()
+                content_type = 'application/json'
+            elif self.path == '/metrics':
+                body = registry.to_prometheus().encode()
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = _ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    return server
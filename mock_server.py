@@ -0,0 +1,234 @@
+"""Local stand-in for the Cybex API server and the cyb-signer
+
+Serves the signer under /signer/v1 and the API under /v1 on one port, so
+    SignerConnector('http://127.0.0.1:8090/signer/v1') and CybexRestful('http://127.0.0.1:8090/v1')
+can both point at it. Latency, fills and rejects are injectable.
+
+Usage:
+    python3 mock_server.py --port 8090 --latency 0.002 --fill 0.3 --reject 0.01
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+MOCK_PORT = 8090
+SIGNER_PREFIX = '/signer/v1'
+API_PREFIX = '/v1'
+
+
+class MockConfig:
+    """Behaviour of the mock exchange
+
+    Latencies are in seconds, either a number or a (low, high) range drawn uniformly.
+    fill_probability is the chance an open order fills on each order poll.
+    """
+    def __init__(self, signer_latency=0.0, api_latency=0.0, fill_probability=0.0, reject_probability=0.0,
+                 partial_fill=False, book_mid=100.0, book_levels=10, seed=None):
+        self.signer_latency = signer_latency
+        self.api_latency = api_latency
+        self.fill_probability = fill_probability
+        self.reject_probability = reject_probability
+        self.partial_fill = partial_fill
+        self.book_mid = book_mid
+        self.book_levels = book_levels
+        self.random = random.Random(seed)
+
+    def delay(self, latency):
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(latency[0], latency[1])
+        if latency > 0:
+            time.sleep(latency)
+
+
+class MockExchange:
+    """Order state behind the mock API, shared by all handler threads"""
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.sequence = itertools.count(1)
+        self.trx_counter = itertools.count(1)
+        self.transactions = 0
+
+    def next_trx_id(self, seed):
+        return hashlib.sha1(('%s-%s' % (next(self.trx_counter), seed)).encode()).hexdigest()
+
+    def sign_new_order(self, data):
+        side = data.get('side')
+        return {'transactionType': 'NewLimitOrder', 'transactionId': self.next_trx_id(data),
+                'assetPair': data.get('assetPair'), 'price': data.get('price'), 'quantity': data.get('quantity'),
+                'isBuy': 1 if side == 'buy' else 0, 'txExpiration': int(time.time()) + 3600, 'signature': 'mock'}
+
+    def sign_cancel(self, data):
+        return {'transactionType': 'Cancel', 'transactionId': self.next_trx_id(data),
+                'originalTransactionId': data.get('originalTransactionId'),
+                'txExpiration': int(time.time()) + 3600, 'signature': 'mock'}
+
+    def sign_cancel_all(self, data):
+        return {'transactionType': 'CancelAll', 'transactionId': self.next_trx_id(data),
+                'assetPair': data.get('assetPair'), 'txExpiration': int(time.time()) + 3600, 'signature': 'mock'}
+
+    def transaction(self, data):
+        now = datetime.utcnow().isoformat() + 'Z'
+        trx_type = data.get('transactionType')
+        with self.lock:
+            self.transactions += 1
+            if trx_type == 'NewLimitOrder':
+                sequence = next(self.sequence)
+                rejected = self.config.random.random() < self.config.reject_probability
+                self.orders[data['transactionId']] = {
+                    'transactionId': data['transactionId'], 'orderSequence': sequence,
+                    'assetPair': data.get('assetPair'), 'isBuy': data.get('isBuy'),
+                    'price': data.get('price'), 'quantity': data.get('quantity'),
+                    'orderStatus': 'REJECTED' if rejected else 'OPEN', 'filledQuantity': 0, 'averagePrice': 0,
+                    'remark': 'mock reject' if rejected else ''}
+                return {'Status': 'Successful', 'orderSequence': sequence, 'time': now}
+
+            if trx_type == 'Cancel':
+                order = self.orders.get(data.get('originalTransactionId'))
+                if order is None:
+                    return {'Status': 'Failed', 'rejectReason': 'unknown order', 'time': now}
+                if order['orderStatus'] == 'OPEN':
+                    order['orderStatus'] = 'CANCELED'
+                return {'Status': 'Successful', 'time': now}
+
+            if trx_type == 'CancelAll':
+                for order in self.orders.values():
+                    if order['assetPair'] == data.get('assetPair') and order['orderStatus'] == 'OPEN':
+                        order['orderStatus'] = 'CANCELED'
+                return {'Status': 'Successful', 'time': now}
+
+        return {'Status': 'Failed', 'rejectReason': 'unknown transaction type %s' % trx_type, 'time': now}
+
+    def get_orders(self):
+        config = self.config
+        with self.lock:
+            for order in self.orders.values():
+                if order['orderStatus'] != 'OPEN' or config.random.random() >= config.fill_probability:
+                    continue
+                quantity = order['quantity'] or 0
+                if config.partial_fill and order['filledQuantity'] == 0:
+                    order['filledQuantity'] = round(quantity / 2.0, 2)
+                else:
+                    order['filledQuantity'] = quantity
+                    order['orderStatus'] = 'FILLED'
+                order['averagePrice'] = order['price']
+            return [dict(order) for order in self.orders.values()]
+
+    def get_order_book(self):
+        mid = self.config.book_mid
+        levels = range(1, self.config.book_levels + 1)
+        return {'assetPair': 'ETH/USDT',
+                'bids': [['%.2f' % (mid - 0.1 * i), '1.0'] for i in levels],
+                'asks': [['%.2f' % (mid + 0.1 * i), '1.0'] for i in levels],
+                'time': datetime.utcnow().isoformat() + 'Z'}
+
+    def get_position(self):
+        return {'positions': [], 'time': datetime.utcnow().isoformat() + 'Z'}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, do not let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        exchange = self.server.exchange
+        path = urlparse(self.path).path
+        exchange.config.delay(exchange.config.api_latency)
+        if path == API_PREFIX + '/order':
+            self._reply(exchange.get_orders())
+        elif path == API_PREFIX + '/orderBook':
+            self._reply(exchange.get_order_book())
+        elif path == API_PREFIX + '/position':
+            self._reply(exchange.get_position())
+        elif path == API_PREFIX + '/instrument':
+            self._reply([{'assetPair': 'ETH/USDT'}])
+        else:
+            self._reply({'code': 404, 'msg': 'not found'}, 404)
+
+    def do_POST(self):
+        exchange = self.server.exchange
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+
+        if path.startswith(SIGNER_PREFIX):
+            exchange.config.delay(exchange.config.signer_latency)
+            handler = {SIGNER_PREFIX + '/newOrder': exchange.sign_new_order,
+                       SIGNER_PREFIX + '/cancelOrder': exchange.sign_cancel,
+                       SIGNER_PREFIX + '/cancelAll': exchange.sign_cancel_all}.get(path)
+        else:
+            exchange.config.delay(exchange.config.api_latency)
+            handler = exchange.transaction if path == API_PREFIX + '/transaction' else None
+
+        if handler is None:
+            self._reply({'code': 404, 'msg': 'not found'}, 404)
+        else:
+            self._reply(handler(data))
+
+    def _reply(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=MOCK_PORT, host='127.0.0.1', config=None):
+        HTTPServer.__init__(self, (host, port), MockHandler)
+        self.exchange = MockExchange(config if config is not None else MockConfig())
+
+    @property
+    def root(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    @property
+    def signer_root(self):
+        return self.root + SIGNER_PREFIX
+
+    @property
+    def api_root(self):
+        return self.root + API_PREFIX
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='mock-server')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=MOCK_PORT, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="API server latency in seconds")
+    parser.add_argument("--signer_latency", type=float, default=0.0, help="Signer latency in seconds")
+    parser.add_argument("--fill", type=float, default=0.0, help="Fill probability per order poll")
+    parser.add_argument("--reject", type=float, default=0.0, help="Reject probability per new order")
+    args = parser.parse_args()
+
+    server = MockServer(args.port, config=MockConfig(signer_latency=args.signer_latency, api_latency=args.latency,
+                                                     fill_probability=args.fill,
+                                                     reject_probability=args.reject))
+    print(datetime.now(), 'mock signer on', server.signer_root, 'mock api on', server.api_root)
+    server.serve_forever()
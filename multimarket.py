@@ -0,0 +1,301 @@
+"""Market data for many symbols in shared storage
+
+Bars of every symbol live in blocks of 2-D ring buffers, one row per symbol, and order books in 2-D arrays of
+their top levels. Updates and queries run over whole blocks with NumPy, so a pass over all symbols costs a
+few array operations per block rather than Python work per bar.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from barstore import BarStore, BarView, TIME_COLUMNS, VALUE_COLUMNS
+from ordermanager import OrderBook, FAST_PERIOD, SLOW_PERIOD, SIGNAL_PERIOD
+
+# One day of one minute bars per symbol
+MULTI_BAR_CAPACITY = 24 * 60
+
+# Symbols per block of bar arrays, blocks are allocated as symbols are added
+SYMBOL_BLOCK = 64
+
+BOOK_LEVELS = 10
+BOOK_COLUMNS = ('bid_px', 'bid_sz', 'ask_px', 'ask_sz')
+
+FETCH_WORKERS = 16
+
+PRICE_COLUMNS = ('px_open', 'px_high', 'px_low', 'px_close', 'volume')
+INDICATOR_COLUMNS = VALUE_COLUMNS[5:]
+
+
+class SymbolBlock:
+    """Bar columns of up to size symbols, each a (size, capacity) array"""
+    def __init__(self, size, capacity):
+        self.columns = {name: np.zeros((size, capacity)) for name in TIME_COLUMNS + VALUE_COLUMNS}
+        self.finalized = np.zeros((size, capacity), dtype=bool)
+        self.counts = np.zeros(size, dtype=np.int64)
+
+
+class SharedBarStore(BarStore):
+    """BarStore of one symbol over its row of a SymbolBlock, bar count included"""
+    def __init__(self, block, row, capacity, on_evict=None):
+        self.block = block
+        self.row = row
+        BarStore.__init__(self, capacity, on_evict, {name: column[row] for name, column in block.columns.items()},
+                          block.finalized[row])
+
+    @property
+    def count(self):
+        return int(self.block.counts[self.row])
+
+    @count.setter
+    def count(self, value):
+        self.block.counts[self.row] = value
+
+
+class MultiMarketDataManager:
+    """Bars, MACD and order books of many symbols
+
+    update_bars() takes one bar per symbol for a whole batch of symbols and steps MACD for the bars it appended
+    or changed, with the same arithmetic as MarketDataManager.calc_ema. bars(symbol) is a BarStore of one
+    symbol for everything written against a single MarketDataManager.
+    """
+    def __init__(self, capacity=MULTI_BAR_CAPACITY, block_size=SYMBOL_BLOCK, book_levels=BOOK_LEVELS,
+                 on_evict=None, fetch_workers=FETCH_WORKERS):
+        self.capacity = capacity
+        self.block_size = block_size
+        self.book_levels = book_levels
+        self.on_evict = on_evict
+        self.symbols = []
+        self.positions = {}
+        self.blocks = []
+        self.stores = []
+        self.books = {name: np.full((0, book_levels), np.nan) for name in BOOK_COLUMNS}
+        self.fast_k = 2 / (FAST_PERIOD + 1)
+        self.slow_k = 2 / (SLOW_PERIOD + 1)
+        self.signal_k = 2 / (SIGNAL_PERIOD + 1)
+        self.fetch_workers = fetch_workers
+        self.executor = None
+
+    def add_symbol(self, symbol):
+        """Position of symbol in every cross symbol array, adding it if new"""
+        position = self.positions.get(symbol)
+        if position is not None:
+            return position
+
+        position = len(self.symbols)
+        row = position % self.block_size
+        if row == 0:
+            self.blocks.append(SymbolBlock(self.block_size, self.capacity))
+        on_evict = None
+        if self.on_evict is not None:
+            on_evict = lambda index, view, symbol=symbol: self.on_evict(symbol, index, view)
+        self.stores.append(SharedBarStore(self.blocks[-1], row, self.capacity, on_evict))
+        self.symbols.append(symbol)
+        self.positions[symbol] = position
+
+        allocated = len(self.books['bid_px'])
+        if position >= allocated:
+            grow = max(self.block_size, allocated)
+            for name in BOOK_COLUMNS:
+                self.books[name] = np.vstack((self.books[name], np.full((grow, self.book_levels), np.nan)))
+        return position
+
+    def add_symbols(self, symbols):
+        return [self.add_symbol(symbol) for symbol in symbols]
+
+    def bars(self, symbol):
+        return self.stores[self.positions[symbol]]
+
+    def get_bar_count(self, symbol):
+        return len(self.bars(symbol))
+
+    def bar_counts(self):
+        """Number of bars ever appended, for every symbol in position order"""
+        return np.concatenate([block.counts for block in self.blocks])[:len(self.symbols)] if self.blocks \
+            else np.zeros(0, dtype=np.int64)
+
+    def update_bars(self, symbols, start_time, px_open, px_high, px_low, px_close, volume, end_time=None):
+        """Upsert one bar for each of symbols, values are sequences aligned with symbols, times in epoch seconds
+
+        Same rule as MarketDataManager.update_bar_data: a newer bar is appended, a bar with the start time of the
+        last one replaces it if it changed, anything older is ignored. A symbol may appear only once per call.
+        Returns the symbols whose newest bar was appended or changed.
+        """
+        positions = np.array(self.add_symbols(symbols), dtype=np.int64)
+        values = {'start_time': np.asarray(start_time, dtype=float), 'px_open': np.asarray(px_open, dtype=float),
+                  'px_high': np.asarray(px_high, dtype=float), 'px_low': np.asarray(px_low, dtype=float),
+                  'px_close': np.asarray(px_close, dtype=float), 'volume': np.asarray(volume, dtype=float)}
+        values['end_time'] = values['start_time'] if end_time is None else np.asarray(end_time, dtype=float)
+
+        changed = []
+        block_ids = positions // self.block_size
+        for block_id in np.unique(block_ids):
+            mask = block_ids == block_id
+            rows = self._update_block(int(block_id), positions[mask] % self.block_size,
+                                      {name: value[mask] for name, value in values.items()})
+            changed.extend(self.symbols[block_id * self.block_size + row] for row in rows)
+        return changed
+
+    def _update_block(self, block_id, rows, values):
+        block = self.blocks[block_id]
+        columns = block.columns
+        capacity = self.capacity
+        counts = block.counts[rows]
+
+        last_slots = (counts - 1) % capacity
+        last_start = np.where(counts > 0, columns['start_time'][rows, last_slots], -np.inf)
+        new = values['start_time'] > last_start
+        changed = values['start_time'] == last_start
+        if changed.any():
+            differs = np.zeros(len(rows), dtype=bool)
+            for name in PRICE_COLUMNS + ('end_time',):
+                differs |= columns[name][rows, last_slots] != values[name]
+            changed &= differs
+
+        if self.on_evict is not None:
+            for i in np.flatnonzero(new & (counts >= capacity)):
+                position = block_id * self.block_size + rows[i]
+                self.on_evict(self.symbols[position], int(counts[i]) - capacity,
+                              BarView(self.stores[position], int(counts[i]) % capacity))
+
+        slots = np.where(new, counts % capacity, last_slots)
+        write = new | changed
+        write_rows = rows[write]
+        write_slots = slots[write]
+        for name in TIME_COLUMNS + PRICE_COLUMNS:
+            columns[name][write_rows, write_slots] = values[name][write]
+        new_rows = rows[new]
+        new_slots = slots[new]
+        for name in INDICATOR_COLUMNS:
+            columns[name][new_rows, new_slots] = 0
+        block.finalized[new_rows, new_slots] = False
+        block.counts[new_rows] += 1
+
+        self._step_macd(block, write_rows, write_slots)
+        return write_rows
+
+    def _step_macd(self, block, rows, slots):
+        # calc_ema for the newest bar of each row, the first bar held has no previous bar
+        counts = block.counts[rows]
+        keep = counts - 1 > np.maximum(counts - self.capacity, 0)
+        rows = rows[keep]
+        slots = slots[keep]
+        previous = (slots - 1) % self.capacity
+        columns = block.columns
+
+        close = columns['px_close'][rows, slots]
+        last_fast = columns['ema_fast'][rows, previous]
+        last_slow = columns['ema_slow'][rows, previous]
+        last_signal = columns['macd_signal'][rows, previous]
+        ema_fast = (close - last_fast) * self.fast_k + last_fast
+        ema_slow = (close - last_slow) * self.slow_k + last_slow
+        macd = ema_fast - ema_slow
+        columns['ema_fast'][rows, slots] = ema_fast
+        columns['ema_slow'][rows, slots] = ema_slow
+        columns['macd'][rows, slots] = macd
+        columns['macd_signal'][rows, slots] = (macd - last_signal) * self.signal_k + last_signal
+
+    def apply_ohlcv(self, results):
+        """Apply {symbol: [[ms, open, high, low, close, volume], ...]}, the ccxt fetch_ohlcv format
+
+        Bars are applied one start time at a time, each start time being one update_bars call over every symbol
+        that has a bar for it. Returns the set of symbols that changed.
+        """
+        by_time = {}
+        for symbol, rows in results.items():
+            for row in rows:
+                by_time.setdefault(row[0], {})[symbol] = row
+
+        changed = set()
+        for ms in sorted(by_time):
+            bars = by_time[ms]
+            data = np.array([row[1:6] for row in bars.values()], dtype=float)
+            changed.update(self.update_bars(list(bars), np.full(len(bars), ms / 1000.0), data[:, 0], data[:, 1],
+                                            data[:, 2], data[:, 3], data[:, 4]))
+        return changed
+
+    def fetch_ohlcv(self, fetch, symbols, since=None):
+        """Call fetch(symbol, since) for every symbol in parallel (e.g. ccxt fetch_ohlcv) and apply the bars
+
+        A symbol whose fetch failed is reported and left as it was. Returns the set of symbols that changed.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='market-data')
+        futures = [(symbol, self.executor.submit(fetch, symbol, since)) for symbol in symbols]
+        results = {}
+        for symbol, future in futures:
+            try:
+                results[symbol] = future.result()
+            except Exception as e:
+                print(datetime.now(), 'Unable to get bars for', symbol, e)
+        return self.apply_ohlcv(results)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def update_order_book(self, symbol, bids, asks):
+        """Keep the top book_levels of [[price, size], ...] bids and asks"""
+        position = self.add_symbol(symbol)
+        for prefix, levels in (('bid', bids), ('ask', asks)):
+            px = self.books[prefix + '_px'][position]
+            sz = self.books[prefix + '_sz'][position]
+            px[:] = np.nan
+            sz[:] = np.nan
+            depth = min(len(levels), self.book_levels)
+            for i in range(depth):
+                px[i] = levels[i][0]
+                sz[i] = levels[i][1]
+
+    def get_order_book(self, symbol):
+        """OrderBook of symbol, as MarketDataManager.get_order_book() returns it"""
+        position = self.positions[symbol]
+        book = OrderBook()
+        for prefix, side in (('bid', book.bids), ('ask', book.asks)):
+            px = self.books[prefix + '_px'][position]
+            sz = self.books[prefix + '_sz'][position]
+            for i in range(self.book_levels):
+                if np.isnan(px[i]):
+                    break
+                side.append([float(px[i]), float(sz[i])])
+        return book
+
+    def best_bids(self):
+        return self.books['bid_px'][:len(self.symbols), 0]
+
+    def best_asks(self):
+        return self.books['ask_px'][:len(self.symbols), 0]
+
+    def column_at(self, name, at=-1):
+        """Column value of bar at for every symbol, negative at counts back from the newest bar
+
+        NaN for symbols that do not hold that bar.
+        """
+        result = np.full(len(self.symbols), np.nan)
+        for block_id, block in enumerate(self.blocks):
+            offset = block_id * self.block_size
+            n = min(self.block_size, len(self.symbols) - offset)
+            counts = block.counts[:n]
+            index = counts + at if at < 0 else np.full(n, at)
+            held = (index >= np.maximum(counts - self.capacity, 0)) & (index < counts)
+            rows = np.flatnonzero(held)
+            result[offset:offset + n][held] = block.columns[name][rows, index[held] % self.capacity]
+        return result
+
+    def macd_crosses(self, at=-2):
+        """{symbol: 1 or -1} for every symbol whose MACD crossed its signal up or down at bar at
+
+        Same rule as MarketDataManager.check_signal, at=-2 being the last finished bar as autotrader checks it.
+        """
+        this_diff = self.column_at('macd', at) - self.column_at('macd_signal', at)
+        last_diff = self.column_at('macd', at - 1) - self.column_at('macd_signal', at - 1)
+        counts = self.bar_counts()
+        index = counts + at if at < 0 else np.full(len(counts), at)
+        enough = index > SLOW_PERIOD
+
+        crosses = {}
+        for position in np.flatnonzero(enough & (last_diff < 0) & (this_diff > 0)):
+            crosses[self.symbols[position]] = 1
+        for position in np.flatnonzero(enough & (this_diff < 0) & (last_diff > 0)):
+            crosses[self.symbols[position]] = -1
+        return crosses
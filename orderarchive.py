@@ -0,0 +1,222 @@
+"""Compact storage for orders that reached a terminal status
+
+Orders are appended as fixed size records into NumPy chunks and only the newest resident_chunks stay in
+memory, so memory stays flat however many orders a run goes through. With a spill file full chunks are written
+to it before they leave memory, and flush() or close() write the chunk being filled, without one the oldest
+chunks are dropped and only their fills stay in the totals. Lookups by trx_id hit a dict for resident orders and a sorted array of 64-bit trx_id hashes for spilled
+ones, 16 bytes per spilled order, then read the one matching record from the file.
+"""
+import calendar
+import hashlib
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+ARCHIVE_CHUNK = 4096
+RESIDENT_CHUNKS = 4
+
+ARCHIVE_DTYPE = np.dtype([('trx_id', 'S64'), ('side', 'i1'), ('status', 'S1'), ('price', '<f8'),
+                          ('quantity', '<f8'), ('filled', '<f8'), ('avg_price', '<f8'), ('order_sequence', '<i8'),
+                          ('created', '<f8'), ('closed', '<f8')])
+
+SIDE_CODES = {'buy': 1, 'sell': -1}
+SIDE_NAMES = {1: 'buy', -1: 'sell', 0: None}
+
+
+def trx_id_hash(trx_id):
+    """Stable 64-bit hash of a trx_id (str or bytes) for the spill index"""
+    if isinstance(trx_id, str):
+        trx_id = trx_id.encode()
+    return int.from_bytes(hashlib.blake2b(trx_id, digest_size=8).digest(), 'little')
+
+
+class ArchivedOrder:
+    """Read-only view of an archive record with the Order attribute names, times in epoch seconds"""
+    __slots__ = ('trx_id', 'side', 'order_status', 'price', 'quantity', 'filled', 'avg_price', 'order_sequence',
+                 'created', 'closed')
+
+    def __init__(self, record, status_by_value):
+        self.trx_id = record['trx_id'].decode()
+        self.side = SIDE_NAMES[int(record['side'])]
+        self.order_status = status_by_value.get(record['status'].decode())
+        self.price = float(record['price'])
+        self.quantity = float(record['quantity'])
+        self.filled = float(record['filled'])
+        self.avg_price = float(record['avg_price'])
+        self.order_sequence = int(record['order_sequence'])
+        self.created = float(record['created'])
+        self.closed = float(record['closed'])
+
+
+class OrderArchive:
+    """Append-only archive of terminal orders, keeps filled totals for PnL
+
+    The totals only cover orders archived by this process, records already in the spill file are kept for
+    lookups. Without spill_path at most resident_chunks * chunk_size orders can be looked up, dropped counts
+    the ones that could not. status_by_value maps the stored status character back to an OrderStatus, see
+    ArchivedOrder.
+    """
+    def __init__(self, spill_path=None, chunk_size=ARCHIVE_CHUNK, resident_chunks=RESIDENT_CHUNKS,
+                 status_by_value=None):
+        self.spill_path = spill_path
+        self.chunk_size = chunk_size
+        self.resident_chunks = resident_chunks
+        self.status_by_value = status_by_value or {}
+        # (chunk number, records) of the chunks in memory, the last one is being filled
+        self.chunks = deque()
+        self.filled_rows = 0
+        # Rows of the chunk being filled already in the spill file
+        self.flushed_rows = 0
+        self.chunk_count = 0
+        self.index = {}
+        self.spilled = 0
+        self.dropped = 0
+        self.count = 0
+        # Spilled rows by trx_id hash: sorted hashes and their rows, plus chunks not merged in yet
+        self.spill_hashes = np.zeros(0, dtype='<u8')
+        self.spill_rows = np.zeros(0, dtype='<i8')
+        self.unmerged = []
+        self.spill_map = None
+        self.total_buy = 0
+        self.total_sell = 0
+        self.buy_notional = 0
+        self.sell_notional = 0
+        if spill_path is not None and os.path.exists(spill_path):
+            self.spilled = os.path.getsize(spill_path) // ARCHIVE_DTYPE.itemsize
+            self.count = self.spilled
+            # Drop a record cut short by a crash, later records must stay aligned
+            if os.path.getsize(spill_path) != self.spilled * ARCHIVE_DTYPE.itemsize:
+                os.truncate(spill_path, self.spilled * ARCHIVE_DTYPE.itemsize)
+            if self.spilled:
+                records = np.memmap(spill_path, dtype=ARCHIVE_DTYPE, mode='r', shape=(self.spilled,))
+                for start in range(0, self.spilled, self.chunk_size):
+                    self._index_spilled(records['trx_id'][start:start + self.chunk_size], start)
+        self._new_chunk()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, trx_id):
+        return self.get(trx_id) is not None
+
+    def _new_chunk(self):
+        self.chunks.append((self.chunk_count, np.zeros(self.chunk_size, dtype=ARCHIVE_DTYPE)))
+        self.chunk_count += 1
+        self.filled_rows = 0
+        self.flushed_rows = 0
+
+    def _add_totals(self, side, filled, avg_price):
+        if filled > 0:
+            if side == 'sell':
+                self.total_sell += filled
+                self.sell_notional += filled * avg_price
+            elif side == 'buy':
+                self.total_buy += filled
+                self.buy_notional += filled * avg_price
+
+    def add(self, order, closed=None):
+        """Archive an Order, timestamps are stored as epoch seconds"""
+        number, records = self.chunks[-1]
+        row = self.filled_rows
+        record = records[row]
+        record['trx_id'] = order.trx_id.encode()
+        record['side'] = SIDE_CODES.get(order.side, 0)
+        record['status'] = order.order_status.value.encode() if order.order_status is not None else b''
+        record['price'] = order.price or 0
+        record['quantity'] = order.quantity or 0
+        record['filled'] = order.filled or 0
+        record['avg_price'] = order.avg_price or 0
+        record['order_sequence'] = order.order_sequence or 0
+        # Order.timestamp is a naive UTC datetime
+        record['created'] = calendar.timegm(order.timestamp.utctimetuple()) + order.timestamp.microsecond / 1e6
+        record['closed'] = closed if closed is not None else time.time()
+        self.index[order.trx_id] = (number, row)
+        self._add_totals(order.side, order.filled or 0, order.avg_price or 0)
+        self.count += 1
+
+        self.filled_rows += 1
+        if self.filled_rows == self.chunk_size:
+            self._rotate()
+
+    def _spill(self):
+        # Append the rows of the chunk being filled that are not in the spill file yet
+        number, records = self.chunks[-1]
+        rows = records[self.flushed_rows:self.filled_rows]
+        if len(rows):
+            with open(self.spill_path, 'ab') as f:
+                f.write(rows.tobytes())
+            self._index_spilled(rows['trx_id'], self.spilled)
+            self.spilled += len(rows)
+            self.flushed_rows = self.filled_rows
+
+    def flush(self):
+        """Write the orders archived since the last full chunk to the spill file, if there is one"""
+        if self.spill_path is not None:
+            self._spill()
+
+    def close(self):
+        """flush() and release the spill file, call once no more orders are archived"""
+        self.flush()
+        self.spill_map = None
+
+    def _rotate(self):
+        if self.spill_path is not None:
+            self._spill()
+        while len(self.chunks) >= self.resident_chunks:
+            number, records = self.chunks.popleft()
+            if self.spill_path is None:
+                self.dropped += len(records)
+            for trx_id in records['trx_id']:
+                self.index.pop(trx_id.decode(), None)
+        self._new_chunk()
+
+    def _index_spilled(self, trx_ids, first_row):
+        hashes = np.fromiter((trx_id_hash(trx_id) for trx_id in trx_ids), dtype='<u8', count=len(trx_ids))
+        self.unmerged.append((hashes, np.arange(first_row, first_row + len(trx_ids), dtype='<i8')))
+
+    def _spill_map(self):
+        # Remapped once more chunks were spilled since the last lookup
+        if self.spill_map is None or len(self.spill_map) != self.spilled:
+            self.spill_map = np.memmap(self.spill_path, dtype=ARCHIVE_DTYPE, mode='r', shape=(self.spilled,))
+        return self.spill_map
+
+    def _spill_index(self):
+        # Merged on the first lookup after a spill, so a run that never looks up never sorts
+        if self.unmerged:
+            hashes = np.concatenate([self.spill_hashes] + [h for h, rows in self.unmerged])
+            rows = np.concatenate([self.spill_rows] + [rows for h, rows in self.unmerged])
+            order = np.argsort(hashes, kind='stable')
+            self.spill_hashes = hashes[order]
+            self.spill_rows = rows[order]
+            self.unmerged = []
+        return self.spill_hashes, self.spill_rows
+
+    def get(self, trx_id):
+        """ArchivedOrder for trx_id, None when it was never archived"""
+        location = self.index.get(trx_id)
+        if location is not None:
+            number, row = location
+            for chunk_number, records in self.chunks:
+                if chunk_number == number:
+                    return ArchivedOrder(records[row], self.status_by_value)
+        if self.spilled:
+            hashes, rows = self._spill_index()
+            key = np.uint64(trx_id_hash(trx_id))
+            first = np.searchsorted(hashes, key, 'left')
+            last = np.searchsorted(hashes, key, 'right')
+            if last > first:
+                records = self._spill_map()
+                encoded = trx_id.encode()
+                # Newest first, the same trx_id may have been archived again after a restart
+                for row in sorted(rows[first:last], reverse=True):
+                    if records[row]['trx_id'] == encoded:
+                        return ArchivedOrder(records[row], self.status_by_value)
+        return None
+
+    def records(self):
+        """Resident records in archive order, the spilled ones are in the spill file"""
+        chunks = [records for number, records in self.chunks]
+        chunks[-1] = chunks[-1][:self.filled_rows]
+        return np.concatenate(chunks)
@@ -1,13 +1,28 @@
 import sys
+import threading
+import time
 import requests
 from enum import Enum
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from cybexapi_connector import SignerConnector, CybexRestful, CybexException
+from cancelcache import CancelCache, CANCEL_CACHE_SIZE
+from orderarchive import OrderArchive
+from expiry import ExpiryScheduler, DEFAULT_ORDER_TTL, EXPIRY_RETRY
+from barstore import BarStore, BAR_CAPACITY, to_timestamp
+from l2book import L2OrderBook
+import indicators
 
 FAST_PERIOD = 12
 SLOW_PERIOD = 26
 SIGNAL_PERIOD = 9
 
+# Number of delta syncs between two unconditional full resyncs
+FULL_RESYNC_INTERVAL = 100
+
+# Cancels of one cancel_orders call sent at the same time
+CANCEL_WORKERS = 8
+
 
 class OrderStatus(Enum):
     New = '0'
@@ -19,6 +34,26 @@ class OrderStatus(Enum):
     PendingNew = 'A'
 
 
+TERMINAL_STATUSES = frozenset([OrderStatus.Filled, OrderStatus.Canceled, OrderStatus.Rejected])
+
+# Statuses whose unfilled quantity counts towards buy_open / sell_open
+OPEN_STATUSES = frozenset([OrderStatus.PendingNew, OrderStatus.New, OrderStatus.PartiallyFilled,
+                           OrderStatus.PendingCancel])
+
+# Relative tolerance of check_consistency for the incrementally kept float totals
+CONSISTENCY_TOLERANCE = 1e-9
+
+# api server order status names, same sequence as the sbe definition
+ORDER_STATUS_BY_NAME = {
+    'PENDING_NEW': OrderStatus.PendingNew,
+    'OPEN': OrderStatus.New,
+    'PENDING_CXL': OrderStatus.PendingCancel,
+    'CANCELED': OrderStatus.Canceled,
+    'FILLED': OrderStatus.Filled,
+    'REJECTED': OrderStatus.Rejected,
+}
+
+
 class Order:
     def __init__(self):
         self.seller = None
@@ -34,6 +69,19 @@ class Order:
         self.timestamp = datetime.utcnow()
 
 
+class OrderUpdate:
+    """Compact order state decoded from an api server order record"""
+    __slots__ = ('trx_id', 'order_status', 'order_sequence', 'filled', 'avg_price', 'quantity')
+
+    def __init__(self, trx_id, order_status, order_sequence, filled, avg_price, quantity=None):
+        self.trx_id = trx_id
+        self.order_status = order_status
+        self.order_sequence = order_sequence
+        self.filled = filled
+        self.avg_price = avg_price
+        self.quantity = quantity
+
+
 class BarData:
     def __init__(self):
         self.start_time = datetime.fromtimestamp(0)
@@ -75,11 +123,21 @@ class OrderBook:
 
 
 class MarketDataManager:
-    def __init__(self):
-        self.bars = []
-        self.order_book = OrderBook()
+    def __init__(self, capacity=BAR_CAPACITY, on_evict=None):
+        # Bars live in a columnar ring buffer, bars[i] still reads and writes like a BarData
+        self.bars = BarStore(capacity, on_evict)
+        # Incremental book, reads like OrderBook
+        self.order_book = L2OrderBook()
         self.best_bid = 0
         self.best_ask = 0
+        # Streaming indicators, recomputed from the oldest bar changed since the last update_indicators()
+        self.indicators = indicators.IndicatorRegistry(self.bars)
+        self.indicators.register(indicators.MACDIndicator(FAST_PERIOD, SLOW_PERIOD, SIGNAL_PERIOD))
+        self.dirty_from = None
+        # Start (ms) of the bar after the last finalized one, where the next incremental fetch starts
+        self.ohlcv_cursor = None
+        # Optional barfile.BarFile, finalized bars are appended to it as they close
+        self.history = None
 
     def get_order_book(self):
         return self.order_book
@@ -87,28 +145,171 @@ class MarketDataManager:
     def is_new_bar(self, bar):
         if len(self.bars) == 0:
             return True
-        return self.bars[-1].start_time < bar.start_time
+        return self.bars.last_start_time() < to_timestamp(bar.start_time)
+
+    def load_history(self, history):
+        """Load the newest bars of a BarFile into an empty manager and keep appending finalized bars to it"""
+        records = history.records(max(0, len(history) - self.bars.capacity))
+        if len(records):
+            self.bars.extend({name: records[name] for name in records.dtype.names})
+            self.ohlcv_cursor = int(self.bars.last_start_time() * 1000)
+            self.mark_dirty(self.bars.first_index)
+            self.indicators.reset()
+        self.history = history
+        return len(records)
+
+    def finalize_last(self):
+        """Mark the newest bar finalized, it no longer changes and goes to the history file"""
+        bar = self.bars[-1]
+        if bar.finalized:
+            return
+        bar.finalized = True
+        if self.history is not None:
+            self.history.append_bar(bar)
 
     def update_bar_data(self, bar):
         if self.is_new_bar(bar):
+            if len(self.bars) > 0:
+                self.finalize_last()
             self.bars.append(bar)
+            self.mark_dirty(len(self.bars) - 1)
             # print('insert a bar, current length', len(self.bars))
-        elif self.bars[-1].start_time == bar.start_time:
-            self.bars[-1] = bar
+        elif self.bars.last_start_time() == to_timestamp(bar.start_time):
+            # Refetched bars usually did not change, leave them and their indicators alone
+            if not self.same_bar(self.bars[-1], bar):
+                self.bars[-1] = bar
+                self.mark_dirty(len(self.bars) - 1)
+
+    def ohlcv_since(self, default):
+        """Where to start the next OHLCV request, in ms: the in-progress bar once bars were synced"""
+        return self.ohlcv_cursor if self.ohlcv_cursor is not None else default
+
+    def sync_ohlcv(self, rows, rewrite=False):
+        """Apply [[ms, open, high, low, close, volume], ...] rows (ccxt fetch_ohlcv format) in time order
+
+        Rows of finalized bars are skipped without building anything, the in-progress bar is updated in place
+        when it changed, and a newer row finalizes the bar before it. With rewrite, rows of finalized bars still
+        in the store overwrite them instead, e.g. after trades were missed; the history file keeps what it
+        already has. Returns the number of bars changed.
+        """
+        bars = self.bars
+        columns = bars.columns
+        changed = 0
+        for row in rows:
+            start = row[0] / 1000.0
+            last_start = bars.last_start_time()
+            if last_start is not None and start < last_start:
+                if rewrite and self._rewrite_bar(start, row):
+                    changed += 1
+                continue
+
+            px_open, px_high, px_low, px_close, volume = (float(value) for value in row[1:6])
+            if last_start is not None and start == last_start:
+                slot = (len(bars) - 1) % bars.capacity
+                if (columns['px_open'][slot] == px_open and columns['px_high'][slot] == px_high
+                        and columns['px_low'][slot] == px_low and columns['px_close'][slot] == px_close
+                        and columns['volume'][slot] == volume):
+                    continue
+                bars.set_values(-1, start, px_open, px_high, px_low, px_close, volume)
+            else:
+                if last_start is not None:
+                    self.finalize_last()
+                bars.append_values(start, px_open, px_high, px_low, px_close, volume)
+            self.mark_dirty(len(bars) - 1)
+            changed += 1
+
+        if len(bars) > 0:
+            self.ohlcv_cursor = int(bars.last_start_time() * 1000)
+        return changed
+
+    def _rewrite_bar(self, start, row):
+        # Walk back from the newest bar, resync windows only span a few bars
+        bars = self.bars
+        starts = bars.columns['start_time']
+        for index in range(len(bars) - 1, bars.first_index - 1, -1):
+            stored = starts[index % bars.capacity]
+            if stored < start:
+                return False
+            if stored == start:
+                bars.set_values(index, start, *(float(value) for value in row[1:6]))
+                self.mark_dirty(index)
+                return True
+        return False
+
+    @staticmethod
+    def same_bar(stored, bar):
+        return (stored.px_open == bar.px_open and stored.px_high == bar.px_high and stored.px_low == bar.px_low
+                and stored.px_close == bar.px_close and stored.volume == bar.volume
+                and to_timestamp(stored.end_time) == to_timestamp(bar.end_time))
+
+    def mark_dirty(self, index):
+        if self.dirty_from is None or index < self.dirty_from:
+            self.dirty_from = index
+
+    def apply_trade(self, timestamp, px, qty, bar_seconds=60):
+        """Fold one trade into the bar it falls in, timestamp in epoch seconds
+
+        A trade in a new bar finalizes the previous one, trades older than the last bar are ignored.
+        """
+        start = timestamp - timestamp % bar_seconds
+        last_start = self.bars.last_start_time()
+        if last_start is None or last_start < start:
+            if last_start is not None:
+                self.finalize_last()
+            self.bars.append_values(start, px, px, px, px, qty)
+        elif last_start == start:
+            columns = self.bars.columns
+            slot = (len(self.bars) - 1) % self.bars.capacity
+            if px > columns['px_high'][slot]:
+                columns['px_high'][slot] = px
+            if px < columns['px_low'][slot]:
+                columns['px_low'][slot] = px
+            columns['px_close'][slot] = px
+            columns['volume'][slot] += qty
+        else:
+            return
+        self.mark_dirty(len(self.bars) - 1)
+
+    def register_indicator(self, indicator):
+        """Add a streaming indicator, its outputs become bar store columns"""
+        return self.indicators.register(indicator)
+
+    def update_indicators(self):
+        """Bring every registered indicator up to date, returns the number of bars recomputed"""
+        recomputed = self.indicators.update(self.dirty_from)
+        self.dirty_from = None
+        return recomputed
 
     def redo_sma(self):
-        if SLOW_PERIOD > len(self.bars):
+        # Same result as calc_sma over every bar, computed over the whole close column at once
+        first = self.bars.first_index
+        if len(self.bars) - first <= SLOW_PERIOD:
             return
 
-        for i in range(SLOW_PERIOD, len(self.bars)):
-            self.calc_sma(i)
+        close = self.bars.column('px_close')
+        self.bars.set_column('sma_fast', indicators.sma(close, FAST_PERIOD, SLOW_PERIOD), first + SLOW_PERIOD)
+        self.bars.set_column('sma_slow', indicators.sma(close, SLOW_PERIOD, SLOW_PERIOD), first + SLOW_PERIOD)
 
     def redo_ema(self):
-        for i in range(0, len(self.bars)):
-            self.calc_ema(i)
+        # Same result as calc_ema over every bar, the first bar held keeps its values as the seed
+        first = self.bars.first_index
+        if len(self.bars) - first < 2:
+            return
+
+        seed = self.bars[first]
+        ema_fast, ema_slow, macd, macd_signal = indicators.macd(self.bars.column('px_close'), FAST_PERIOD,
+                                                                SLOW_PERIOD, SIGNAL_PERIOD, seed.ema_fast,
+                                                                seed.ema_slow, seed.macd, seed.macd_signal)
+        self.bars.set_column('ema_fast', ema_fast, first)
+        self.bars.set_column('ema_slow', ema_slow, first)
+        self.bars.set_column('macd', macd, first)
+        self.bars.set_column('macd_signal', macd_signal, first)
+        # Kept indicator states no longer match the columns
+        self.indicators.reset()
 
     def calc_ema(self, index):
-        if index == 0:
+        # The first bar, and the first bar still held once older ones were evicted, have no previous bar
+        if index <= self.bars.first_index:
             return
 
         this_bar = self.bars[index]
@@ -127,7 +328,7 @@ class MarketDataManager:
         #       .format(index, this_bar.macd, this_bar.macd_signal, this_bar.ema_fast, this_bar.ema_slow))
 
     def calc_sma(self, index):
-        if len(self.bars) <= SLOW_PERIOD or index > len(self.bars):
+        if len(self.bars) <= SLOW_PERIOD or index > len(self.bars) or index - SLOW_PERIOD < self.bars.first_index:
             return
 
         fast_sum = 0
@@ -183,70 +384,269 @@ class MarketDataManager:
         #     return -1
 
 
+class MassCancelResult:
+    """Outcome of OrderManager.cancel_orders
+
+    results maps each trx_id to the send_transaction result or the exception raised, collapsed is True when a
+    single cancel all was sent, elapsed is the wall time in seconds.
+    """
+    def __init__(self, results, collapsed, elapsed):
+        self.results = results
+        self.collapsed = collapsed
+        self.elapsed = elapsed
+
+    def failed(self):
+        return {trx_id: result for trx_id, result in self.results.items() if isinstance(result, Exception)}
+
+
 class OrderManager:
 
-    def __init__(self, account, assetPair):
+    def __init__(self, account, assetPair, signer=None, api_server=None, presign_cancels=False,
+                 cancel_cache_size=CANCEL_CACHE_SIZE, delta_sync=False, archive=None, order_ttl=DEFAULT_ORDER_TTL,
+                 expiry_retry=EXPIRY_RETRY, cancel_workers=CANCEL_WORKERS, risk=None, collapse_cancels=False):
         self.account = account
         self.assetPair = assetPair
         self.sym_base = assetPair.split('/')[0]
         self.sym_quote = assetPair.split('/')[1]
+        # Held by every change of the order state below, order entry and order updates can run on other threads
+        self.lock = threading.RLock()
+        # Orders move from orders to the compact archive once terminal, their fills stay in the totals
         self.orders = {}
+        self.archive = archive if archive is not None else \
+            OrderArchive(status_by_value={status.value: status for status in OrderStatus})
+        # Orders not in a terminal status, also by side and by status. Totals below follow every change
+        self.live_orders = {}
+        self.live_by_side = {'buy': {}, 'sell': {}}
+        self.live_by_status = {}
+        # Live orders by time-to-live deadline, order_ttl applies to orders placed without their own ttl
+        self.order_ttl = order_ttl
+        self.expiry_retry = expiry_retry
+        self.expiry = ExpiryScheduler()
         self.trades = {}
         self.total_sell = 0
         self.total_buy = 0
+        self.buy_notional = 0
+        self.sell_notional = 0
         self.buy_open = 0
         self.sell_open = 0
+        # Quantity of orders sent but without a status from the api server yet, not part of buy_open / sell_open
+        self.buy_unacked = 0
+        self.sell_unacked = 0
+        # Orders that passed the risk checks and are being signed, counted until add_order records them
+        self.buy_reserved = 0
+        self.sell_reserved = 0
+        self.reserved_orders = 0
         self.pnl = 0
         self.position = 0
         self.size = 0.5
         self.last_price = 0.0
-        self.signer = SignerConnector()
-        self.api_server = CybexRestful()
+        self.signer = signer if signer is not None else SignerConnector()
+        self.api_server = api_server if api_server is not None else CybexRestful()
+        # Optional cache of cancel messages signed right after each order is accepted
+        self.cancel_cache = CancelCache(self.signer, cancel_cache_size) if presign_cancels else None
+        self.cancel_workers = cancel_workers
+        self.cancel_executor = None
+        # Only when this process owns every order of the asset pair, a cancel all also hits orders placed by
+        # hand, by another instance, before a restart or still being sent
+        self.collapse_cancels = collapse_cancels
+        # Optional risk.RiskEngine, checked before every order is signed
+        self.risk = risk
+
+        # Delta sync state: highest orderSequence seen and the raw (orderStatus, filledQuantity) last applied
+        self.delta_sync = delta_sync
+        self.sequence_cursor = 0
+        self.order_fingerprints = {}
+        self.syncs_since_full = 0
+        # Live orders a full resync could not find, not reported as a gap again
+        self.unsynced_orders = set()
 
     def calculate_pnl(self, orderbook):
-        total_pnl = 0
+        # Sum over filled orders of (cur_px - avg_price) * filled for buys and the opposite for sells
         cur_px = orderbook.get_cur_px()
-        for trx_id, order in self.orders.items():
-            if order.filled > 0:
-                if order.side == 'sell':
-                    pnl = (order.avg_price - cur_px) * order.filled
-                    total_pnl = total_pnl + pnl
-                elif order.side == 'buy':
-                    pnl = (cur_px - order.avg_price) * order.filled
-                    total_pnl = total_pnl + pnl
-
-        return total_pnl
+        return cur_px * (self.total_buy - self.total_sell) - self.buy_notional + self.sell_notional
 
     def update_status(self):
-        self.buy_open = 0
-        self.sell_open = 0
-        self.total_sell = 0
-        self.total_buy = 0
+        # Totals are kept up to date by set_order_state, only the position is derived
+        self.position = self.total_buy - self.total_sell
+
+    def open_quantity(self, side):
+        """Unfilled quantity on side of the live orders, unacknowledged ones and those still being signed included"""
+        if side == 'buy':
+            return self.buy_open + self.buy_unacked + self.buy_reserved
+        return self.sell_open + self.sell_unacked + self.sell_reserved
+
+    def open_order_count(self):
+        return len(self.live_orders) + self.reserved_orders
 
+    def scan_status(self):
+        """Totals computed from scratch over every order, what the incremental ones must equal"""
+        totals = {'buy_open': 0, 'sell_open': 0, 'buy_unacked': 0, 'sell_unacked': 0, 'total_buy': 0,
+                  'total_sell': 0, 'buy_notional': 0, 'sell_notional': 0}
         for trx_id, order in self.orders.items():
-            if order.order_status in {OrderStatus.PendingNew, OrderStatus.New, OrderStatus.PartiallyFilled,
-                                      OrderStatus.PendingCancel}:
+            if order.order_status in OPEN_STATUSES:
                 if order.side == 'sell':
-                    # Add to pseudo sell
-                    self.sell_open = self.sell_open + (order.quantity - order.filled)
+                    totals['sell_open'] += order.quantity - order.filled
                 if order.side == 'buy':
-                    # Add to pseudo buy
-                    self.buy_open = self.buy_open + (order.quantity - order.filled)
+                    totals['buy_open'] += order.quantity - order.filled
+            elif order.order_status is None:
+                if order.side == 'sell':
+                    totals['sell_unacked'] += order.quantity - order.filled
+                if order.side == 'buy':
+                    totals['buy_unacked'] += order.quantity - order.filled
 
             if order.filled > 0:
                 if order.side == 'sell':
-                    self.total_sell = self.total_sell + order.filled
+                    totals['total_sell'] += order.filled
+                    totals['sell_notional'] += order.filled * order.avg_price
                 elif order.side == 'buy':
-                    self.total_buy = self.total_buy + order.filled
+                    totals['total_buy'] += order.filled
+                    totals['buy_notional'] += order.filled * order.avg_price
+
+        for name in ('total_buy', 'total_sell', 'buy_notional', 'sell_notional'):
+            totals[name] += getattr(self.archive, name)
+        return totals
+
+    def check_consistency(self):
+        """Compare the live indexes and incremental totals with a full scan, returns the differences found"""
+        problems = []
+        for name, expected in self.scan_status().items():
+            actual = getattr(self, name)
+            if abs(actual - expected) > CONSISTENCY_TOLERANCE * max(1.0, abs(expected)):
+                problems.append('{0} is {1}, full scan gives {2}'.format(name, actual, expected))
+
+        live = {trx_id for trx_id, order in self.orders.items() if order.order_status not in TERMINAL_STATUSES}
+        if set(self.live_orders) != live:
+            problems.append('live orders {0}, full scan gives {1}'.format(sorted(self.live_orders), sorted(live)))
+        for side, orders in self.live_by_side.items():
+            for trx_id, order in orders.items():
+                if order.side != side or trx_id not in live:
+                    problems.append('order {0} wrongly indexed under side {1}'.format(trx_id, side))
+        indexed = 0
+        for status, orders in self.live_by_status.items():
+            indexed += len(orders)
+            for trx_id, order in orders.items():
+                if order.order_status != status or trx_id not in live:
+                    problems.append('order {0} wrongly indexed under status {1}'.format(trx_id, status))
+        if indexed != len(live):
+            problems.append('{0} orders indexed by status, {1} live'.format(indexed, len(live)))
+        return problems
+
+    def _account(self, order, sign):
+        # Add (sign 1) or take out (sign -1) what the order contributes to the totals
+        if order.order_status in OPEN_STATUSES:
+            if order.side == 'sell':
+                self.sell_open += sign * (order.quantity - order.filled)
+            if order.side == 'buy':
+                self.buy_open += sign * (order.quantity - order.filled)
+        elif order.order_status is None:
+            if order.side == 'sell':
+                self.sell_unacked += sign * (order.quantity - order.filled)
+            if order.side == 'buy':
+                self.buy_unacked += sign * (order.quantity - order.filled)
+
+        if order.filled > 0:
+            if order.side == 'sell':
+                self.total_sell += sign * order.filled
+                self.sell_notional += sign * order.filled * order.avg_price
+            elif order.side == 'buy':
+                self.total_buy += sign * order.filled
+                self.buy_notional += sign * order.filled * order.avg_price
+
+    def _index(self, order):
+        if order.order_status in TERMINAL_STATUSES:
+            return
+        self.live_orders[order.trx_id] = order
+        if order.side in self.live_by_side:
+            self.live_by_side[order.side][order.trx_id] = order
+        self.live_by_status.setdefault(order.order_status, {})[order.trx_id] = order
 
-        self.position = self.total_buy - self.total_sell
+    def _unindex(self, order):
+        if self.live_orders.pop(order.trx_id, None) is None:
+            return
+        side_orders = self.live_by_side.get(order.side)
+        if side_orders is not None:
+            side_orders.pop(order.trx_id, None)
+            if not side_orders:
+                # Nothing open on this side, clear any float residue of the running sum
+                if order.side == 'sell':
+                    self.sell_open = 0
+                    self.sell_unacked = 0
+                else:
+                    self.buy_open = 0
+                    self.buy_unacked = 0
+        status_orders = self.live_by_status.get(order.order_status)
+        if status_orders is not None:
+            status_orders.pop(order.trx_id, None)
+
+    def add_order(self, order, ttl=None):
+        with self.lock:
+            self.orders[order.trx_id] = order
+            self._account(order, 1)
+            self._index(order)
+            self.expiry.schedule(order.trx_id, ttl if ttl is not None else self.order_ttl)
+            self.update_status()
+
+    def remove_order(self, trx_id):
+        with self.lock:
+            order = self.orders.pop(trx_id, None)
+            if order is not None:
+                self._account(order, -1)
+                self._unindex(order)
+                self.expiry.discard(trx_id)
+                self.update_status()
+        return order
+
+    def archive_order(self, order):
+        """Move a terminal order into the archive, what it filled stays in the totals"""
+        with self.lock:
+            if self.orders.get(order.trx_id) is not order:
+                return
+            del self.orders[order.trx_id]
+            self._unindex(order)
+            self.expiry.discard(order.trx_id)
+            self.archive.add(order)
+
+    def find_order(self, trx_id):
+        """The live Order, or an ArchivedOrder once terminal, None when unknown"""
+        order = self.orders.get(trx_id)
+        if order is None:
+            order = self.archive.get(trx_id)
+        return order
+
+    def set_order_state(self, order, status=None, filled=None, avg_price=None, quantity=None):
+        """Change an order, keeping the live indexes, open quantities, position and PnL totals in step"""
+        with self.lock:
+            tracked = self.orders.get(order.trx_id) is order
+            if tracked:
+                self._account(order, -1)
+                self._unindex(order)
+            if status is not None:
+                order.order_status = status
+            if filled is not None:
+                order.filled = filled
+            if avg_price is not None:
+                order.avg_price = avg_price
+            if quantity is not None:
+                order.quantity = quantity
+            if tracked:
+                self._account(order, 1)
+                self._index(order)
+                self.update_status()
+
+    @staticmethod
+    def best_price(orderbook, side):
+        """Best ask to buy at or best bid to sell at, no trading while that side of the book is empty"""
+        price = orderbook.get_best_ask() if side == 'buy' else orderbook.get_best_bid()
+        if price is None:
+            raise CybexException('no {0} in the order book, not trading'.format('ask' if side == 'buy' else 'bid'))
+        return price
 
     def buy_one(self, orderbook):
-        best_ask = orderbook.get_best_ask()
+        best_ask = self.best_price(orderbook, 'buy')
         self.buy(best_ask+0.2, self.size)
 
     def sell_one(self, orderbook):
-        best_bid = orderbook.get_best_bid()
+        best_bid = self.best_price(orderbook, 'sell')
         self.sell(best_bid-0.2, self.size)
 
     def handle_signal(self, signal, orderbook):
@@ -255,61 +655,78 @@ class OrderManager:
 
         target = self.size * signal
 
+        to_cancel, pending_new_count, pending_count = self.signal_cancels(target)
+        if to_cancel:
+            for trx_id, e in self.cancel_orders(to_cancel).failed().items():
+                print('cancel error', e)
+        self.check_pending(pending_new_count, pending_count)
+
+        decided = self.reserve_for_target(target, orderbook)
+        if not isinstance(decided, tuple):
+            return decided
+        side, price, quantity = decided
+        self.place_order(side, price, quantity, reserved=True)
+        return True
+
+    def signal_cancels(self, target):
+        """Open orders opposite to target, plus the counts of unacknowledged and pending orders"""
         pending_new_count = 0
         pending_count = 0
-        # Cancel open order if it is the opposite side of the target
-        for trx_id, order in self.orders.items():
-            if not order.order_status:
-                pending_new_count = pending_new_count + 1
-            if order.order_status in {OrderStatus.PendingNew, OrderStatus.PendingCancel}:
-                pending_count = pending_count + 1
-            if order.order_status in {OrderStatus.PendingNew, OrderStatus.New, OrderStatus.PartiallyFilled}:
-                if target > 0 and order.side == 'sell':
-                    try:
-                        self.cancel(order.trx_id)
-                        order.order_status = OrderStatus.PendingCancel
-                    except Exception as e:
-                        print('cancel error', e)
-                elif target < 0 and order.side == 'buy':
-                    try:
-                        self.cancel(order.trx_id)
-                        order.order_status = OrderStatus.PendingCancel
-                    except Exception as e:
-                        print('cancel error', e)
+        # Cancel open order if it is the opposite side of the target, terminal orders play no part
+        to_cancel = []
+        with self.lock:
+            for trx_id, order in self.live_orders.items():
+                if not order.order_status:
+                    pending_new_count = pending_new_count + 1
+                if order.order_status in {OrderStatus.PendingNew, OrderStatus.PendingCancel}:
+                    pending_count = pending_count + 1
+                if order.order_status in {OrderStatus.PendingNew, OrderStatus.New, OrderStatus.PartiallyFilled}:
+                    if (target > 0 and order.side == 'sell') or (target < 0 and order.side == 'buy'):
+                        to_cancel.append(trx_id)
+        return to_cancel, pending_new_count, pending_count
 
+    @staticmethod
+    def check_pending(pending_new_count, pending_count):
         if pending_new_count > 1:
             raise CybexException('too many pending new, wait and retry next round')
 
         if pending_count > 3:
             raise CybexException('too many pending, wait and retry next round')
 
-        # Assume pending cancel can be cancelled.
-        # Calculate pseudo_pos again
-        self.update_status()
-        pseudo_pos = self.position + self.buy_open - self.sell_open
+    def reserve_for_target(self, target, orderbook):
+        """Decide the order moving the position to target and reserve it
 
-        to_trade = target - pseudo_pos
+        Returns (side, price, quantity) to send with reserved=True, or what handle_signal returns when there
+        is nothing to send. Decided under the lock, so order updates and other order entry cannot change the
+        position between computing to_trade and the order being counted.
+        """
+        with self.lock:
+            # Assume pending cancel can be cancelled.
+            # Calculate pseudo_pos again
+            self.update_status()
+            buy_open = self.open_quantity('buy')
+            sell_open = self.open_quantity('sell')
+            pseudo_pos = self.position + buy_open - sell_open
 
-        print("{0}, current total_buy {1}, total_sell {2} buy_open {3}, sell_open {4}, position {5} pseudo_pos {6}, to_trade {7} "
-              .format(datetime.now(), self.total_buy, self.total_sell, self.buy_open,
-                      self.sell_open, self.position, pseudo_pos, to_trade))
+            to_trade = target - pseudo_pos
 
-        if target == pseudo_pos:
-            return None
+            print("{0}, current total_buy {1}, total_sell {2} buy_open {3}, sell_open {4}, position {5} pseudo_pos {6}, to_trade {7} "
+                  .format(datetime.now(), self.total_buy, self.total_sell, buy_open,
+                          sell_open, self.position, pseudo_pos, to_trade))
 
-        # Now the target and to_trade is the same direction.
-        if abs(to_trade) < 0.1:
-            # to_trade too small, do nothing.
-            return True
+            if target == pseudo_pos:
+                return None
 
-        if to_trade > 0:
-            best_ask = orderbook.get_best_ask()
-            self.buy(best_ask, to_trade)
-            return True
-        elif to_trade < 0:
-            best_bid = orderbook.get_best_bid()
-            self.sell(best_bid, -1 * to_trade)
-            return True
+            # Now the target and to_trade is the same direction.
+            if abs(to_trade) < 0.1:
+                # to_trade too small, do nothing.
+                return True
+
+            side = 'buy' if to_trade > 0 else 'sell'
+            price = round(self.best_price(orderbook, side), 2)
+            quantity = round(abs(to_trade), 2)
+            self._reserve(side, price, quantity)
+        return side, price, quantity
 
     @staticmethod
     def parse_order_signer(order_data):
@@ -324,128 +741,331 @@ class OrderManager:
 
     @staticmethod
     def parse_order_apiserver(order_data):
-        o = Order()
-        o.trx_id = order_data['transactionId']
-
-        order_status_str = order_data['orderStatus']
-
-        # order status parsing sequence same as sbe definition
-        if order_status_str == 'PENDING_NEW':
-            o.order_status = OrderStatus.PendingNew
-        elif order_status_str == 'OPEN':
-            o.order_status = OrderStatus.New
-        elif order_status_str == 'PENDING_CXL':
-            o.order_status = OrderStatus.PendingCancel
-        elif order_status_str == 'CANCELED':
-            o.order_status = OrderStatus.Canceled
-        elif order_status_str == 'FILLED':
-            o.order_status = OrderStatus.Filled
-        elif order_status_str == 'REJECTED':
-            o.order_status = OrderStatus.Rejected
-
-        o.order_sequence = order_data['orderSequence']
-
-        o.filled = order_data['filledQuantity']
-        o.avg_price = order_data['averagePrice']
-
-        return o
+        return OrderUpdate(order_data['transactionId'],
+                           ORDER_STATUS_BY_NAME.get(order_data['orderStatus'], OrderStatus.PendingNew),
+                           order_data['orderSequence'],
+                           order_data['filledQuantity'],
+                           order_data['averagePrice'],
+                           order_data.get('quantity'))
 
     def update_orders(self):
         # noinspection PyBroadException
         try:
-            order_datas = self.api_server.get_orders(self.account)
+            self.apply_orders(self.fetch_orders())
+        except Exception:
+            print("unable to update orders:", sys.exc_info()[0])
 
-            for order_data in order_datas:
-                order_update = OrderManager.parse_order_apiserver(order_data)
+    def fetch_orders(self):
+        # Network half of update_orders, apply_orders does the rest
+        return self.api_server.get_orders(self.account)
 
-                if order_update.trx_id not in self.orders:
-                    # print('Unrecognized order {0}'.format(order_update.trx_id))
-                    continue
+    def apply_orders(self, order_datas):
+        with self.lock:
+            if self.delta_sync:
+                self.apply_order_deltas(order_datas)
+            else:
+                self.apply_order_updates(order_datas)
 
-                if order_update.order_status == OrderStatus.Rejected:
-                    remark = order_data['remark']
-                    print('{0}, Order {1} rejected. Reason : {2}'.format(datetime.now(), order_update.trx_id, remark))
-                    self.orders.pop(order_update.trx_id, None)
-                    continue
+    def apply_order_updates(self, order_datas):
+        for order_data in order_datas:
+            order_update = OrderManager.parse_order_apiserver(order_data)
+
+            if order_update.trx_id not in self.orders:
+                # print('Unrecognized order {0}'.format(order_update.trx_id))
+                continue
 
+            if order_update.order_status in TERMINAL_STATUSES and self.cancel_cache is not None:
+                self.cancel_cache.evict(order_update.trx_id)
+
+            if order_update.order_status == OrderStatus.Rejected:
+                remark = order_data['remark']
+                print('{0}, Order {1} rejected. Reason : {2}'.format(datetime.now(), order_update.trx_id, remark))
                 order = self.orders[order_update.trx_id]
-                if order.order_status != order_update.order_status:
-                    print('{0}, order status changed from {1} to {2}, trx_id {3}'
-                          .format(datetime.now(), order.order_status, order_update.order_status, order.trx_id))
+                self.set_order_state(order, OrderStatus.Rejected)
+                self.archive_order(order)
+                continue
+
+            order = self.orders[order_update.trx_id]
+            if order.order_status != order_update.order_status:
+                print('{0}, order status changed from {1} to {2}, trx_id {3}'
+                      .format(datetime.now(), order.order_status, order_update.order_status, order.trx_id))
+
+            # Filled quantity changed
+            if order.filled != order_update.filled:
+                print('{0}, order filled change from {1} to {2}, avg_price {3}, order total qty {4}, trx_id {5}'
+                      .format(datetime.now(), order.filled, order_update.filled,
+                              order_update.avg_price, order.quantity, order.trx_id))
+
+            # Keep the quantity the order was sent with when the record does not carry one
+            self.set_order_state(order, order_update.order_status, order_update.filled, order_update.avg_price,
+                                 order_update.quantity)
+            order.order_sequence = order_update.order_sequence
+            if order.order_status in TERMINAL_STATUSES:
+                self.archive_order(order)
 
-                # Filled quantity changed
-                if order.filled != order_update.filled:
-                    print('{0}, order filled change from {1} to {2}, avg_price {3}, order total qty {4}, trx_id {5}'
-                          .format(datetime.now(), order.filled, order_update.filled,
-                                  order_update.avg_price, order.quantity, order.trx_id))
+        self.update_status()
 
-                order.quantity = order_update.quantity
-                order.avg_price = order_update.avg_price
-                order.filled = order_update.filled
-                order.order_status = order_update.order_status
+    def apply_order_deltas(self, order_datas):
+        """Reconcile only the records that are new or changed since the last sync
+
+        Records of unknown orders and of orders already reconciled as terminal are skipped before parsing.
+        A tracked live order missing from the response, or a response that does not reach the sequence
+        cursor, is treated as a gap and triggers a full resync.
+
+        The /order endpoint returns every order of the account and takes no cursor, and orderSequence is fixed
+        when an order is created, so records at or below the cursor can still carry new fills and cannot be
+        dropped unread. Each sync therefore still costs a dict lookup and a fingerprint compare per record in
+        the response plus one pass over the live orders for the gap check; only parsing and reconciling are
+        limited to what changed. benchmark_sync.py measures both.
+        """
+        self.syncs_since_full += 1
+        if self.syncs_since_full >= FULL_RESYNC_INTERVAL:
+            self.full_resync(order_datas)
+            return
 
-            self.update_status()
-        except Exception:
-            print("unable to update orders:", sys.exc_info()[0])
+        cursor = self.sequence_cursor
+        max_sequence = 0
+        changed = []
+        seen = set()
+        orders = self.orders
+        fingerprints = self.order_fingerprints
+
+        for order_data in order_datas:
+            sequence = order_data['orderSequence']
+            if sequence > max_sequence:
+                max_sequence = sequence
+
+            trx_id = order_data['transactionId']
+            order = orders.get(trx_id)
+            if order is None:
+                continue
+            seen.add(trx_id)
+
+            if order.order_status in TERMINAL_STATUSES:
+                continue
+
+            fingerprint = (order_data['orderStatus'], order_data['filledQuantity'])
+            if fingerprints.get(trx_id) == fingerprint:
+                continue
+            fingerprints[trx_id] = fingerprint
+            changed.append(order_data)
+
+        if self.unsynced_orders:
+            self.unsynced_orders -= seen
+
+        if max_sequence < cursor or self._has_gap(seen):
+            print('{0}, order sync gap detected, doing full resync'.format(datetime.now()))
+            self.full_resync(order_datas)
+            return
 
-    def cancel_old_orders(self):
-        now = datetime.utcnow()
-        for trx_id, order in self.orders.items():
+        self.sequence_cursor = max_sequence
+        self.apply_order_updates(changed)
+        self._forget_fingerprints()
+
+    def _has_gap(self, seen):
+        for trx_id, order in self.live_orders.items():
+            # Orders are only expected in the response once the server assigned them a sequence
+            if trx_id not in seen and 0 < order.order_sequence <= self.sequence_cursor \
+                    and order.order_status not in TERMINAL_STATUSES and trx_id not in self.unsynced_orders:
+                return True
+        return False
+
+    def _forget_fingerprints(self):
+        # Terminal orders are archived out of self.orders, drop their fingerprints with them
+        if len(self.order_fingerprints) > len(self.orders):
+            for trx_id in [t for t in self.order_fingerprints if t not in self.orders]:
+                del self.order_fingerprints[trx_id]
+
+    def full_resync(self, order_datas):
+        self.syncs_since_full = 0
+        self.apply_order_updates(order_datas)
+
+        self.order_fingerprints = {}
+        max_sequence = 0
+        for order_data in order_datas:
+            if order_data['orderSequence'] > max_sequence:
+                max_sequence = order_data['orderSequence']
+            if order_data['transactionId'] in self.orders:
+                self.order_fingerprints[order_data['transactionId']] = (order_data['orderStatus'],
+                                                                        order_data['filledQuantity'])
+        self.sequence_cursor = max_sequence
+
+        self.unsynced_orders = set()
+        for trx_id, order in self.live_orders.items():
+            if trx_id not in self.order_fingerprints and order.order_sequence > 0 \
+                    and order.order_status not in TERMINAL_STATUSES:
+                print('{0}, order {1} not returned by the api server'.format(datetime.now(), trx_id))
+                self.unsynced_orders.add(trx_id)
+
+    def expired_orders(self, now=None):
+        """Live orders past their time-to-live that should be cancelled now
+
+        Only orders whose deadline passed are visited. Each one returned is looked at again expiry_retry seconds
+        later, so a cancel that failed or that the exchange ignored gets resent, while one still in flight
+        (PendingCancel) is not sent twice. Orders not acknowledged yet wait for the next retry as well.
+        """
+        expired = []
+        with self.lock:
+            for trx_id in self.expiry.pop_expired(now):
+                order = self.live_orders.get(trx_id)
+                if order is None:
+                    continue
+                self.expiry.schedule(trx_id, self.expiry_retry, now)
+                if order.order_status in {OrderStatus.New, OrderStatus.PartiallyFilled}:
+                    expired.append(order)
+        return expired
 
-            lapse = now - order.timestamp
-            if lapse > timedelta(seconds=40) and order.order_status in {OrderStatus.New, OrderStatus.PartiallyFilled}:
-                try:
-                    self.cancel(order.trx_id)
-                except Exception as e:
-                    print('Cancel exception', e)
+    def cancel_old_orders(self):
+        expired = [order.trx_id for order in self.expired_orders()]
+        if expired:
+            for trx_id, e in self.cancel_orders(expired).failed().items():
+                print('Cancel exception', e)
 
-    def sell(self, price, quantity):
-        quantity = round(quantity, 2)
-        price = round(price, 2)
-        new_order_msg = self.signer.prepare_order_message(self.assetPair, price, quantity, 'sell')
+    def new_order_from_message(self, new_order_msg, side, price, quantity):
         new_order = self.parse_order_signer(new_order_msg)
 
         new_order.assetPair = self.assetPair
         new_order.quantity = quantity
         new_order.price = price
-        new_order.side = 'sell'
-
-        print(datetime.now(), "try to sell", new_order.quantity, "at", new_order.price, "trx_id", new_order.trx_id)
-
-        result = self.api_server.send_transaction(new_order_msg)
-        print('send order result:', result)
-
-        self.orders[new_order.trx_id] = new_order
-
-    def buy(self, price, quantity):
+        new_order.side = side
+        return new_order
+
+    def _reserve(self, side, price, quantity):
+        # Caller holds self.lock. Risk checks see the reservation of every order not recorded yet
+        if self.risk is not None:
+            self.risk.check(self, side, price, quantity)
+        if side == 'buy':
+            self.buy_reserved += quantity
+        else:
+            self.sell_reserved += quantity
+        self.reserved_orders += 1
+
+    def _release(self, side, quantity):
+        if side == 'buy':
+            self.buy_reserved -= quantity
+        else:
+            self.sell_reserved -= quantity
+        self.reserved_orders -= 1
+        if not self.reserved_orders:
+            self.buy_reserved = 0
+            self.sell_reserved = 0
+
+    def place_order(self, side, price, quantity, ttl=None, reserved=False):
+        """Check, sign, record and send one order, returns the Order
+
+        The quantity is reserved from the risk check until the order is recorded, and the order is recorded
+        before it is sent, so no other thread sees the position without it. reserved=True when the caller
+        already called _reserve with the same rounded price and quantity.
+        """
         quantity = round(quantity, 2)
         price = round(price, 2)
-        new_order_msg = self.signer.prepare_order_message(self.assetPair, price, quantity, 'buy')
-        new_order = self.parse_order_signer(new_order_msg)
+        if not reserved:
+            with self.lock:
+                self._reserve(side, price, quantity)
+        try:
+            new_order_msg = self.signer.prepare_order_message(self.assetPair, price, quantity, side)
+            new_order = self.new_order_from_message(new_order_msg, side, price, quantity)
+        except Exception:
+            with self.lock:
+                self._release(side, quantity)
+            raise
 
-        new_order.assetPair = self.assetPair
-        new_order.quantity = quantity
-        new_order.price = price
-        new_order.side = 'buy'
+        with self.lock:
+            self._release(side, quantity)
+            self.add_order(new_order, ttl)
 
-        print(datetime.now(), "try to buy", new_order.quantity, "at", new_order.price, "trx_id", new_order.trx_id)
+        print(datetime.now(), "try to", side, new_order.quantity, "at", new_order.price, "trx_id", new_order.trx_id)
 
-        result = self.api_server.send_transaction(new_order_msg)
+        try:
+            result = self.api_server.send_transaction(new_order_msg)
+        except Exception:
+            self.remove_order(new_order.trx_id)
+            raise
         print('send order result:', result)
 
-        self.orders[new_order.trx_id] = new_order
+        self.order_accepted(new_order, result)
+        return new_order
+
+    def sell(self, price, quantity, ttl=None):
+        return self.place_order('sell', price, quantity, ttl)
+
+    def buy(self, price, quantity, ttl=None):
+        return self.place_order('buy', price, quantity, ttl)
+
+    def order_accepted(self, order, result):
+        if isinstance(result, dict) and 'orderSequence' in result:
+            order.order_sequence = result['orderSequence']
+        if self.cancel_cache is not None:
+            self.cancel_cache.presign(order.trx_id)
 
     def cancel(self, trx_id):
         print(datetime.now(), 'cancelling', trx_id)
-        cancel = self.signer.prepare_cancel_message(trx_id)
+        cancel = None
+        if self.cancel_cache is not None:
+            cancel = self.cancel_cache.take(trx_id)
+        if cancel is None:
+            cancel = self.signer.prepare_cancel_message(trx_id)
         result = self.api_server.send_transaction(cancel)
         print('cancel result', result)
+        return result
 
     def cancel_all(self, symbol):
         print(datetime.now(), 'cancelling all')
         cancel_all = self.signer.prepare_cancel_all_message(symbol)
         result = self.api_server.send_transaction(cancel_all)
         print('cancel all result', result)
+        return result
+
+    def _cancel_pool(self):
+        if self.cancel_executor is None:
+            self.cancel_executor = ThreadPoolExecutor(max_workers=self.cancel_workers, thread_name_prefix='cancel')
+        return self.cancel_executor
+
+    def covers_live_orders(self, trx_ids):
+        """True when collapse_cancels is on and trx_ids holds more than one order and every live one"""
+        if not self.collapse_cancels:
+            return False
+        wanted = set(trx_ids)
+        live = list(self.live_orders)
+        return len(wanted) > 1 and len(live) > 0 and all(trx_id in wanted for trx_id in live)
+
+    def cancel_orders(self, trx_ids):
+        """Cancel several orders at once, returns a MassCancelResult
+
+        Cancels are signed and sent in parallel, at most cancel_workers at a time. With collapse_cancels on and
+        trx_ids covering every live order of the asset pair (and more than one), a single cancel all transaction
+        is sent instead; leave it off unless this process owns the whole pair on the account. Orders whose cancel
+        went through are marked PendingCancel.
+        """
+        start = time.perf_counter()
+        trx_ids = list(dict.fromkeys(trx_ids))
+        collapsed = self.covers_live_orders(trx_ids)
+
+        results = {}
+        if collapsed:
+            try:
+                result = self.cancel_all(self.assetPair)
+            except Exception as e:
+                result = e
+            results = dict.fromkeys(trx_ids, result)
+        elif len(trx_ids) == 1:
+            try:
+                results[trx_ids[0]] = self.cancel(trx_ids[0])
+            except Exception as e:
+                results[trx_ids[0]] = e
+        else:
+            futures = [(trx_id, self._cancel_pool().submit(self.cancel, trx_id)) for trx_id in trx_ids]
+            for trx_id, future in futures:
+                try:
+                    results[trx_id] = future.result()
+                except Exception as e:
+                    results[trx_id] = e
+
+        for trx_id, result in results.items():
+            order = self.live_orders.get(trx_id)
+            if order is not None and not isinstance(result, Exception):
+                self.set_order_state(order, OrderStatus.PendingCancel)
+        return MassCancelResult(results, collapsed, time.perf_counter() - start)
 
     def do_test_order(self):
         self.buy(50, 1)
\ No newline at end of file
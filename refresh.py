@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+
+from metrics import default_registry
+
+REFRESH_WORKERS = 4
+# Seconds a fetch may take, counted from the start of the refresh
+REFRESH_TIMEOUT = 5.0
+
+
+class RefreshTask:
+    __slots__ = ('name', 'fetch', 'apply', 'timeout', 'future')
+
+    def __init__(self, name, fetch, apply, timeout):
+        self.name = name
+        self.fetch = fetch
+        self.apply = apply
+        self.timeout = timeout
+        self.future = None
+
+
+class RefreshStage:
+    """Runs the network half of every task in parallel, then merges the results on the calling thread
+
+    fetch() does the I/O and returns a result, apply(result) merges it into local state. run() waits for each
+    fetch up to its timeout and applies the finished ones in the order the tasks were added, so state only
+    changes at that one point of the loop. Tasks should only do I/O in fetch, anything touching shared state
+    belongs in apply. A fetch still running after its timeout is not started again, its result is applied by
+    the run it finishes in.
+    """
+    def __init__(self, workers=REFRESH_WORKERS, timeout=REFRESH_TIMEOUT, metrics=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh')
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else default_registry
+        self.tasks = []
+        self.last_timings = {}
+
+    def add(self, name, fetch, apply=None, timeout=None):
+        self.tasks.append(RefreshTask(name, fetch, apply, timeout if timeout is not None else self.timeout))
+
+    def _fetch(self, task):
+        start = time.perf_counter()
+        with self.metrics.measure('refresh.%s' % task.name):
+            result = task.fetch()
+        return result, time.perf_counter() - start
+
+    def run(self):
+        """Refresh every task, returns {name: fetch seconds, None if it did not finish, 'total': seconds}"""
+        start = time.perf_counter()
+        for task in self.tasks:
+            if task.future is None:
+                task.future = self.executor.submit(self._fetch, task)
+
+        timings = {}
+        for task in self.tasks:
+            try:
+                result, elapsed = task.future.result(max(0.0, start + task.timeout - time.perf_counter()))
+            except TimeoutError:
+                print(datetime.now(), 'refresh', task.name, 'still running after', task.timeout, 'seconds')
+                timings[task.name] = None
+                continue
+            except Exception as e:
+                print(datetime.now(), 'refresh', task.name, 'failed', e)
+                task.future = None
+                timings[task.name] = None
+                continue
+
+            task.future = None
+            timings[task.name] = elapsed
+            if task.apply is not None:
+                try:
+                    task.apply(result)
+                except Exception as e:
+                    print(datetime.now(), 'refresh', task.name, 'unable to apply result', e)
+
+        timings['total'] = time.perf_counter() - start
+        self.last_timings = timings
+        return timings
+
+    def close(self):
+        self.executor.shutdown(wait=False)
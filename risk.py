@@ -0,0 +1,120 @@
+"""Pre-trade risk checks
+
+RiskEngine.check runs before an order is signed. Each limit is compared with totals the OrderManager already
+keeps up to date (position, open_quantity, open_order_count) and a window of recent order times holding at
+most max_orders_per_second entries, so a check costs the same however many orders the manager holds.
+"""
+import threading
+import time
+from collections import deque
+
+from cybexapi_connector import CybexException
+
+
+class CybexRiskException(CybexException):
+    """An order refused before signing, rule names the limit it broke"""
+    def __init__(self, rule, message):
+        super().__init__(message)
+        self.rule = rule
+
+
+RISK_RULES = ('kill_switch', 'max_order_notional', 'max_open_orders', 'max_position', 'price_band',
+              'max_orders_per_second')
+
+# Keyword arguments of RiskEngine a config section may set
+RISK_LIMITS = ('max_position', 'max_order_notional', 'max_open_orders', 'max_orders_per_second', 'price_band')
+
+
+def limits_from_config(section):
+    """RiskEngine keyword arguments from a config section, ValueError naming any unknown or non-numeric key"""
+    unknown = sorted(name for name in section if name not in RISK_LIMITS)
+    if unknown:
+        raise ValueError('unknown risk limits {0}, expected some of {1}'.format(', '.join(unknown),
+                                                                                ', '.join(RISK_LIMITS)))
+    limits = {}
+    for name in section:
+        try:
+            limits[name] = float(section[name])
+        except ValueError:
+            raise ValueError('risk limit {0} is not a number: {1}'.format(name, section[name]))
+    return limits
+
+
+class RiskEngine:
+    """Pre-trade limits of one OrderManager, a limit of None is not checked
+
+    max_position bounds the absolute position once the order and every open order on its side fill, orders not
+    acknowledged by the api server yet included (OrderManager.open_quantity).
+    price_band is the largest relative distance of the order price from orderbook.get_cur_px(), skipped while
+    the book is empty. Orders passing the checks count towards max_orders_per_second even if sending fails.
+    """
+    def __init__(self, max_position=None, max_order_notional=None, max_open_orders=None,
+                 max_orders_per_second=None, price_band=None, orderbook=None, clock=time.monotonic):
+        self.max_position = max_position
+        self.max_order_notional = max_order_notional
+        self.max_open_orders = max_open_orders
+        self.max_orders_per_second = max_orders_per_second
+        self.price_band = price_band
+        self.orderbook = orderbook
+        self.clock = clock
+        self.killed = False
+        self.kill_reason = None
+        # Times of the orders passed within the last second
+        self.recent = deque()
+        self.passed = 0
+        self.rejected = dict.fromkeys(RISK_RULES, 0)
+        self.lock = threading.Lock()
+
+    def kill(self, reason='kill switch'):
+        """Refuse every order until resume()"""
+        self.kill_reason = reason
+        self.killed = True
+        print('risk kill switch on:', reason)
+
+    def resume(self):
+        self.killed = False
+        self.kill_reason = None
+        print('risk kill switch off')
+
+    def _reject(self, rule, message):
+        self.rejected[rule] += 1
+        raise CybexRiskException(rule, message)
+
+    def check(self, om, side, price, quantity):
+        """Raise CybexRiskException unless om may send this order, called with om.lock held"""
+        if self.killed:
+            self._reject('kill_switch', 'trading halted: %s' % self.kill_reason)
+
+        if self.max_order_notional is not None and price * quantity > self.max_order_notional:
+            self._reject('max_order_notional', 'order notional %s above %s' % (price * quantity,
+                                                                              self.max_order_notional))
+
+        if self.max_open_orders is not None and om.open_order_count() >= self.max_open_orders:
+            self._reject('max_open_orders', '%s open orders, limit %s' % (om.open_order_count(),
+                                                                          self.max_open_orders))
+
+        if self.max_position is not None:
+            if side == 'buy':
+                exposure = om.position + om.open_quantity('buy') + quantity
+            else:
+                exposure = om.position - om.open_quantity('sell') - quantity
+            if abs(exposure) > self.max_position:
+                self._reject('max_position', 'position would reach %s, limit %s' % (exposure, self.max_position))
+
+        if self.price_band is not None and self.orderbook is not None:
+            reference = self.orderbook.get_cur_px()
+            if reference > 0 and abs(price - reference) > self.price_band * reference:
+                self._reject('price_band', 'price %s more than %s away from %s' % (price, self.price_band,
+                                                                                   reference))
+
+        with self.lock:
+            if self.max_orders_per_second is not None:
+                now = self.clock()
+                recent = self.recent
+                while recent and recent[0] <= now - 1.0:
+                    recent.popleft()
+                if len(recent) >= self.max_orders_per_second:
+                    self._reject('max_orders_per_second', 'more than %s orders per second'
+                                 % self.max_orders_per_second)
+                recent.append(now)
+            self.passed += 1
@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import default_registry
+
+# Priority classes, lower runs first
+PRIORITY_CANCEL = 0
+PRIORITY_NEW_ORDER = 1
+PRIORITY_ORDER_POLL = 2
+PRIORITY_MARKET_DATA = 3
+
+PRIORITY_NAMES = {PRIORITY_CANCEL: 'cancel', PRIORITY_NEW_ORDER: 'new_order',
+                  PRIORITY_ORDER_POLL: 'order_poll', PRIORITY_MARKET_DATA: 'market_data'}
+
+# Transaction types that cancel orders, sent with cancel priority
+CANCEL_TRANSACTION_TYPES = frozenset(['Cancel', 'CancelAll'])
+
+SCHEDULER_WORKERS = 8
+
+
+def coalesce_key_for(method, url, kwargs):
+    """Key under which identical reads share one in-flight request, None for anything but GET"""
+    if method != 'GET':
+        return None
+    params = kwargs.get('params')
+    return method, url, tuple(sorted(params.items())) if params else ()
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst tokens"""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until one token is available, 0 when it can be taken now"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ('fn', 'future', 'buckets', 'coalesce_key', 'priority', 'queued_at')
+
+    def __init__(self, fn, future, buckets, coalesce_key, priority):
+        self.fn = fn
+        self.future = future
+        self.buckets = buckets
+        self.coalesce_key = coalesce_key
+        self.priority = priority
+        self.queued_at = time.perf_counter()
+
+
+class RequestScheduler:
+    """Shared request scheduler for all exchange connectors
+
+    Requests wait in one priority queue (cancels > new orders > order polling > market data) and run on a
+    pool of worker threads. Each request takes a token from the bucket of its host and of its endpoint, if
+    limits were set for them; a request whose bucket is empty does not hold back requests on other buckets.
+    Reads submitted with the same coalesce_key while one is queued or running share its result.
+    """
+    def __init__(self, workers=SCHEDULER_WORKERS, metrics=None):
+        self.metrics = metrics if metrics is not None else default_registry
+        self.queue = []
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+        self.host_limits = {}
+        self.endpoint_limits = {}
+        self.in_flight = {}
+        self.coalesced = 0
+        self.running = True
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name='scheduler-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def set_host_limit(self, host, rate, burst=None):
+        with self.cond:
+            self.host_limits[host] = TokenBucket(rate, burst)
+
+    def set_endpoint_limit(self, host, endpoint, rate, burst=None):
+        with self.cond:
+            self.endpoint_limits[(host, endpoint)] = TokenBucket(rate, burst)
+
+    def submit(self, fn, priority=PRIORITY_MARKET_DATA, host=None, endpoint=None, coalesce_key=None):
+        """Queue fn() and return a concurrent.futures.Future of its result, RuntimeError after shutdown()"""
+        with self.cond:
+            if not self.running:
+                raise RuntimeError('cannot schedule new requests after shutdown')
+            if coalesce_key is not None:
+                future = self.in_flight.get(coalesce_key)
+                if future is not None:
+                    self.coalesced += 1
+                    return future
+
+            buckets = []
+            if host in self.host_limits:
+                buckets.append(self.host_limits[host])
+            if (host, endpoint) in self.endpoint_limits:
+                buckets.append(self.endpoint_limits[(host, endpoint)])
+
+            future = Future()
+            job = _Job(fn, future, buckets, coalesce_key, priority)
+            if coalesce_key is not None:
+                self.in_flight[coalesce_key] = future
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            self.cond.notify()
+        return future
+
+    def call(self, fn, priority=PRIORITY_MARKET_DATA, host=None, endpoint=None, coalesce_key=None, timeout=None):
+        return self.submit(fn, priority, host, endpoint, coalesce_key).result(timeout)
+
+    def pending(self):
+        with self.cond:
+            return len(self.queue)
+
+    def shutdown(self):
+        """Stop the workers, requests still queued are cancelled so nobody waits on them for ever"""
+        with self.cond:
+            self.running = False
+            for priority, sequence, job in self.queue:
+                job.future.cancel()
+            self.queue = []
+            self.in_flight.clear()
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def _next_ready(self):
+        # Pop in priority order until a job with tokens is found, skipped jobs go back on the heap
+        now = time.monotonic()
+        skipped = []
+        job = None
+        min_wait = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            wait = max([bucket.wait_time(now) for bucket in entry[2].buckets] or [0])
+            if wait == 0:
+                job = entry[2]
+                for bucket in job.buckets:
+                    bucket.take()
+                break
+            skipped.append(entry)
+            if min_wait is None or wait < min_wait:
+                min_wait = wait
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+        return job, min_wait
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.running:
+                        return
+                    job, wait = self._next_ready()
+                    if job is not None:
+                        break
+                    self.cond.wait(wait)
+
+            queue_name = 'scheduler.queue.%s' % PRIORITY_NAMES.get(job.priority, job.priority)
+            self.metrics.endpoint(queue_name).latency_us.record((time.perf_counter() - job.queued_at) * 1000000)
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn())
+                except BaseException as e:
+                    job.future.set_exception(e)
+
+            if job.coalesce_key is not None:
+                with self.cond:
+                    if self.in_flight.get(job.coalesce_key) is job.future:
+                        del self.in_flight[job.coalesce_key]
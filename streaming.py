@@ -0,0 +1,327 @@
+"""Streaming market data ingestion
+
+A StreamIngestor reads normalized messages from a transport and keeps a MarketDataManager current:
+
+    {'type': 'trade', 'ts': ms, 'px': price, 'qty': quantity, 'seq': n}
+    {'type': 'depth', 'seq': last update id, 'first_seq': first update id, 'bids': [[px, sz]], 'asks': [[px, sz]]}
+    {'type': 'snapshot', 'seq': n, 'bids': [[px, sz]], 'asks': [[px, sz]]}
+
+seq and first_seq are optional, first_seq defaults to seq. Depth diffs are applied on top of a snapshot; a
+gap in their sequence drops the book back to buffering until a new snapshot arrives, a gap in the trade
+sequence refetches the exchange bars from the one the last trade fell in. Exchange specific messages are
+turned into these by the adapter passed to the ingestor.
+
+Transports only have to provide connect(), recv() (a message, or None at the end of the stream) and close().
+"""
+import json
+import socket
+import threading
+import time
+from datetime import datetime
+
+from metrics import default_registry
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# Depth diffs kept while waiting for a snapshot
+BOOK_BUFFER = 10000
+# Minimum seconds between two snapshot requests
+SNAPSHOT_INTERVAL = 1.0
+RECONNECT_DELAY = 1.0
+
+
+class ReplayTransport:
+    """Messages from a JSON lines file, or any iterable of dicts
+
+    With speed set, messages are paced by their ts field, speed 1 being real time.
+    """
+    def __init__(self, source, speed=None):
+        self.source = source
+        self.speed = speed
+        self.file = None
+        self.messages = None
+        self.first_ts = None
+        self.started = None
+
+    def connect(self):
+        if isinstance(self.source, str):
+            self.file = open(self.source)
+            self.messages = (json.loads(line) for line in self.file if line.strip())
+        else:
+            self.messages = iter(self.source)
+
+    def recv(self):
+        message = next(self.messages, None)
+        if message is None or self.speed is None or 'ts' not in message:
+            return message
+
+        now = time.perf_counter()
+        if self.first_ts is None:
+            self.first_ts = message['ts']
+            self.started = now
+        delay = (message['ts'] - self.first_ts) / 1000.0 / self.speed - (now - self.started)
+        if delay > 0:
+            time.sleep(delay)
+        return message
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SocketTransport:
+    """Newline delimited JSON messages over TCP"""
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def recv(self):
+        line = self.reader.readline()
+        while line and not line.strip():
+            line = self.reader.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+
+
+class WebSocketTransport:
+    """JSON messages from a websocket, needs the websocket-client package
+
+    subscriptions are sent once connected, decode turns a raw frame (e.g. gzip compressed) into text.
+    """
+    def __init__(self, url, subscriptions=(), decode=None, timeout=None):
+        self.url = url
+        self.subscriptions = subscriptions
+        self.decode = decode
+        self.timeout = timeout
+        self.ws = None
+
+    def connect(self):
+        if websocket is None:
+            raise ImportError('WebSocketTransport needs the websocket-client package')
+        self.ws = websocket.create_connection(self.url, timeout=self.timeout)
+        for subscription in self.subscriptions:
+            self.ws.send(json.dumps(subscription))
+
+    def recv(self):
+        try:
+            frame = self.ws.recv()
+        except websocket.WebSocketConnectionClosedException:
+            return None
+        if self.decode is not None:
+            frame = self.decode(frame)
+        return json.loads(frame)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+            self.ws = None
+
+
+class StreamIngestor:
+    """Applies a message stream to a MarketDataManager
+
+    snapshot_fn() returns a snapshot message and is called whenever the book needs one, otherwise the stream
+    is expected to send them. ohlcv_fn(since_ms) returns ccxt fetch_ohlcv rows and is called after a trade
+    sequence gap. Both are called without lock held, so a slow REST call never stalls readers. Trades also go
+    to aggregator (an aggregator.TradeAggregator) when set. Messages are applied under lock, hold it while
+    reading the manager from another thread.
+    """
+    def __init__(self, mdb, transport, snapshot_fn=None, adapter=None, metrics=None, bar_seconds=60,
+                 reconnect=False, snapshot_interval=SNAPSHOT_INTERVAL, aggregator=None, ohlcv_fn=None):
+        self.mdb = mdb
+        self.transport = transport
+        self.snapshot_fn = snapshot_fn
+        self.ohlcv_fn = ohlcv_fn
+        self.adapter = adapter
+        self.metrics = metrics if metrics is not None else default_registry
+        self.bar_seconds = bar_seconds
+        self.reconnect = reconnect
+        self.aggregator = aggregator
+        self.lock = threading.RLock()
+        self.book_synced = False
+        self.book_buffer = []
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_requested = None
+        # Set under lock by the gap checks, fetched by process() once it released lock
+        self.snapshot_wanted = False
+        self.resync_since = None
+        self.trade_seq = None
+        self.trade_ts = None
+        self.messages = 0
+        self.gaps = 0
+        self.running = False
+        self.thread = None
+
+    def process(self, message):
+        """Apply one normalized message, then fetch whatever a gap asked for. Call it without lock held"""
+        kind = message.get('type')
+        with self.lock, self.metrics.measure('stream.%s' % kind):
+            self.messages += 1
+            if kind == 'trade':
+                self._on_trade(message)
+            elif kind == 'depth':
+                self._on_depth(message)
+            elif kind == 'snapshot':
+                self._on_snapshot(message)
+        if self.snapshot_wanted or self.resync_since is not None:
+            self._resync()
+
+    def _gap(self, stream):
+        self.gaps += 1
+        self.metrics.endpoint('stream.%s' % stream).add_error('sequence_gap')
+
+    def _on_trade(self, message):
+        seq = message.get('seq')
+        if seq is not None:
+            if self.trade_seq is not None:
+                if seq <= self.trade_seq:
+                    return
+                if seq > self.trade_seq + 1:
+                    # Bars from the one of the last trade on miss the trades in between, fetch them again
+                    self._gap('trade')
+                    self.request_ohlcv(self.trade_ts)
+            self.trade_seq = seq
+        self.trade_ts = message['ts']
+        px = float(message['px'])
+        qty = float(message['qty'])
+        self.mdb.apply_trade(message['ts'] / 1000.0, px, qty, self.bar_seconds)
+        if self.aggregator is not None:
+            self.aggregator.add_trade(message['ts'], px, qty)
+
+    def _on_depth(self, message):
+        if not self.book_synced:
+            if len(self.book_buffer) >= BOOK_BUFFER:
+                del self.book_buffer[0]
+            self.book_buffer.append(message)
+            self.request_snapshot()
+            return
+        self._apply_depth(message)
+
+    def _apply_depth(self, message):
+        book = self.mdb.order_book
+        seq = message.get('seq')
+        if seq is not None and book.sequence is not None:
+            if seq <= book.sequence:
+                return
+            if message.get('first_seq', seq) > book.sequence + 1:
+                self._gap('depth')
+                self.book_synced = False
+                self.book_buffer = [message]
+                self.request_snapshot()
+                return
+        book.apply_diff(message.get('bids', ()), message.get('asks', ()), seq)
+        self._update_touch()
+
+    def _on_snapshot(self, message):
+        self.mdb.order_book.apply_snapshot(message.get('bids', ()), message.get('asks', ()), message.get('seq'))
+        self.book_synced = True
+        buffered = self.book_buffer
+        self.book_buffer = []
+        self._update_touch()
+        for diff in buffered:
+            if not self.book_synced:
+                # Gap inside the buffer, the rest waits for the next snapshot
+                self.book_buffer.append(diff)
+            else:
+                self._apply_depth(diff)
+
+    def _update_touch(self):
+        self.mdb.best_bid = self.mdb.order_book.get_best_bid()
+        self.mdb.best_ask = self.mdb.order_book.get_best_ask()
+
+    def request_snapshot(self):
+        """Ask for a book snapshot, at most one per snapshot_interval"""
+        now = time.monotonic()
+        if self.snapshot_fn is None:
+            return
+        if self.snapshot_requested is not None and now - self.snapshot_requested < self.snapshot_interval:
+            return
+        self.snapshot_requested = now
+        self.snapshot_wanted = True
+
+    def request_ohlcv(self, since_ts):
+        """Ask for the exchange bars from the one holding since_ts (ms) on"""
+        if self.ohlcv_fn is None or since_ts is None:
+            return
+        since = since_ts - since_ts % (self.bar_seconds * 1000)
+        if self.resync_since is None or since < self.resync_since:
+            self.resync_since = since
+
+    def _fetch(self, name, fn, *args):
+        try:
+            with self.metrics.measure(name):
+                return fn(*args)
+        except Exception as e:
+            print(datetime.now(), 'Unable to get', name, e)
+            return None
+
+    def _resync(self):
+        # Called without lock held, only the merge of what was fetched takes it
+        if self.snapshot_wanted:
+            self.snapshot_wanted = False
+            snapshot = self._fetch('stream.snapshot', self.snapshot_fn)
+            if snapshot is not None:
+                with self.lock:
+                    self._on_snapshot(snapshot)
+        since = self.resync_since
+        if since is not None:
+            self.resync_since = None
+            rows = self._fetch('stream.ohlcv', self.ohlcv_fn, since)
+            if rows is not None:
+                with self.lock:
+                    self.mdb.sync_ohlcv(rows, rewrite=True)
+
+    def run(self):
+        """Read the transport until it ends (or for ever with reconnect), returns the number of messages"""
+        self.running = True
+        while self.running:
+            try:
+                self.transport.connect()
+                while self.running:
+                    raw = self.transport.recv()
+                    if raw is None:
+                        break
+                    for message in (self.adapter(raw) if self.adapter is not None else (raw,)):
+                        self.process(message)
+            except Exception as e:
+                print(datetime.now(), 'market data stream error', e)
+            finally:
+                self.transport.close()
+
+            if not self.reconnect:
+                break
+            # Diffs were lost while disconnected
+            with self.lock:
+                self.book_synced = False
+                self.book_buffer = []
+            time.sleep(RECONNECT_DELAY)
+        self.running = False
+        return self.messages
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='market-data-stream')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.transport.close()
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from async_ordermanager import AsyncOrderManager
+from cybexapi_connector import CybexException
+from ordermanager import OrderStatus
+from conftest import FakeApiServer, FakeSigner
+from test_ordermanager import make_order, order_record
+
+
+class AsyncFake:
+    """Awaitable version of a conftest fake"""
+    def __init__(self, fake, orders=()):
+        self.fake = fake
+        self.orders = list(orders)
+
+    def __getattr__(self, name):
+        method = getattr(self.fake, name)
+
+        async def call(*args):
+            return method(*args)
+        return call
+
+    async def get_orders(self, account):
+        return self.orders
+
+
+def make_manager(**kwargs):
+    signer, api_server = FakeSigner(), FakeApiServer()
+    return AsyncOrderManager('test', 'ETH/USDT', signer=signer, api_server=api_server,
+                             async_signer=AsyncFake(signer), async_api_server=AsyncFake(api_server), **kwargs)
+
+
+def test_options_reach_order_manager():
+    om = make_manager(delta_sync=True, order_ttl=7, collapse_cancels=True)
+    assert om.delta_sync and om.order_ttl == 7 and om.collapse_cancels
+
+
+def test_update_orders_goes_through_apply_orders():
+    om = make_manager(delta_sync=True)
+    order = make_order('a', 'buy')
+    order.order_sequence = 1
+    om.add_order(order)
+    om.async_api_server.orders = [order_record(order, OrderStatus.Filled, 1.0, 100.0)]
+    asyncio.run(om.update_orders_async())
+    assert 'a' not in om.orders and om.position == 1.0
+    assert om.sequence_cursor == 1
+
+
+def test_pending_orders_stop_the_async_signal(book):
+    om = make_manager()
+    om.add_order(make_order('a', 'buy', status=None))
+    om.add_order(make_order('b', 'buy', status=None))
+    with pytest.raises(CybexException):
+        asyncio.run(om.handle_signal_async(1, book))
+    assert om.signer.calls == []
+
+
+def test_async_signal_sends_the_difference(book):
+    om = make_manager()
+    assert asyncio.run(om.handle_signal_async(1, book)) is True
+    assert om.open_quantity('buy') == om.size and om.reserved_orders == 0
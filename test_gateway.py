@@ -0,0 +1,77 @@
+import threading
+import time
+
+from gateway import OrderGateway, OrderIntent
+from metrics import MetricsRegistry
+
+
+class RecordingManager:
+    """Stands in for OrderManager, handle_signal blocks until release is set"""
+    def __init__(self):
+        self.signals = []
+        self.orders = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def handle_signal(self, signal, orderbook):
+        self.release.wait(5)
+        self.signals.append(signal)
+        return True
+
+    def buy(self, price, quantity):
+        self.orders.append(('buy', price, quantity))
+
+    def cancel_orders(self, trx_ids):
+        raise RuntimeError('down')
+
+
+def test_newer_target_replaces_queued_one():
+    gateway = OrderGateway(RecordingManager(), None, metrics=MetricsRegistry())
+    done = []
+    assert gateway.submit_target(1)
+    assert gateway.submit_target(-1)
+    assert gateway.submit_target(0, done.append)
+    assert len(gateway) == 1 and gateway.coalesced == 2 and gateway.target_busy()
+    gateway.start()
+    gateway.stop(5)
+    assert gateway.om.signals == [0]
+    assert [intent.signal for intent in done] == [0]
+    assert not gateway.target_busy()
+
+
+def test_target_running_is_not_replaced():
+    om = RecordingManager()
+    om.release.clear()
+    gateway = OrderGateway(om, None, metrics=MetricsRegistry())
+    gateway.start()
+    gateway.submit_target(1)
+    deadline = time.monotonic() + 5
+    while gateway.pending_target is not None and time.monotonic() < deadline:
+        time.sleep(0.001)
+    # The first target is being handled, the next one queues behind it
+    gateway.submit_target(-1)
+    gateway.submit_target(0)
+    om.release.set()
+    gateway.stop(5)
+    assert om.signals == [1, 0]
+
+
+def test_full_queue_drops():
+    gateway = OrderGateway(RecordingManager(), None, max_pending=2, metrics=MetricsRegistry())
+    assert gateway.submit_order('buy', 100, 1)
+    assert gateway.submit_order('buy', 101, 1)
+    assert not gateway.submit_order('buy', 102, 1)
+    assert not gateway.submit(OrderIntent('buy', price=103, quantity=1), block=True, timeout=0.01)
+    assert gateway.dropped == 2
+    gateway.start()
+    gateway.stop(5)
+    assert gateway.om.orders == [('buy', 100, 1), ('buy', 101, 1)]
+
+
+def test_errors_reach_on_done():
+    gateway = OrderGateway(RecordingManager(), None, metrics=MetricsRegistry())
+    done = []
+    gateway.submit(OrderIntent('cancel', trx_ids=['a'], on_done=done.append))
+    gateway.start()
+    gateway.stop(5)
+    assert isinstance(done[0].error, RuntimeError) and done[0].result is None
@@ -0,0 +1,63 @@
+from orderarchive import OrderArchive
+from ordermanager import OrderStatus
+from test_ordermanager import make_order
+
+STATUS_BY_VALUE = {status.value: status for status in OrderStatus}
+
+
+def filled_order(i):
+    order = make_order('trx%d' % i, 'buy' if i % 2 else 'sell', 1.0, 100.0 + i, OrderStatus.Filled)
+    order.filled = 1.0
+    order.avg_price = 100.0 + i
+    order.order_sequence = i
+    return order
+
+
+def test_lookup_resident_and_spilled(tmp_path):
+    archive = OrderArchive(str(tmp_path / 'orders.bin'), chunk_size=8, resident_chunks=2,
+                           status_by_value=STATUS_BY_VALUE)
+    for i in range(100):
+        archive.add(filled_order(i))
+    assert len(archive) == 100 and archive.dropped == 0
+    assert len(archive.chunks) <= 2
+    for i in (0, 7, 8, 50, 95, 99):
+        found = archive.get('trx%d' % i)
+        assert found.trx_id == 'trx%d' % i and found.price == 100.0 + i
+        assert found.order_status == OrderStatus.Filled and found.order_sequence == i
+    assert archive.get('missing') is None and 'missing' not in archive
+    assert archive.total_buy == 50 and archive.total_sell == 50
+
+
+def test_dropped_without_spill_file():
+    archive = OrderArchive(chunk_size=8, resident_chunks=2, status_by_value=STATUS_BY_VALUE)
+    for i in range(100):
+        archive.add(filled_order(i))
+    assert len(archive.chunks) <= 2
+    # One full chunk and the one being filled stay resident
+    assert archive.dropped == 88
+    assert archive.get('trx87') is None
+    assert archive.get('trx88').trx_id == 'trx88'
+    assert archive.get('trx99').trx_id == 'trx99'
+    # Fills of dropped orders stay in the totals
+    assert archive.total_buy + archive.total_sell == 100
+
+
+def test_reopen_spill_file(tmp_path):
+    path = str(tmp_path / 'orders.bin')
+    archive = OrderArchive(path, chunk_size=8, status_by_value=STATUS_BY_VALUE)
+    for i in range(20):
+        archive.add(filled_order(i))
+    archive.flush()
+    archive.add(filled_order(20))
+    archive.close()
+    reopened = OrderArchive(path, chunk_size=8, status_by_value=STATUS_BY_VALUE)
+    # The chunk being filled reached the file too, each row once
+    assert len(reopened) == 21
+    assert reopened.get('trx3').avg_price == 103.0
+    assert reopened.get('trx17').avg_price == 117.0
+    assert reopened.get('trx20').order_sequence == 20
+    assert reopened.total_buy == 0
+    for i in range(21, 30):
+        reopened.add(filled_order(i))
+    reopened.close()
+    assert len(OrderArchive(path, chunk_size=8, status_by_value=STATUS_BY_VALUE)) == 30
@@ -0,0 +1,173 @@
+import random
+
+from ordermanager import Order, OrderManager, OrderStatus, ORDER_STATUS_BY_NAME, TERMINAL_STATUSES
+from conftest import FakeApiServer, FakeSigner
+
+API_STATUS_NAMES = {status: name for name, status in ORDER_STATUS_BY_NAME.items()}
+
+
+def make_order(trx_id, side, quantity=1.0, price=100.0, status=OrderStatus.New):
+    order = Order()
+    order.trx_id = trx_id
+    order.side = side
+    order.quantity = quantity
+    order.price = price
+    order.order_status = status
+    return order
+
+
+def order_record(order, status, filled, avg_price):
+    return {'transactionId': order.trx_id, 'orderStatus': API_STATUS_NAMES[status],
+            'orderSequence': order.order_sequence, 'filledQuantity': filled, 'averagePrice': avg_price,
+            'quantity': order.quantity, 'remark': 'test'}
+
+
+def random_walk(om, rnd, steps):
+    sent = []
+    for step in range(steps):
+        action = rnd.random()
+        live = list(om.live_orders.values())
+        if action < 0.3 or not live:
+            status = rnd.choice([None, OrderStatus.PendingNew, OrderStatus.New])
+            order = make_order('o%d' % step, rnd.choice(['buy', 'sell']), round(rnd.uniform(0.1, 2), 2),
+                               round(rnd.uniform(90, 110), 2), status)
+            order.order_sequence = step + 1
+            om.add_order(order)
+            sent.append(order)
+        elif action < 0.8:
+            order = rnd.choice(live)
+            filled = min(order.quantity, round(order.filled + rnd.uniform(0, order.quantity), 2))
+            status = OrderStatus.Filled if filled >= order.quantity else \
+                rnd.choice([OrderStatus.New, OrderStatus.PendingCancel])
+            om.apply_orders([order_record(order, status, filled, order.price)])
+        elif action < 0.9:
+            order = rnd.choice(live)
+            status = rnd.choice([OrderStatus.Canceled, OrderStatus.Rejected])
+            om.apply_orders([order_record(order, status, order.filled, order.price)])
+        else:
+            om.remove_order(rnd.choice(live).trx_id)
+    return sent
+
+
+def test_incremental_totals_match_full_scan():
+    for seed in range(5):
+        om = OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer())
+        random_walk(om, random.Random(seed), 2000)
+        assert om.check_consistency() == []
+        assert om.position == om.total_buy - om.total_sell
+
+
+def test_delta_sync_totals_match_full_scan():
+    om = OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer(), delta_sync=True)
+    random_walk(om, random.Random(7), 2000)
+    assert om.check_consistency() == []
+
+
+def test_terminal_orders_move_to_the_archive(om):
+    order = make_order('a', 'buy', 1.0)
+    om.add_order(order)
+    om.apply_orders([order_record(order, OrderStatus.Filled, 1.0, 100.0)])
+    assert 'a' not in om.orders and 'a' not in om.live_orders
+    archived = om.find_order('a')
+    assert archived.order_status == OrderStatus.Filled and archived.filled == 1.0
+    assert om.position == 1.0 and om.check_consistency() == []
+
+
+def test_only_expired_orders_are_returned(om):
+    clock = om.expiry.clock()
+    om.add_order(make_order('short', 'buy'), ttl=5)
+    om.add_order(make_order('long', 'sell'), ttl=50)
+    om.add_order(make_order('unacked', 'buy', status=None), ttl=5)
+    assert om.expired_orders(clock + 1) == []
+    assert [order.trx_id for order in om.expired_orders(clock + 6)] == ['short']
+    # Retried after expiry_retry, unless the cancel is in flight
+    om.set_order_state(om.orders['short'], OrderStatus.PendingCancel)
+    om.set_order_state(om.orders['unacked'], OrderStatus.New)
+    retried = [order.trx_id for order in om.expired_orders(clock + 6 + om.expiry_retry)]
+    assert retried == ['unacked']
+
+
+def test_archived_orders_leave_the_expiry_heap(om):
+    order = make_order('a', 'buy')
+    om.add_order(order, ttl=5)
+    om.apply_orders([order_record(order, OrderStatus.Canceled, 0, 0)])
+    assert 'a' not in om.expiry
+    assert om.expired_orders(om.expiry.clock() + 10) == []
+
+
+def test_cancel_old_orders_marks_pending_cancel(om):
+    om.add_order(make_order('a', 'buy'), ttl=0)
+    om.cancel_old_orders()
+    assert om.orders['a'].order_status == OrderStatus.PendingCancel
+    assert om.signer.calls == [('cancel', 'a')]
+
+
+def test_cancel_orders_reports_each_order(om):
+    for trx_id in ('a', 'b', 'c'):
+        om.add_order(make_order(trx_id, 'buy'))
+    om.api_server.fail.add('b')
+    result = om.cancel_orders(['a', 'b'])
+    assert not result.collapsed
+    assert list(result.failed()) == ['b']
+    assert om.orders['a'].order_status == OrderStatus.PendingCancel
+    assert om.orders['b'].order_status == OrderStatus.New
+    assert result.elapsed >= 0
+
+
+def test_cancel_all_collapse_is_opt_in(om):
+    for trx_id in ('a', 'b'):
+        om.add_order(make_order(trx_id, 'buy'))
+    result = om.cancel_orders(['a', 'b'])
+    assert not result.collapsed
+    assert ('cancel_all', 'ETH/USDT') not in om.signer.calls
+
+
+def test_cancel_all_collapse_needs_every_live_order():
+    om = OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer(), collapse_cancels=True)
+    for trx_id in ('a', 'b', 'c'):
+        om.add_order(make_order(trx_id, 'buy'))
+    assert not om.cancel_orders(['a', 'b']).collapsed
+    result = om.cancel_orders(['a', 'b', 'c'])
+    assert result.collapsed
+    assert om.signer.calls[-1] == ('cancel_all', 'ETH/USDT')
+    assert all(order.order_status == OrderStatus.PendingCancel for order in om.live_orders.values())
+
+
+def test_unacknowledged_orders_count_as_open(om):
+    om.add_order(make_order('a', 'buy', 0.7, status=None))
+    assert om.buy_open == 0 and om.open_quantity('buy') == 0.7
+    om.set_order_state(om.orders['a'], OrderStatus.New)
+    assert om.buy_open == 0.7 and om.buy_unacked == 0 and om.open_quantity('buy') == 0.7
+
+
+def test_order_is_recorded_before_it_is_sent(om):
+    seen = []
+    send = om.api_server.send_transaction
+
+    def send_and_look(data):
+        seen.append((data['transactionId'] in om.orders, om.open_quantity('buy'), om.reserved_orders))
+        return send(data)
+
+    om.api_server.send_transaction = send_and_look
+    om.buy(100.0, 0.5)
+    assert seen == [(True, 0.5, 0)]
+
+
+def test_failed_send_leaves_no_order(om):
+    def refuse(data):
+        raise RuntimeError('down')
+
+    om.api_server.send_transaction = refuse
+    try:
+        om.sell(100.0, 0.5)
+    except RuntimeError:
+        pass
+    assert om.orders == {} and om.open_quantity('sell') == 0 and om.reserved_orders == 0
+
+
+def test_handle_signal_counts_in_flight_orders(om, book):
+    assert om.handle_signal(1, book) is True
+    # The first order has no status yet, a second signal must not buy again
+    assert om.handle_signal(1, book) is None
+    assert [call[0] for call in om.signer.calls] == ['order']
+    assert all(order.order_status not in TERMINAL_STATUSES for order in om.orders.values())
@@ -0,0 +1,106 @@
+import pytest
+
+from ordermanager import OrderManager
+from risk import CybexRiskException, RiskEngine, limits_from_config
+from conftest import FakeApiServer, FakeSigner
+from test_ordermanager import make_order
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def refused_by(engine, om, side, price, quantity):
+    with pytest.raises(CybexRiskException) as info:
+        engine.check(om, side, price, quantity)
+    return info.value.rule
+
+
+def test_order_notional(om):
+    engine = RiskEngine(max_order_notional=100)
+    engine.check(om, 'buy', 100, 1)
+    assert refused_by(engine, om, 'buy', 100, 1.01) == 'max_order_notional'
+    assert engine.rejected['max_order_notional'] == 1 and engine.passed == 1
+
+
+def test_open_orders_include_unacknowledged(om):
+    engine = RiskEngine(max_open_orders=2)
+    om.add_order(make_order('a', 'buy'))
+    engine.check(om, 'buy', 100, 1)
+    om.add_order(make_order('b', 'sell', status=None))
+    assert refused_by(engine, om, 'buy', 100, 1) == 'max_open_orders'
+
+
+def test_position_counts_open_orders_on_the_same_side(om):
+    engine = RiskEngine(max_position=2)
+    om.add_order(make_order('a', 'buy', 1.5, status=None))
+    engine.check(om, 'buy', 100, 0.5)
+    assert refused_by(engine, om, 'buy', 100, 0.6) == 'max_position'
+    # Open buys do not offset a sell
+    engine.check(om, 'sell', 100, 2)
+    assert refused_by(engine, om, 'sell', 100, 2.1) == 'max_position'
+
+
+def test_position_counts_reserved_orders():
+    om = OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer(),
+                      risk=RiskEngine(max_position=1))
+    with om.lock:
+        om._reserve('buy', 100, 1)
+        assert refused_by(om.risk, om, 'buy', 100, 0.1) == 'max_position'
+        om._release('buy', 1)
+    om.risk.check(om, 'buy', 100, 1)
+
+
+def test_price_band(om, book):
+    engine = RiskEngine(price_band=0.05, orderbook=book)
+    engine.check(om, 'buy', 104, 1)
+    assert refused_by(engine, om, 'buy', 106, 1) == 'price_band'
+    assert refused_by(engine, om, 'sell', 94, 1) == 'price_band'
+
+
+def test_price_band_skipped_on_empty_book(om):
+    from l2book import L2OrderBook
+    RiskEngine(price_band=0.05, orderbook=L2OrderBook()).check(om, 'buy', 1e6, 1)
+
+
+def test_orders_per_second(om):
+    clock = FakeClock()
+    engine = RiskEngine(max_orders_per_second=3, clock=clock)
+    for i in range(3):
+        engine.check(om, 'buy', 100, 1)
+        clock.now += 0.1
+    assert refused_by(engine, om, 'buy', 100, 1) == 'max_orders_per_second'
+    # Only the first order left the window
+    clock.now += 0.75
+    engine.check(om, 'buy', 100, 1)
+    assert len(engine.recent) == 3
+    assert refused_by(engine, om, 'buy', 100, 1) == 'max_orders_per_second'
+
+
+def test_kill_switch(om):
+    engine = RiskEngine()
+    engine.kill('test')
+    assert refused_by(engine, om, 'buy', 100, 1) == 'kill_switch'
+    engine.resume()
+    engine.check(om, 'buy', 100, 1)
+
+
+def test_refused_order_is_not_sent():
+    om = OrderManager('test', 'ETH/USDT', signer=FakeSigner(), api_server=FakeApiServer(),
+                      risk=RiskEngine(max_order_notional=10))
+    with pytest.raises(CybexRiskException):
+        om.buy(100, 1)
+    assert om.signer.calls == [] and om.api_server.sent == [] and om.reserved_orders == 0
+
+
+def test_limits_from_config():
+    assert limits_from_config({'max_position': '5', 'price_band': '0.02'}) == {'max_position': 5.0,
+                                                                             'price_band': 0.02}
+    with pytest.raises(ValueError, match='max_positon'):
+        limits_from_config({'max_positon': '5'})
+    with pytest.raises(ValueError, match='not a number'):
+        limits_from_config({'max_position': 'five'})
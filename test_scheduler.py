@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from metrics import MetricsRegistry
+from scheduler import PRIORITY_CANCEL, PRIORITY_MARKET_DATA, RequestScheduler
+
+
+def test_cancels_run_first():
+    scheduler = RequestScheduler(workers=1, metrics=MetricsRegistry())
+    gate = threading.Event()
+    order = []
+    scheduler.submit(gate.wait)
+    reads = [scheduler.submit(lambda: order.append('read'), PRIORITY_MARKET_DATA) for _ in range(3)]
+    cancel = scheduler.submit(lambda: order.append('cancel'), PRIORITY_CANCEL)
+    gate.set()
+    cancel.result(5)
+    for read in reads:
+        read.result(5)
+    assert order[0] == 'cancel'
+    scheduler.shutdown()
+
+
+def test_identical_reads_share_one_request():
+    scheduler = RequestScheduler(workers=1, metrics=MetricsRegistry())
+    gate = threading.Event()
+    scheduler.submit(gate.wait)
+    first = scheduler.submit(lambda: 1, coalesce_key='book')
+    second = scheduler.submit(lambda: 2, coalesce_key='book')
+    gate.set()
+    assert first is second and second.result(5) == 1 and scheduler.coalesced == 1
+    scheduler.shutdown()
+
+
+def test_shutdown_cancels_queued_requests():
+    scheduler = RequestScheduler(workers=1, metrics=MetricsRegistry())
+    gate = threading.Event()
+    started = threading.Event()
+    running = scheduler.submit(lambda: started.set() or gate.wait())
+    started.wait(5)
+    queued = scheduler.submit(lambda: 'never', coalesce_key='book')
+    stopper = threading.Thread(target=scheduler.shutdown)
+    stopper.start()
+    with pytest.raises(CancelledError):
+        queued.result(5)
+    gate.set()
+    stopper.join(5)
+    assert running.result(5) is True
+    with pytest.raises(RuntimeError):
+        scheduler.call(lambda: 'late')
@@ -0,0 +1,55 @@
+import threading
+
+from ordermanager import MarketDataManager
+from streaming import ReplayTransport, StreamIngestor
+
+
+def lock_free(lock):
+    # From another thread, an RLock held by this one cannot be taken
+    free = []
+
+    def probe():
+        if lock.acquire(blocking=False):
+            lock.release()
+            free.append(True)
+    thread = threading.Thread(target=probe)
+    thread.start()
+    thread.join()
+    return bool(free)
+
+
+def test_snapshot_is_fetched_without_the_lock():
+    mdb = MarketDataManager()
+    held = []
+
+    def snapshot():
+        held.append(not lock_free(ingestor.lock))
+        return {'type': 'snapshot', 'seq': 1, 'bids': [[99.0, 1.0]], 'asks': [[101.0, 1.0]]}
+
+    feed = [{'type': 'depth', 'seq': 2, 'bids': [[99.5, 1.0]], 'asks': []},
+            {'type': 'depth', 'seq': 3, 'bids': [], 'asks': [[100.5, 1.0]]}]
+    ingestor = StreamIngestor(mdb, ReplayTransport(feed), snapshot_fn=snapshot, snapshot_interval=0)
+    ingestor.run()
+    assert held == [False]
+    assert mdb.order_book.get_best_bid() == 99.5 and mdb.order_book.get_best_ask() == 100.5
+
+
+def test_trade_gap_refetches_bars():
+    mdb = MarketDataManager()
+    fetched = []
+
+    def ohlcv(since):
+        fetched.append((since, not lock_free(ingestor.lock)))
+        # The exchange saw the missed trades at 97 and 103
+        return [[60000, 100.0, 103.0, 97.0, 101.0, 5.0], [120000, 101.0, 102.0, 101.0, 102.0, 2.0]]
+
+    feed = [{'type': 'trade', 'ts': 60500, 'px': 100.0, 'qty': 1.0, 'seq': 1},
+            {'type': 'trade', 'ts': 61000, 'px': 100.0, 'qty': 1.0, 'seq': 2},
+            {'type': 'trade', 'ts': 120500, 'px': 102.0, 'qty': 1.0, 'seq': 9}]
+    ingestor = StreamIngestor(mdb, ReplayTransport(feed), ohlcv_fn=ohlcv)
+    ingestor.run()
+    assert fetched == [(60000, False)]
+    assert ingestor.gaps == 1
+    bar = mdb.bars[0]
+    assert (bar.px_high, bar.px_low, bar.px_close, bar.volume) == (103.0, 97.0, 101.0, 5.0)
+    assert mdb.bars[1].px_close == 102.0 and mdb.get_bar_count() == 2